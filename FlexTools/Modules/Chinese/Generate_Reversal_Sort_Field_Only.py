@@ -55,8 +55,10 @@ by stroke count, and finally by stroke order. This follows the ordering in
 See Chinese Utilities Help.pdf for detailed information on configuration and usage.
 """ }
 
-from ChineseUtilities import ChineseParser
-from ChineseUtilities import SortStringDB, ChineseWritingSystems
+from ChineseUtilities import SharedChineseParser, ChineseProcessPool
+from ChineseUtilities import SharedSortStringDB, ChineseWritingSystems
+from ChineseUtilities import ChangeTracker
+import datafiles
 
 #----------------------------------------------------------------
 # Configurables:
@@ -83,6 +85,19 @@ HACK_FIRST_WORD_IGNORE_TONE = 2
                  
 HACK_LEVEL = 0
 
+# For very large reversal indexes, the tone numbers can be calculated in
+# this many worker processes on a multi-core computer. 0 calculates them
+# in the FlexTools process.
+
+PROCESSES = 0
+
+# Set INCREMENTAL to True to skip the reversal entries that haven't
+# changed since the last run of this module on the project.
+# Everything is checked again if the dictionary, the sort data or
+# HACK_LEVEL change.
+
+INCREMENTAL = False
+
 
 #----------------------------------------------------------------
 import chin_utils
@@ -152,19 +167,43 @@ UpdatedTonenums = 0
 UpdatedSortStrings = 0
 HackedSortStrings = 0
 
-def GenerateReversalSortFields(project, report, modifyAllowed=False):
+def GenerateReversalSortFields(project, report, modifyAllowed, writeBuffer):
 
-    def __WriteReversalTonenumAndSortString(entry):
-        global UpdatedTonenums
-        global UpdatedSortStrings
-        global HackedSortStrings
-        
+    # The fields are read first, then the tone numbers are calculated
+    # together (Parser.CalculateTonenumBatch), then the sort strings are
+    # calculated together (SortDB.CalculateSortStringBatch), and finally
+    # the tone numbers and sort strings are written.
+
+    def __ReadReversalTonenumAndSortString(entry, fields):
         hz = project.ReversalGetForm(entry, ChineseWS)
         tn = project.ReversalGetForm(entry, ChineseTonenumWS)
         ss = project.ReversalGetForm(entry, ChineseSortWS)
+        if not Tracker.Unchanged(entry.Guid, hz, tn, ss):
+            fields.append(((entry, hz, tn, ss), hz, tn))
+
+    def __SortStringFields(entry, hz, tn, ss, newTonenum, msg, sortFields):
+        # The sort string is calculated from the new tone number, and
+        # hacked if necessary.
+        sort_hz = hz
+        sort_tn = tn if newTonenum is None else newTonenum
+        hacked = False
+        if HACK_LEVEL:
+            hacked_hz, hacked_tn = HACK_Tonenum(sort_hz, sort_tn)
+            if sort_tn != hacked_tn:
+                hacked = True
+                sort_hz = hacked_hz
+                sort_tn = hacked_tn
+        sortFields.append(((entry, hz, tn, ss, newTonenum, msg, hacked, sort_hz, sort_tn),
+                           sort_hz, sort_tn, ss))
+
+    def __WriteReversalTonenumAndSortString(entry, hz, tn, ss, newTonenum, msg, hacked,
+                                            sort_hz, sort_tn,
+                                            newSortString, sortMsg):
+        global UpdatedTonenums
+        global UpdatedSortStrings
+        global HackedSortStrings
         
         # Tone number
-        newTonenum, msg = Parser.CalculateTonenum(hz, tn)
         if msg:
             report.Warning("    %s" % msg,
                            project.BuildGotoURL(entry))
@@ -172,34 +211,35 @@ def GenerateReversalSortFields(project, report, modifyAllowed=False):
             report.Info(("    Updating %s > %s" if modifyAllowed else
                          "    %s needs updating > %s") \
                          % (hz, newTonenum))
-            if modifyAllowed:
-                project.ReversalSetForm(entry, newTonenum, ChineseTonenumWS)
+            writeBuffer.SetReversalForm(entry, newTonenum, ChineseTonenumWS)
             UpdatedTonenums += 1
-            tn = newTonenum
                 
-        if HACK_LEVEL:
-            hacked_hz, hacked_tn = HACK_Tonenum(hz, tn)
-            if tn != hacked_tn:
-                HackedSortStrings += 1
-                report.Warning("    Hacked %s" % hz,
-                               project.BuildGotoURL(entry))
-                hz = hacked_hz
-                tn = hacked_tn
-
+        if hacked:
+            HackedSortStrings += 1
+            report.Warning("    Hacked %s" % hz,
+                           project.BuildGotoURL(entry))
 
         # Sort string
-        newSortString, msg = SortDB.CalculateSortString(hz, tn, ss)
-        if msg:
-            report.Warning("    %s: %s" % (hz, msg),
+        if sortMsg:
+            report.Warning("    %s: %s" % (sort_hz, sortMsg),
                            project.BuildGotoURL(entry))
 
         if newSortString is not None:
             report.Info(("    Updating %s: (%s + %s) > %s" if modifyAllowed else
                          "    %s needs updating: (%s + %s) > %s") \
-                         % (hz, hz, tn, newSortString))
-            if modifyAllowed:
-                project.ReversalSetForm(entry, newSortString, ChineseSortWS)
+                         % (sort_hz, sort_hz, sort_tn, newSortString))
+            writeBuffer.SetReversalForm(entry, newSortString, ChineseSortWS)
             UpdatedSortStrings += 1
+
+        # Entries with warnings, or changes not yet written, are
+        # reported again next time.
+        if not (msg or sortMsg or hacked):
+            if newTonenum is None and newSortString is None:
+                Tracker.Record(entry.Guid, hz, tn, ss)
+            elif modifyAllowed:
+                Tracker.Record(entry.Guid, hz,
+                               tn if newTonenum is None else newTonenum,
+                               ss if newSortString is None else newSortString)
                 
         # (Subentries don't need the sort string)
 
@@ -216,17 +256,39 @@ def GenerateReversalSortFields(project, report, modifyAllowed=False):
         report.Info("    Tone number Pinyin: %s" % project.WSUIName(ChineseTonenumWS))
         report.Info("    Chinese sort field: %s" % project.WSUIName(ChineseSortWS))
 
-    Parser = ChineseParser()       
-    SortDB = SortStringDB()
+    # Standard maximal match parsing (not lattice mode), as in
+    # Update_Tonenumber_Fields' default, whatever other modules use.
+    Parser = SharedChineseParser(latticeParses=0)
+    SortDB = SharedSortStringDB()
+    Tracker = ChangeTracker(project, "Generate_Reversal_Sort_Field_Only",
+                            [datafiles.DictDB, datafiles.SortPickle],
+                            {"version"       : docs[FTM_Version],
+                             "hackLevel"     : HACK_LEVEL,
+                             "latticeParses" : 0},
+                            enabled=INCREMENTAL)
 
     index = project.ReversalIndex(ChineseWS)
     if index:
         report.ProgressStart(index.AllEntries.Count)
         report.Info("Updating sort strings for '%s' reversal index"
                     % project.WSUIName(ChineseWS))
+        fields = []
         for entryNumber, entry in enumerate(project.ReversalEntries(ChineseWS)):
             report.ProgressUpdate(entryNumber)
-            __WriteReversalTonenumAndSortString(entry)
+            __ReadReversalTonenumAndSortString(entry, fields)
+
+        if PROCESSES:
+            with ChineseProcessPool(PROCESSES, latticeParses=0) as pool:
+                results = list(pool.CalculateTonenumBatch(fields))
+        else:
+            results = Parser.CalculateTonenumBatch(fields)
+
+        sortFields = []
+        for (entry, hz, tn, ss), newTonenum, msg in results:
+            __SortStringFields(entry, hz, tn, ss, newTonenum, msg, sortFields)
+
+        for key, newSortString, sortMsg in SortDB.CalculateSortStringBatch(sortFields):
+            __WriteReversalTonenumAndSortString(*key, newSortString, sortMsg)
     
     report.Info(("  %d %s updated" if modifyAllowed else
                  "  %d %s to update") \
@@ -238,6 +300,10 @@ def GenerateReversalSortFields(project, report, modifyAllowed=False):
     if HACK_LEVEL:
         report.Info("  %d %s hacked" \
                  % (HackedSortStrings, "sort string" if (HackedSortStrings==1) else "sort strings"))
+    if INCREMENTAL:
+        report.Info("  %d unchanged %s skipped"
+                    % (Tracker.Skipped, "entry" if (Tracker.Skipped==1) else "entries"))
+    Tracker.Save()
 
 #----------------------------------------------------------------
 
@@ -11,8 +11,18 @@
 
 import codecs
 import re
+import unicodedata
 
 import os, sys
+import json
+import hashlib
+import multiprocessing
+from collections import OrderedDict
+from collections.abc import Mapping
+from concurrent.futures import ProcessPoolExecutor
+
+import logging
+logger = logging.getLogger(__name__)
 
 import datafiles
 from chin_utils import *
@@ -65,11 +75,121 @@ class ChineseDB(list):
         self.extend(get_tonenum_dict(fname))
 
 
+class LRUCache(OrderedDict):
+    # A dictionary that holds at most maxSize items, discarding the
+    # least recently used.
+
+    def __init__(self, maxSize):
+        OrderedDict.__init__(self)
+        self.MaxSize = maxSize
+        self.Evictions = 0
+
+    def __getitem__(self, key):
+        value = OrderedDict.__getitem__(self, key)
+        self.move_to_end(key)
+        return value
+
+    def __setitem__(self, key, value):
+        OrderedDict.__setitem__(self, key, value)
+        self.move_to_end(key)
+        if len(self) > self.MaxSize:
+            self.popitem(last=False)
+            self.Evictions += 1
+
+
 class ChineseParser(object):
-    def __init__(self, fname=datafiles.DictDB):
-        self.segmenter = init_chin_sgmtr([fname])
+    # cacheSize: if non-zero, the parses of this many Hanzi strings are
+    # kept (least recently used are discarded) so that repeated Hanzi
+    # aren't parsed again. See SetCacheSize() and CacheStatistics().
+    # latticeParses: if non-zero, use lattice mode. See SetLatticeMode().
+
+    def __init__(self, fname=datafiles.DictDB, cacheSize=0, latticeParses=0):
+        self.segmenter = datafiles.loadSegmenter(fname)
+        self.LatticeParses = latticeParses
+        self.SetCacheSize(cacheSize)
+
+    def SetLatticeMode(self, latticeParses):
+        # By default the Hanzi is parsed with forward and backward maximal
+        # matching, and it is ambiguous if they differ.
+        # In lattice mode (latticeParses > 0), all the segmentations are
+        # considered together (segmenter.best_segmentations()), and every
+        # segmentation with the fewest words is an alternative, up to
+        # latticeParses of them.
+        # The parse cache is cleared if the mode changes.
+        if latticeParses != self.LatticeParses:
+            self.LatticeParses = latticeParses
+            if self._cache is not None:
+                self._cache.clear()
+
+    def SetCacheSize(self, cacheSize):
+        # Set the size of the parse cache (0 to disable). The cache
+        # is cleared if the size changes.
+        if getattr(self, "_cache", None) is not None and \
+           self._cache.MaxSize == cacheSize:
+            return
+        self._cache = LRUCache(cacheSize) if cacheSize else None
+        self.ResetCacheStatistics()
+
+    def ResetCacheStatistics(self):
+        self.CacheHits = self.CacheMisses = 0
+        if self._cache is not None:
+            self._cache.Evictions = 0
+
+    def CacheStatistics(self):
+        # Returns a tuple: (hits, misses, evictions)
+        evictions = self._cache.Evictions if self._cache is not None else 0
+        return (self.CacheHits, self.CacheMisses, evictions)
+
+    def __parse(self, hanzi):
+        # Parses the (stripped) hanzi, returning a tuple:
+        #   (newTonenum, alternatives, error)
+        #   newTonenum: the tone number, or a warning message in [].
+        #   alternatives: the list of segmentations (match positions); more
+        #                 than one if the parse is ambiguous.
+        #   error: True if newTonenum is a warning message.
+        if self._cache is not None:
+            try:
+                result = self._cache[hanzi]
+            except KeyError:
+                self.CacheMisses += 1
+            else:
+                self.CacheHits += 1
+                return result
+
+        if self.LatticeParses:
+            parses = self.segmenter.best_segmentations(hanzi, self.LatticeParses)
+            alternatives = [m for cost, m in parses if cost == parses[0][0]]
+        else:
+            l = self.segmenter.match_all_ends(hanzi)
+            r = self.segmenter.match_all_starts(hanzi)
+            alternatives = [l] if l == r else [l, r]
+        try:
+            tonenums = [join_segments(self.segmenter, hanzi, m).strip()
+                        for m in alternatives]
+            if self.LatticeParses:
+                tonenums = list(dict.fromkeys(tonenums))    # Remove duplicates
+            newTonenum = " | ".join(tonenums)
+            result = (newTonenum, alternatives, False)
+        except KeyError as msg:
+            ch = str(msg)
+            if ch =="u'.'" and "..." in hanzi:
+                newTonenum = "[Use Ellipsis (U+2026): %s]" % msg
+            elif ch in ["u'('", "u')'", "u'['", "u']'", "u';'", "u'.'", "u' '", "u'-'"]:
+                newTonenum = "[Use Chinese (wide) punctuation: %s]" % msg
+            else:
+                newTonenum = "[Unknown/unsupported Chinese : %s]" % msg
+            result = (newTonenum, alternatives, True)
+
+        if self._cache is not None:
+            self._cache[hanzi] = result
+        return result
 
     def Tonenum(self, hanzi, tonenum):
+        return self.__tonenum(hanzi, tonenum, self.__parse)
+
+    def __tonenum(self, hanzi, tonenum, parse):
+        # parse: function returning the result of __parse() for the
+        # stripped hanzi.
         # Copied and adapted from check_pinyin.check_pinyin()
         def __check_hanzi_with_pinyin(matches):
             hz_segs = segments(hanzi, matches)
@@ -90,50 +210,18 @@ class ChineseParser(object):
 
         if hanzi:
             hanzi = hanzi.strip()
-            l = self.segmenter.match_all_ends(hanzi)
-            r = self.segmenter.match_all_starts(hanzi)
-            if l == r:
-                try:
-                    newTonenum = join_segments(self.segmenter, hanzi, l).strip()
-                except KeyError as msg:
-                    ch = str(msg)
-                    if ch =="u'.'" and "..." in hanzi:
-                        return "[Use Ellipsis (U+2026): %s]" % msg
-                    elif ch in ["u'('", "u')'", "u'['", "u']'", "u';'", "u'.'", "u' '", "u'-'"]:
-                        return "[Use Chinese (wide) punctuation: %s]" % msg
-                    return "[Unknown/unsupported Chinese : %s]" % msg
-
-                if not tonenum:
-                    return newTonenum
-
-                if newTonenum != tonenum:
-                    if __check_hanzi_with_pinyin(l):
-                        return None
-                    else:
-                        return '[Expected "%s"]' % newTonenum
-            else:
-                # Ambiguous parse
-                try:
-                    tonenum1 = join_segments(self.segmenter, hanzi, l).strip()
-                    tonenum2 = join_segments(self.segmenter, hanzi, r).strip()
-                except KeyError as msg:
-                    ch = str(msg)
-                    if ch =="u'.'" and "..." in hanzi:
-                        return "[Use Ellipsis (U+2026): %s]" % msg
-                    elif ch in ["u'('", "u')'", "u'['", "u']'", "u';'", "u'.'", "u' '", "u'-'"]:
-                        return "[Use Chinese (wide) punctuation: %s]" % msg
-                    return "[Unknown/unsupported Chinese : %s]" % msg
-
-                newTonenum = " | ".join((tonenum1, tonenum2))
-                if not tonenum:
-                    return newTonenum
-
-                if newTonenum != tonenum:
-                    if (__check_hanzi_with_pinyin(l) or\
-                        __check_hanzi_with_pinyin(r)):
-                        return None           # All okay; no change
-                    else:
-                        return '[Expected "%s"]' % newTonenum.replace(' | ', '" or "')
+            newTonenum, alternatives, error = parse(hanzi)
+            if error or not tonenum:
+                return newTonenum
+
+            if newTonenum != tonenum:
+                if any(__check_hanzi_with_pinyin(m) for m in alternatives):
+                    return None           # All okay; no change
+                elif len(alternatives) == 1:
+                    return '[Expected "%s"]' % newTonenum
+                else:
+                    # Ambiguous parse
+                    return '[Expected "%s"]' % newTonenum.replace(' | ', '" or "')
         return None
 
     def CalculateTonenum(self, hanzi, tonenum):
@@ -144,10 +232,12 @@ class ChineseParser(object):
         #               None if the field is not to be written
         #               (i.e. it is already correct, or there was an error)
         #   msg: None, or a warning message about the data.
+        return self.__calculateTonenum(hanzi, tonenum, self.__parse)
 
+    def __calculateTonenum(self, hanzi, tonenum, parse):
         newTonenum = msg = None
         if hanzi:
-            newTonenum = self.Tonenum(hanzi, tonenum)
+            newTonenum = self.__tonenum(hanzi, tonenum, parse)
             if newTonenum and "[" in newTonenum:   # Warning message, don't write field
                 if tonenum:
                     msg = "(%s; %s): %s" % (hanzi, tonenum, newTonenum)
@@ -160,11 +250,57 @@ class ChineseParser(object):
 
         return (newTonenum, msg)
 
+    def CalculateTonenumBatch(self, items):
+        # Calculates the Tonenumbers for many fields at once.
+        #   items: an iterable of (key, hanzi, tonenum) tuples. The key
+        #          identifies the field to the caller (e.g. the sense).
+        # Yields a tuple for each item, in the same order:
+        #   (key, newTonenum, msg) - as for CalculateTonenum()
+        # Identical (hanzi, tonenum) pairs are only calculated once, and
+        # each distinct Hanzi string is only parsed once.
+
+        items = list(items)
+        fields = set((hanzi, tonenum) for key, hanzi, tonenum in items)
+
+        parses = {}
+        for hanzi, tonenum in fields:
+            if hanzi:
+                hanzi = hanzi.strip()
+                if hanzi not in parses:
+                    parses[hanzi] = self.__parse(hanzi)
+
+        results = {}
+        for hanzi, tonenum in fields:
+            results[(hanzi, tonenum)] = \
+                self.__calculateTonenum(hanzi, tonenum, parses.__getitem__)
+
+        for key, hanzi, tonenum in items:
+            yield (key,) + results[(hanzi, tonenum)]
+
 # --- Tone number to Pinyin
 
 def TonenumberToPinyin(tonenum):
     return tonenum_pinyin(tonenum)
 
+def TonenumberToPinyinMany(tonenums, normalForm="NFD"):
+    # Converts an iterable of tone number strings to Pinyin.
+    # Returns a list of the Pinyin in the same order, normalised to
+    # normalForm (see unicodedata.normalize; None for no normalisation.)
+    # Repeated tone numbers are only converted once.
+
+    converted = {}
+    pinyins = []
+    for tonenum in tonenums:
+        try:
+            pinyin = converted[tonenum]
+        except KeyError:
+            pinyin = tonenum_pinyin(tonenum)
+            if normalForm:
+                pinyin = unicodedata.normalize(normalForm, pinyin)
+            converted[tonenum] = pinyin
+        pinyins.append(pinyin)
+    return pinyins
+
 # --- Sort String functions and classes ---
 
 def MakeSortString(py, stroke_count, strokes):
@@ -179,11 +315,20 @@ def MakeSortString(py, stroke_count, strokes):
     return "".join([py, stroke_count, strokes])
 
 
-class SortStringDB(dict):
+SortCacheSize = 4096        # Characters with their sort strings calculated
+
+class SortStringDB(Mapping):
+    # A read-only dictionary of {hz : {pinyin : sort string}}.
+    # The sort data is either a ch2sort.txt-style text file, which is
+    # loaded in full, or char_dat.pkl/.bin, which is read through
+    # datafiles.SortDataStore and only decoded when a character is
+    # looked up.
 
-    def __init__(self, fname=datafiles.SortPickle):
-        dict.__init__(self)
+    def __init__(self, fname=datafiles.SortPickle, cacheSize=SortCacheSize):
         self.FileName = fname
+        self.__entries = {}         # Text file entries and punctuation
+        self.__store = None         # datafiles.SortDataStore
+        self.__cache = LRUCache(cacheSize)
         self.__load()
 
     def __loadFromTextFile(self, fname):
@@ -204,33 +349,59 @@ class SortStringDB(dict):
                     py = parts.pop(0)
                     sortKey = parts.pop(0)
                     mapping[py] = sortKey
-                self[hz] = mapping
+                self.__entries[hz] = mapping
 
         f.close()
 
-    def __loadFromPickle(self, fname):
-        sortData = datafiles.loadSortData(fname)
-
-        for d in list(sortData.values()):
-            # d is list of [chr, pinyin, # strokes, order of strokes by type]
-            mapping = {}
-            for py in d[1]:
-                mapping[py] = MakeSortString(py, d[2], d[3])
-            self[d[0]] = mapping
-
     def __loadPunctuation(self):
         # Extra punctuation and numerals used in Chinese text
 
         for c, l in list(punctuation.items()): # from check_pinyin.py
             l = l.strip()
-            self[c] = {l: l}            # Sort string is itself for punctuation
+            self.__entries[c] = {l: l}  # Sort string is itself for punctuation
 
     def __load(self):
-        if self.FileName.endswith(".pkl"):
-            self.__loadFromPickle(self.FileName)
+        if self.FileName.endswith((".pkl", datafiles.COMPILED_SUFFIX)):
+            self.__store = datafiles.loadSortDataStore(self.FileName)
         else:
             self.__loadFromTextFile(self.FileName)
         self.__loadPunctuation()
+        if self.__store is not None:
+            self.__entriesNotInStore = sum(1 for hz in self.__entries
+                                   if hz not in self.__store)
+
+    def __getitem__(self, hz):
+        try:
+            return self.__entries[hz]
+        except KeyError:
+            if self.__store is None:
+                raise
+        try:
+            return self.__cache[hz]
+        except KeyError:
+            pass
+        pinyin, strokeCount, strokes = self.__store[hz]
+        mapping = {}
+        for py in pinyin:
+            mapping[py] = MakeSortString(py, strokeCount, strokes)
+        self.__cache[hz] = mapping
+        return mapping
+
+    def __contains__(self, hz):
+        return hz in self.__entries or \
+               (self.__store is not None and hz in self.__store)
+
+    def __len__(self):
+        if self.__store is None:
+            return len(self.__entries)
+        return len(self.__store) + self.__entriesNotInStore
+
+    def __iter__(self):
+        yield from self.__entries
+        if self.__store is not None:
+            for hz in self.__store:
+                if hz not in self.__entries:
+                    yield hz
 
     def Lookup(self, hz, py):
         try:
@@ -294,3 +465,262 @@ class SortStringDB(dict):
 
         return (newSortString, msg)
 
+    def CalculateSortStringBatch(self, items):
+        # Calculates the Sort Strings for many fields at once.
+        #   items: an iterable of (key, hanzi, tonenum, sortString) tuples.
+        # Yields a tuple for each item, in the same order:
+        #   (key, newSortString, msg) - as for CalculateSortString()
+        # Identical inputs are only calculated once.
+
+        items = list(items)
+        results = {}
+        for key, hanzi, tonenum, sortString in items:
+            fields = (hanzi, tonenum, sortString)
+            if fields not in results:
+                results[fields] = self.CalculateSortString(*fields)
+
+        for key, hanzi, tonenum, sortString in items:
+            yield (key,) + results[(hanzi, tonenum, sortString)]
+
+
+# --- Shared parsers and sort string databases ---
+#
+# ChineseParser and SortStringDB take a while to load, and several modules
+# in a collection use them. These functions return one instance per data
+# file and settings that is shared by all the modules run in this FlexTools
+# process, so a module never sees the settings of another module.
+# An instance is reloaded if its data file changes on disk.
+
+MaxSharedResources = 4          # Least recently used are dropped beyond this
+
+# (class, path, settings) -> (fileStamp, instance)
+__sharedResources = OrderedDict()
+
+def __fileStamp(fname):
+    try:
+        stat = os.stat(fname)
+    except OSError:
+        return None
+    return (stat.st_size, stat.st_mtime_ns)
+
+def __getShared(resourceClass, fname, **settings):
+    key = (resourceClass, os.path.abspath(fname),
+           tuple(sorted(settings.items())))
+    stamp = __fileStamp(fname)
+    try:
+        resourceStamp, resource = __sharedResources[key]
+    except KeyError:
+        pass
+    else:
+        if resourceStamp == stamp:
+            __sharedResources.move_to_end(key)
+            return resource
+        del __sharedResources[key]
+
+    resource = resourceClass(fname, **settings)
+    __sharedResources[key] = (stamp, resource)
+    while len(__sharedResources) > MaxSharedResources:
+        __sharedResources.popitem(last=False)
+    return resource
+
+def SharedChineseParser(fname=datafiles.DictDB, cacheSize=0, latticeParses=0):
+    # Don't change the settings of the returned parser (SetCacheSize(),
+    # SetLatticeMode()), since other modules share it; ask for the
+    # settings needed here instead.
+    return __getShared(ChineseParser, fname,
+                       cacheSize=cacheSize, latticeParses=latticeParses)
+
+def SharedSortStringDB(fname=datafiles.SortPickle):
+    return __getShared(SortStringDB, fname)
+
+def ClearSharedResources():
+    __sharedResources.clear()
+
+
+# --- Change tracking ---
+#
+# Modules that update many fields can skip the objects that haven't changed
+# since the last run. The state is saved per project and module, and maps
+# each object GUID to a digest of its fields after the last run. The whole
+# state is discarded if the data files or the module's settings change.
+
+ChangeTrackerVersion = 1
+
+class ChangeTracker(object):
+    # Usage:
+    #   Tracker = ChangeTracker(project, "Module name",
+    #                           [datafiles.DictDB], {"version" : "4.0"},
+    #                           enabled=INCREMENTAL)
+    #   if not Tracker.Unchanged(obj.Guid, hz, tn):
+    #       ...calculate, and write the fields...
+    #       Tracker.Record(obj.Guid, hz, newTn)
+    #   Tracker.Save()
+    # Only Record() objects that don't need attention next time, i.e. the
+    # fields are correct and there were no warnings.
+    # When not enabled, nothing is skipped and nothing is saved.
+
+    def __init__(self, project, name, dataFiles=(), settings=None,
+                 enabled=True, folder=datafiles.statepath):
+        self.Enabled = enabled
+        self.Skipped = 0
+        self.__fileName = os.path.join(folder, "%s - %s.json"
+                                       % (project.ProjectName(), name))
+        self.__dataFiles = [os.path.abspath(f) for f in dataFiles]
+        self.__settings = settings or {}
+        self.__previous = {}
+        self.__current = {}
+        if enabled:
+            self.__previous = self.__load()
+
+    def __load(self):
+        try:
+            with open(self.__fileName, encoding="utf-8") as file:
+                state = json.load(file)
+        except (OSError, ValueError) as e:
+            logger.info(f"No change tracking state loaded: {e}")
+            return {}
+        try:
+            if state["version"] != ChangeTrackerVersion or \
+               state["settings"] != self.__settings or \
+               sorted(state["dataFiles"]) != sorted(self.__dataFiles):
+                return {}
+            for fname, signature in state["dataFiles"].items():
+                if not datafiles.isUnchanged(signature, fname):
+                    return {}
+            return state["digests"]
+        except (KeyError, TypeError, AttributeError):
+            return {}
+
+    @staticmethod
+    def __digest(fields):
+        text = "\x1f".join(f if f is not None else "\x00" for f in fields)
+        return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+    def Unchanged(self, guid, *fields):
+        # Returns True if the fields of this object are the same as when
+        # it was last recorded. The object's record is kept for next time.
+        if not self.Enabled:
+            return False
+        guid = str(guid)
+        digest = self.__previous.get(guid)
+        if digest is None or digest != self.__digest(fields):
+            return False
+        self.__current[guid] = digest
+        self.Skipped += 1
+        return True
+
+    def Record(self, guid, *fields):
+        if self.Enabled:
+            self.__current[str(guid)] = self.__digest(fields)
+
+    def Save(self):
+        # Saves the records from this run. Objects that weren't recorded
+        # (or found Unchanged) in this run will be processed next time.
+        if not self.Enabled:
+            return
+        state = {"version"   : ChangeTrackerVersion,
+                 "settings"  : self.__settings,
+                 "dataFiles" : {f : datafiles.fileSignature(f)
+                                for f in self.__dataFiles},
+                 "digests"   : self.__current}
+        tmpFile = self.__fileName + ".tmp"
+        try:
+            os.makedirs(os.path.dirname(self.__fileName), exist_ok=True)
+            with open(tmpFile, "w", encoding="utf-8") as file:
+                json.dump(state, file)
+            os.replace(tmpFile, self.__fileName)
+        except OSError as e:
+            logger.warning(f"Couldn't save change tracking state {self.__fileName}: {e}")
+
+
+# --- Process pool ---
+#
+# Segmentation and sort strings are pure Python, so for large lexicons
+# and reversal indexes the calculations can be shared between several
+# processes. The FieldWorks project is only accessed in the main process:
+# the module reads the fields, the pool calculates, and the module writes
+# the results.
+#
+# Note: the worker processes are started with 'spawn', so the main script
+# must be guarded with 'if __name__ == "__main__":'.
+
+def _initWorker(dictFile, sortFile, latticeParses):
+    global _workerFiles, _workerLatticeParses
+    _workerFiles = (dictFile, sortFile)
+    _workerLatticeParses = latticeParses
+
+def _workerTonenums(fields):
+    # fields: list of (hanzi, tonenum)
+    parser = SharedChineseParser(_workerFiles[0],
+                                 latticeParses=_workerLatticeParses)
+    return [(newTonenum, msg) for key, newTonenum, msg in
+            parser.CalculateTonenumBatch((None,) + f for f in fields)]
+
+def _workerSortStrings(fields):
+    # fields: list of (hanzi, tonenum, sortString)
+    sortDB = SharedSortStringDB(_workerFiles[1])
+    return [(newSortString, msg) for key, newSortString, msg in
+            sortDB.CalculateSortStringBatch((None,) + f for f in fields)]
+
+
+class ChineseProcessPool(object):
+    # A pool of worker processes with the same batch functions as
+    # ChineseParser and SortStringDB. The results are identical to
+    # those classes, and in the same order.
+    #   processes: number of worker processes (None = number of CPUs)
+    #   chunkSize: number of distinct fields sent to a worker at a time
+    #   latticeParses: see ChineseParser.SetLatticeMode()
+    # Each worker loads the dictionary and sort data once.
+    # Use in a 'with' statement, or call Close() when finished.
+
+    def __init__(self, processes=None,
+                 dictFile=datafiles.DictDB,
+                 sortFile=datafiles.SortPickle,
+                 chunkSize=500,
+                 latticeParses=0):
+        self.ChunkSize = chunkSize
+        self.__executor = ProcessPoolExecutor(
+                            max_workers=processes,
+                            mp_context=multiprocessing.get_context("spawn"),
+                            initializer=_initWorker,
+                            initargs=(dictFile, sortFile, latticeParses))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        # After an exception, the work that hasn't started is dropped.
+        self.Close(cancel=excType is not None)
+
+    def Close(self, cancel=False):
+        # Shuts down the worker processes. If cancel is True, waiting
+        # work is dropped (Python 3.9+; otherwise it is finished.)
+        if cancel and sys.version_info >= (3, 9):
+            self.__executor.shutdown(cancel_futures=True)
+        else:
+            self.__executor.shutdown()
+
+    def __map(self, function, items, getFields):
+        # Sends each distinct set of fields to the workers (in chunks),
+        # and yields (key,) + result for each item in order.
+        items = list(items)
+        fields = list(dict.fromkeys(getFields(item) for item in items))
+        chunks = [fields[i:i+self.ChunkSize]
+                  for i in range(0, len(fields), self.ChunkSize)]
+        results = {}
+        for chunk, chunkResults in zip(chunks,
+                                       self.__executor.map(function, chunks)):
+            results.update(zip(chunk, chunkResults))
+
+        for item in items:
+            yield (item[0],) + results[getFields(item)]
+
+    def CalculateTonenumBatch(self, items):
+        # See ChineseParser.CalculateTonenumBatch()
+        return self.__map(_workerTonenums, items,
+                          lambda item: item[1:])
+
+    def CalculateSortStringBatch(self, items):
+        # See SortStringDB.CalculateSortStringBatch()
+        return self.__map(_workerSortStrings, items,
+                          lambda item: item[1:])
@@ -28,27 +28,28 @@ import re
 import logging
 logger = logging.getLogger(__name__)
 
-def get_tonenum_dict(fname):
-    """return a dictionary of tonenums keyed by lexeme
-    
+# tonenum digits that may follow a headword (homograph numbers)
+digits = set('123456789')
+# the erhua 'r' in a tonenum, e.g. 'huar1' > 'hua1'
+erhua_r_pat = re.compile(r"(?<=[a-z]{2})r(?=[:1-5])")
+
+def iter_tonenum_dict(fname):
+    """generate the lexemes and their tonenums from a dictionary file.
+
+    Lexemes with optional erhua (（儿）) are generated with and without it.
+    Badly formatted lines are logged (with the line number) and skipped.
+
     @param fname: name of the dictionary file
     @type fname: string
-    @return: list of Chinese lexemes with pronunciations
-    @rtype: list of tuples
+    @return: Chinese lexemes with pronunciations
+    @rtype: iterator over (chinese, tonenum) tuples
     """
-    word_file = open(fname, encoding="utf-8")
-    line_num = 0
-    word_tonenum = list()
-    digits = set('123456789')
-    removeR = re.compile(r"(?<=[a-z]{2})r(?=[:1-5])")
-    #char_prons = get_xhc_char_prons()
-    for line in word_file:
-        line_num += 1
-        line = line.strip()
-        fields = line.split('\t')
-        if len(fields) != 2:
-            logger.error("line %d: num of fields != 2" %  line_num)
-        else:
+    with open(fname, encoding="utf-8") as word_file:
+        for line_num, line in enumerate(word_file, 1):
+            fields = line.strip().split('\t')
+            if len(fields) != 2:
+                logger.error("line %d: num of fields != 2" %  line_num)
+                continue
             chinese, tonenum = fields
             # perhaps should skip at this point
             if chinese[-1] == '*':
@@ -60,13 +61,21 @@ def get_tonenum_dict(fname):
             # get rid of erhua
             if '（儿）' in chinese:
                 # include with erhua
-                word_tonenum += ((chinese.replace('（儿）', '儿'), tonenum),)
+                yield (chinese.replace('（儿）', '儿'), tonenum)
                 # and without erhua
-                word_tonenum += ((chinese.replace('（儿）', ''),
-                                  removeR.sub("", tonenum)),)
+                yield (chinese.replace('（儿）', ''), erhua_r_pat.sub("", tonenum))
             else:
-                word_tonenum += ((chinese, tonenum),)
-    return word_tonenum
+                yield (chinese, tonenum)
+
+def get_tonenum_dict(fname):
+    """return a dictionary of tonenums keyed by lexeme
+    
+    @param fname: name of the dictionary file
+    @type fname: string
+    @return: list of Chinese lexemes with pronunciations
+    @rtype: list of tuples
+    """
+    return list(iter_tonenum_dict(fname))
 
 punctuation = {
     '\N{IDEOGRAPHIC COMMA}': ', ',
@@ -174,9 +183,8 @@ def check_pinyin(sgmtr, hanzi, pinyin):
     return errors
 
 def init_chin_sgmtr(dict_files):
-    chin_sgmtr = segmenter.MaximalMatch()
+    chin_sgmtr = segmenter.TrieMaximalMatch()
     for fname in dict_files:
-        word_tonenum = get_tonenum_dict(fname)
-        chin_sgmtr.add_segment_values(word_tonenum)
-    chin_sgmtr.add_segment_values(list(punctuation.items()))
+        chin_sgmtr.add_segment_values(iter_tonenum_dict(fname))
+    chin_sgmtr.add_segment_values(punctuation.items())
     return chin_sgmtr
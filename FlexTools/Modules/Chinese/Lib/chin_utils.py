@@ -22,6 +22,7 @@
 # Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
 
 import re
+from bisect import bisect_right
 
 import logging
 logger = logging.getLogger(__name__)
@@ -79,6 +80,60 @@ def get_tone_syls(tonenum):
             syls.append(s)
     return syls
 
+# Character classes for is_chinese_char() and is_chinese_punctuation().
+# The Basic Multilingual Plane is looked up in a table indexed by codepoint,
+# the supplementary planes in a (sorted) table of ranges.
+# (codepoints from Unicode 5.0)
+CHINESE_CHAR = 1
+CHINESE_PUNCTUATION = 2
+
+chinese_ranges = (
+    (0x4e00, 0x9fbb, CHINESE_CHAR),     # CJK Unified Ideographs
+    (0x3400, 0x4db5, CHINESE_CHAR),     # CJK Unified Ideographs Extension A
+    (0x20000, 0x2a6d6, CHINESE_CHAR),   # CJK Unified Ideographs Extension B
+    (0x2ff0, 0x2ffb, CHINESE_CHAR),     # Ideographic Description Characters
+    (0x3000, 0x303f, CHINESE_PUNCTUATION),  # CJK Symbols and Punctuation
+    (0xff0c, 0xff0c, CHINESE_PUNCTUATION),  # FULLWIDTH COMMA
+    (0x2026, 0x2026, CHINESE_PUNCTUATION),  # HORIZONTAL ELLIPSIS
+    )
+
+def make_char_classes(ranges):
+    """return the lookup tables for L{char_class}.
+
+    @param ranges: (first codepoint, last codepoint, class) triples
+    @type ranges: sequence of tuples
+    @return: a table of the class of each BMP codepoint, and a sorted
+        list of (first, last, class) for the supplementary planes
+    @rtype: (bytearray, list) tuple
+    """
+    bmp = bytearray(0x10000)
+    supplementary = list()
+    for first, last, cls in ranges:
+        for o in range(first, min(last, 0xffff) + 1):
+            bmp[o] = cls
+        if last > 0xffff:
+            supplementary.append((max(first, 0x10000), last, cls))
+    supplementary.sort()
+    return bmp, supplementary
+
+bmp_classes, supplementary_classes = make_char_classes(chinese_ranges)
+supplementary_starts = [first for first, last, cls in supplementary_classes]
+
+def char_class(c):
+    """return the class of c: CHINESE_CHAR, CHINESE_PUNCTUATION or 0.
+
+    @param c: a single character
+    @type c: string
+    @rtype: integer
+    """
+    o = ord(c)
+    if o <= 0xffff:
+        return bmp_classes[o]
+    i = bisect_right(supplementary_starts, o) - 1
+    if i >= 0 and o <= supplementary_classes[i][1]:
+        return supplementary_classes[i][2]
+    return 0
+
 def is_chinese_punctuation(c):
     """Return C{True} if c is Chinese punctuation.
 
@@ -87,17 +142,10 @@ def is_chinese_punctuation(c):
     @return: True if c is a normal Chinese punctuation
     @rtype: boolean
     """
-    
-    # codepoints from Unicode 5.0
-    ans = False
-    if '\u3000' <= c <= '\u303f':
-        # CJK Symbols and Punctuation
-        ans = True
-    elif c == '\N{FULLWIDTH COMMA}':
-        ans = True
-    elif c == '\N{HORIZONTAL ELLIPSIS}':
-        ans = True
-    return ans
+    try:
+        return bmp_classes[ord(c)] == CHINESE_PUNCTUATION
+    except IndexError:      # Supplementary planes
+        return char_class(c) == CHINESE_PUNCTUATION
 
 def is_chinese(c):
     """Return C{True} if c is a Chinese character or punctuation.
@@ -107,15 +155,10 @@ def is_chinese(c):
     @return: True if c is a normal Chinese character or punctuation
     @rtype: boolean
     """
-
-    ans = False
-    if is_chinese_char(c):
-        # Chinese Character
-        ans = True
-    elif is_chinese_punctuation(c):
-        # CJK Symbols and Punctuation
-        ans = True
-    return ans
+    try:
+        return bmp_classes[ord(c)] != 0
+    except IndexError:      # Supplementary planes
+        return char_class(c) != 0
 
 def is_chinese_char(c):
     """Return C{True} if c is a Chinese character.
@@ -125,22 +168,10 @@ def is_chinese_char(c):
     @return: True if c is a normal Chinese character
     @rtype: boolean
     """
-    
-    # codepoints from Unicode 5.0
-    ans = False
-    if  '\u4e00' <= c <= '\u9fbb':
-        # CJK Unified Ideographs
-        ans = True
-    elif '\u3400' <= c <= '\u4db5':
-        # CJK Unified Ideographs Extension A
-        ans = True
-    elif  '\u020000' <= c <= '\u02a6d6':
-        # CJK Unified Ideographs Extension B
-        ans = True
-    elif '\u2ff0' <= c <= '\u2ffb':
-        # Ideographic Description Characters
-        ans = True
-    return ans
+    try:
+        return bmp_classes[ord(c)] == CHINESE_CHAR
+    except IndexError:      # Supplementary planes
+        return char_class(c) == CHINESE_CHAR
 
 def is_chinese_string(s):
     """
@@ -149,11 +180,17 @@ def is_chinese_string(s):
     @return: True if all characters in s are valid for Chinese
     @rtype: boolean
     """
-    ans = True
-    for c in s:
-        if not is_chinese(c):
-            ans = False
-    return ans
+    if s.isascii():
+        # No ASCII characters are Chinese
+        return not s
+    bmp = bmp_classes
+    try:
+        for c in s:
+            if not bmp[ord(c)]:
+                return False
+        return True
+    except IndexError:      # Supplementary planes
+        return all(char_class(c) for c in s)
 
 def get_chars(s):
     """return a list of the characters in s.
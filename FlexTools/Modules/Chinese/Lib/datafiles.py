@@ -2,11 +2,21 @@
 #   datafiles
 #
 #   References to the Chinese data files, including load/save functions
-#   for char_dat.pkl.
+#   for char_dat.pkl, the compiled dictionary (xhc4_words.bin) and the
+#   columnar sort data store (char_dat.bin).
+#   Also the per-user folder for project state files (see ChangeTracker.)
 #
 
 import os
+import sys
+import json
 import pickle
+import hashlib
+from array import array
+from bisect import bisect_left
+
+import logging
+logger = logging.getLogger(__name__)
 
 datapath = os.path.join(os.path.dirname(__file__), "Datafiles")
 
@@ -15,6 +25,23 @@ SortDB = os.path.join(datapath, "ch2sort.txt")
 DictDB = os.path.join(datapath, "xhc4_words.txt")
 SortPickle = os.path.join(datapath, "char_dat.pkl")
 
+# The state files are kept in the user's data folder, since FlexTools
+# may be installed in a read-only location.
+def _userDataPath():
+    path = os.environ.get("LOCALAPPDATA") or os.environ.get("XDG_DATA_HOME")
+    if not path:
+        path = os.path.join(os.path.expanduser("~"), ".local", "share")
+    return path
+
+statepath = os.path.join(_userDataPath(), "FlexTools", "Chinese", "State")
+
+# The compiled dictionary is built automatically from DictDB. Increment
+# this version if the way the dictionary is read or compiled changes
+# (e.g. check_pinyin.get_tonenum_dict() or the punctuation table).
+COMPILED_SUFFIX = ".bin"
+CompiledDictVersion = 1
+SortStoreVersion = 1
+
 
 def loadSortData(fname=SortPickle):
     with open(fname, 'rb') as file:
@@ -24,4 +51,264 @@ def loadSortData(fname=SortPickle):
 def saveSortData(SortData, fname=SortPickle):
     with open(fname, 'wb') as file:
         pickle.dump(SortData, file)
-    
+
+
+# --- Detecting changes to the data files ---
+
+def fileSignature(fname):
+    # Returns a dictionary identifying the current contents of the file.
+    stat = os.stat(fname)
+    with open(fname, 'rb') as file:
+        sha1 = hashlib.sha1(file.read()).hexdigest()
+    return {"size"  : stat.st_size,
+            "mtime" : stat.st_mtime_ns,
+            "sha1"  : sha1}
+
+def isUnchanged(signature, fname):
+    # Returns True if the file still matches the signature from
+    # fileSignature(). The file is only hashed if the modification
+    # time has changed (e.g. the file has been copied.)
+    try:
+        stat = os.stat(fname)
+        if stat.st_size != signature["size"]:
+            return False
+        if stat.st_mtime_ns == signature["mtime"]:
+            return True
+        return fileSignature(fname)["sha1"] == signature["sha1"]
+    except (OSError, KeyError, TypeError):
+        return False
+
+def _refreshMeta(compiledFile, meta, fname):
+    # If fname has been touched or copied (so isUnchanged() had to hash
+    # it) the new modification time is saved in the meta information
+    # of compiledFile, so that it isn't hashed on every load.
+    # compiledFile is a compiled dictionary or sort data store: both
+    # start with an 8-byte magic string, array('I', [version, header
+    # length]) and a JSON header, padded to 4 bytes, containing "meta".
+    mtime = os.stat(fname).st_mtime_ns
+    if meta["source"]["mtime"] == mtime:
+        return
+    meta = dict(meta, source=dict(meta["source"], mtime=mtime))
+    tmpFile = compiledFile + ".tmp"
+    try:
+        with open(compiledFile, 'rb') as file:
+            data = file.read()
+        pos = 8
+        version, headerLength = array('I', data[pos:pos+8])
+        header = json.loads(data[pos+8:pos+8+headerLength])
+        header["meta"] = meta
+        newHeader = json.dumps(header).encode("utf-8")
+        newHeader += b' ' * (-len(newHeader) % 4)
+        with open(tmpFile, 'wb') as file:
+            file.write(data[:pos])
+            file.write(array('I', [version, len(newHeader)]).tobytes())
+            file.write(newHeader)
+            file.write(data[pos+8+headerLength:])
+        os.replace(tmpFile, compiledFile)
+    except OSError as e:
+        logger.warning(f"Couldn't update {compiledFile}: {e}")
+    else:
+        logger.info(f"Updated the modification time of {fname} in {compiledFile}")
+
+
+# --- Compiled dictionary ---
+
+def compiledName(fname):
+    return os.path.splitext(fname)[0] + COMPILED_SUFFIX
+
+def _punctuationDigest():
+    from check_pinyin import punctuation
+    return hashlib.sha1(repr(sorted(punctuation.items())).encode("utf-8")).hexdigest()
+
+def loadSegmenter(fname=DictDB):
+    # Returns a segmenter for the dictionary file, fname.
+    # The segmenter is opened from the compiled dictionary if it is
+    # up to date. Otherwise the dictionary is loaded from fname, and
+    # the compiled dictionary is (re)written for next time.
+
+    import segmenter
+    from check_pinyin import init_chin_sgmtr
+
+    compiledFile = compiledName(fname)
+    try:
+        sgmtr = segmenter.MappedMaximalMatch(compiledFile)
+    except (OSError, ValueError) as e:
+        logger.info(f"Compiled dictionary not loaded: {e}")
+    else:
+        meta = sgmtr.meta or {}
+        if meta.get("version") == CompiledDictVersion and \
+           meta.get("punctuation") == _punctuationDigest() and \
+           isUnchanged(meta.get("source"), fname):
+            if meta["source"]["mtime"] != os.stat(fname).st_mtime_ns:
+                # (The file can't be replaced while it is mapped.)
+                sgmtr.close()
+                _refreshMeta(compiledFile, meta, fname)
+                sgmtr = segmenter.MappedMaximalMatch(compiledFile)
+            return sgmtr
+        sgmtr.close()
+
+    logger.info(f"Compiling dictionary {fname}")
+    sgmtr = init_chin_sgmtr([fname])
+    meta = {"version"     : CompiledDictVersion,
+            "source"      : fileSignature(fname),
+            "punctuation" : _punctuationDigest()}
+    tmpFile = compiledFile + ".tmp"
+    try:
+        sgmtr.save(tmpFile, meta)
+        os.replace(tmpFile, compiledFile)
+    except OSError as e:
+        # E.g. a read-only folder, or the old file is in use. We can
+        # still use the dictionary loaded from the text file.
+        logger.warning(f"Couldn't write compiled dictionary {compiledFile}: {e}")
+    return sgmtr
+
+
+# --- Columnar sort data store ---
+#
+# char_dat.pkl is a dictionary of {hz : (hz, [pinyin], stroke count, strokes)}.
+# The store holds the same data as columns so that it can be loaded
+# without creating objects for every entry:
+#   - a sorted index of the characters (keys),
+#   - offset arrays into the pinyin and strokes text,
+#   - an array of stroke counts.
+# Entries are only decoded when they are looked up.
+#
+# File layout (all arrays are native byte order):
+#   SORT_STORE_MAGIC
+#   array('I', [version, header length])
+#   JSON header: {byteorder, count, pools, meta}, padded to 4 bytes
+#   keyOffsets, pinyinOffsets, strokesOffsets : array('I') x (count + 1)
+#   strokeCounts : array('B') x count
+#   keys, pinyin, strokes text (UTF-8)
+
+SORT_STORE_MAGIC = b'SORTDAT\0'
+
+def packSortData(sortData, meta=None):
+    # Returns the store file contents (bytes) for the sortData dictionary.
+    keys = sorted(sortData)
+    offsets = {"keys" : array('I', [0]),
+               "pinyin" : array('I', [0]),
+               "strokes" : array('I', [0])}
+    pools = {name : bytearray() for name in offsets}
+    strokeCounts = array('B')
+    for hz in keys:
+        d = sortData[hz]
+        # d is list of [chr, pinyin, # strokes, order of strokes by type]
+        for name, text in (("keys", hz),
+                           ("pinyin", " ".join(d[1])),
+                           ("strokes", d[3])):
+            pools[name] += text.encode("utf-8")
+            offsets[name].append(len(pools[name]))
+        strokeCounts.append(d[2])
+    header = json.dumps({"byteorder" : sys.byteorder,
+                         "count" : len(keys),
+                         "pools" : [len(pools[name]) for name in offsets],
+                         "meta" : meta}).encode("utf-8")
+    header += b' ' * (-len(header) % 4)
+    data = bytearray(SORT_STORE_MAGIC)
+    data += array('I', [SortStoreVersion, len(header)]).tobytes()
+    data += header
+    for name in offsets:
+        data += offsets[name].tobytes()
+    data += strokeCounts.tobytes()
+    for name in offsets:
+        data += pools[name]
+    return bytes(data)
+
+
+class SortDataStore(object):
+    # Read-only, dictionary-like access to the sort data:
+    #   store[hz] -> ([pinyin], stroke count, strokes)
+    # Raises ValueError if data isn't a valid store for this version.
+
+    def __init__(self, data):
+        if data[:len(SORT_STORE_MAGIC)] != SORT_STORE_MAGIC:
+            raise ValueError("Not a sort data store")
+        pos = len(SORT_STORE_MAGIC)
+        version, headerLength = array('I', data[pos:pos+8])
+        if version != SortStoreVersion:
+            raise ValueError(f"Sort data store version {version} (expected {SortStoreVersion})")
+        pos += 8
+        header = json.loads(data[pos:pos+headerLength])
+        if header["byteorder"] != sys.byteorder:
+            raise ValueError("Sort data store has the wrong byte order")
+        self.meta = header["meta"]
+        pos += headerLength
+
+        count = header["count"]
+        buf = memoryview(data)
+        columns = []
+        for i in range(3):
+            columns.append(buf[pos:pos+(count+1)*4].cast('I'))
+            pos += (count+1)*4
+        self.__keyOffsets, self.__pinyinOffsets, self.__strokesOffsets = columns
+        self.__strokeCounts = buf[pos:pos+count]
+        pos += count
+        pools = []
+        for length in header["pools"]:
+            pools.append(bytes(buf[pos:pos+length]))
+            pos += length
+        self.__pinyin, self.__strokes = pools[1:]
+
+        # The character index is decoded up front for searching.
+        keys = pools[0]
+        o = self.__keyOffsets
+        self.__keys = [keys[o[i]:o[i+1]].decode("utf-8") for i in range(count)]
+
+    def __index(self, hz):
+        i = bisect_left(self.__keys, hz)
+        if i == len(self.__keys) or self.__keys[i] != hz:
+            raise KeyError(hz)
+        return i
+
+    def __getitem__(self, hz):
+        i = self.__index(hz)
+        o = self.__pinyinOffsets
+        pinyin = self.__pinyin[o[i]:o[i+1]].decode("utf-8").split(" ")
+        o = self.__strokesOffsets
+        strokes = self.__strokes[o[i]:o[i+1]].decode("ascii")
+        return (pinyin, self.__strokeCounts[i], strokes)
+
+    def __contains__(self, hz):
+        i = bisect_left(self.__keys, hz)
+        return i < len(self.__keys) and self.__keys[i] == hz
+
+    def __len__(self):
+        return len(self.__keys)
+
+    def __iter__(self):
+        return iter(self.__keys)
+
+
+def loadSortDataStore(fname=SortPickle):
+    # Returns a SortDataStore for fname, which is either a store
+    # file (.bin) or the sort data pickle (.pkl). For a pickle, the
+    # store is compiled next to it and rebuilt whenever the pickle
+    # changes.
+
+    if fname.endswith(COMPILED_SUFFIX):
+        with open(fname, 'rb') as file:
+            return SortDataStore(file.read())
+
+    compiledFile = compiledName(fname)
+    try:
+        with open(compiledFile, 'rb') as file:
+            store = SortDataStore(file.read())
+    except (OSError, ValueError) as e:
+        logger.info(f"Sort data store not loaded: {e}")
+    else:
+        if isUnchanged((store.meta or {}).get("source"), fname):
+            _refreshMeta(compiledFile, store.meta, fname)
+            return store
+
+    logger.info(f"Compiling sort data {fname}")
+    data = packSortData(loadSortData(fname),
+                        {"source" : fileSignature(fname)})
+    tmpFile = compiledFile + ".tmp"
+    try:
+        with open(tmpFile, 'wb') as file:
+            file.write(data)
+        os.replace(tmpFile, compiledFile)
+    except OSError as e:
+        logger.warning(f"Couldn't write sort data store {compiledFile}: {e}")
+    return SortDataStore(data)
@@ -223,13 +223,88 @@ def oldtonenum_pinyin(s):
     s = tone_pat.sub(sub_tone, s)
     return s
 
-def tonenum_pinyin(s):
+def multipass_tonenum_pinyin(s):
+    """convert tonenum to pinyin with a regular expression pass per rule.
+
+    This is the reference implementation for L{tonenum_pinyin}.
+    """
     s = ambiguity_pat.sub(add_apostrophe, s)
     s = u_diaeresis_pat.sub(sub_u_diaeresis, s)
     s = e_circumflex_pat.sub(sub_e_circumflex, s)
     s = tone_pat.sub(sub_tone, s)
     return s
 
+# Single pass conversion.
+# None of the rules above can match across a character that isn't a letter,
+# ':' or '^', except for the apostrophe between a tone number and a
+# following a, e or o. So the text is split into runs of those characters
+# (with an optional tone number at the end), and each run is converted
+# independently, by looking it up in a table of the syllables.
+
+initials = ('', 'b', 'p', 'm', 'f', 'd', 't', 'n', 'l', 'g', 'k', 'h',
+            'j', 'q', 'x', 'zh', 'ch', 'sh', 'r', 'z', 'c', 's', 'y', 'w')
+finals = ('a', 'o', 'e', 'e^', 'er', 'ai', 'ei', 'ao', 'ou',
+          'an', 'en', 'ang', 'eng', 'ong', 'r',
+          'i', 'ia', 'ie', 'iao', 'iu', 'ian', 'in', 'iang', 'ing', 'iong',
+          'u', 'ua', 'uo', 'uai', 'ui', 'uan', 'un', 'uang', 'ueng',
+          'u:', 'ue:', 'u:an', 'u:n', 'ue', 'ng', 'm', 'n')
+
+token_pat = re.compile('[A-Za-z:^'
+                       '\N{LATIN SMALL LETTER U WITH DIAERESIS}'
+                       '\N{LATIN CAPITAL LETTER U WITH DIAERESIS}'
+                       '\N{LATIN SMALL LETTER E WITH CIRCUMFLEX}'
+                       '\N{LATIN CAPITAL LETTER E WITH CIRCUMFLEX}'
+                       '\N{LATIN CAPITAL LETTER I WITH DOT ABOVE}'
+                       '\N{LATIN SMALL LETTER DOTLESS I}'    # match i with re.I
+                       ']+[1-5]?')
+ambiguous_starts = frozenset('aeoAEO' + mid_vowels[2:])
+apostrophe = '\N{RIGHT SINGLE QUOTATION MARK}'
+
+# Tokens that aren't in the table (e.g. capitalised syllables) are added
+# to it when they are converted, up to this many entries in total.
+# Longer tokens are unlikely to repeat, so they aren't added.
+max_table_size = 50000
+max_cached_token = 8
+
+def make_syllable_table():
+    """return a dictionary of tonenum syllables to pinyin.
+
+    The table covers every combination of L{initials}, L{finals} and the 
+    tone numbers 1-5 (a superset of the pinyin syllables), and is made 
+    with L{multipass_tonenum_pinyin} so the results are identical.
+    """
+    table = dict()
+    for initial in initials:
+        for final in finals:
+            for tone in '12345':
+                syl = initial + final + tone
+                table[syl] = multipass_tonenum_pinyin(syl)
+    return table
+
+syllable_table = make_syllable_table()
+
+def sub_token(m):
+    token = m.group()
+    try:
+        result = syllable_table[token]
+    except KeyError:
+        result = multipass_tonenum_pinyin(token)
+        if len(token) <= max_cached_token and \
+           len(syllable_table) < max_table_size:
+            syllable_table[token] = result
+    start = m.start()
+    if start and token[0] in ambiguous_starts and \
+       '1' <= m.string[start-1] <= '5':
+        return apostrophe + result
+    return result
+
+def tonenum_pinyin(s):
+    """convert tonenum to pinyin (with tone marks).
+
+    Gives identical results to L{multipass_tonenum_pinyin}, in a single pass.
+    """
+    return token_pat.sub(sub_token, s)
+
 if __name__ == "__main__":
     tests = ('a1', 'a2', 'a3', 'a4', 'a5',
             'ao1', 'an2', 'ang3',
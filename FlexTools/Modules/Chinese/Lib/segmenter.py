@@ -24,7 +24,14 @@
 """
 functions for doing word segmentation.
 """
+import heapq
+import json
 import logging
+import mmap
+import os
+import sys
+from array import array
+from bisect import bisect_left
 
 class MaximalMatch(object):
     """
@@ -170,6 +177,548 @@ class MaximalMatch(object):
         l.reverse()
         return l
 
+    def match_ends(self, s, start=0):
+        """return the endpoints of all the segments from position start.
+
+        @param s: text to be segmented
+        @type s: indexable sequence
+        @param start: position to look for matches from
+        @type start: integer
+        @return: the endpoints, in increasing order, of every known segment
+            s[start:end]
+        @rtype: list of integers
+        """
+        beginnings = self._beginnings
+        ends = list()
+        p = ''
+        for pos in range(start, len(s)):
+            p += s[pos]
+            try:
+                value = beginnings[p]
+            except KeyError:
+                break
+            if value is not None:
+                ends.append(pos + 1)
+        return ends
+
+    def word_dag(self, s):
+        """return the lattice (directed acyclic graph) of the segments in s.
+
+        Positions that don't start any known segment get a single character
+        segment, as in L{match_all_ends}.
+
+        @param s: text to be segmented
+        @type s: indexable sequence
+        @return: for each position in s, the endpoints of the segments
+            starting there
+        @rtype: list of lists of integers
+        """
+        dag = list()
+        for pos in range(len(s)):
+            dag.append(self.match_ends(s, pos) or [pos + 1])
+        return dag
+
+    def segmentations(self, s, limit=None):
+        """generate every segmentation of s.
+
+        The number of segmentations can grow exponentially with the length
+        of s, so use limit, or L{best_segmentations}, for long text.
+
+        @param s: text to be segmented
+        @type s: indexable sequence
+        @param limit: maximum number of segmentations to generate
+        @type limit: integer
+        @return: the segment boundaries of each segmentation, in the same
+            form as L{match_all_ends}
+        @rtype: iterator over lists of integers
+        """
+        n = len(s)
+        if n == 0:
+            yield [0]
+            return
+        dag = self.word_dag(s)
+        count = 0
+        # depth first search, with a stack of the remaining edges from
+        # each position in the current path
+        positions = [0]
+        stack = [iter(dag[0])]
+        while stack:
+            end = next(stack[-1], None)
+            if end is None:
+                stack.pop()
+                positions.pop()
+            elif end == n:
+                yield positions + [n]
+                count += 1
+                if limit is not None and count >= limit:
+                    return
+            else:
+                positions.append(end)
+                stack.append(iter(dag[end]))
+
+    def best_segmentations(self, s, k=1, cost=None):
+        """return the k best segmentations of s.
+
+        Dynamic programming over the lattice from L{word_dag}, keeping the
+        k best paths from each position to the end of s.
+
+        @param s: text to be segmented
+        @type s: indexable sequence
+        @param k: number of segmentations to return
+        @type k: integer
+        @param cost: function giving the cost of a segment; the cost of a
+            segmentation is the sum of its segment costs. The default cost
+            is 1 per segment, i.e. the fewest segments are best.
+        @type cost: function
+        @return: (cost, positions) pairs, lowest cost first; positions are
+            in the same form as L{match_all_ends}. Equal costs are ordered
+            by their positions.
+        @rtype: list of tuples
+        """
+        dag = self.word_dag(s)
+        n = len(s)
+        best = [None] * n + [[(0, (n,))]]
+        for pos in range(n - 1, -1, -1):
+            paths = list()
+            for end in dag[pos]:
+                seg_cost = 1 if cost is None else cost(s[pos:end])
+                for path_cost, path in best[end]:
+                    paths.append((path_cost + seg_cost, (pos,) + path))
+            best[pos] = heapq.nsmallest(k, paths)
+        return [(path_cost, list(path)) for path_cost, path in best[0]]
+
+def make_trie(segments):
+    """return an array-backed trie of the segments.
+
+    The nodes are numbered in breadth-first order so that the children of
+    each node are numbered consecutively, sorted by character. The children
+    of node C{n} are the nodes C{first[n]} to C{first[n+1]-1}, and
+    C{chars[c]} is the (ordinal of the) character leading to node C{c}.
+    Node 0 is the root.
+
+    @param segments: sequence of segments
+    @type segments: sequence of strings
+    @return: (first, chars, nodes) where nodes[i] is the node at the end
+        of segments[i]
+    @rtype: tuple of (array, array, list)
+    """
+    root = dict()
+    seg_ends = list()
+    for segment in segments:
+        node = root
+        for c in segment:
+            node = node.setdefault(c, {})
+        seg_ends.append(node)
+    first = array('I')
+    chars = array('I', [0])
+    queue = [root]
+    node_ids = {id(root): 0}
+    for node in queue:              # queue grows as the children are added
+        first.append(len(queue))
+        for c in sorted(node):
+            child = node[c]
+            node_ids[id(child)] = len(queue)
+            queue.append(child)
+            chars.append(ord(c))
+    first.append(len(queue))
+    return first, chars, [node_ids[id(node)] for node in seg_ends]
+
+class TrieMaximalMatch(MaximalMatch):
+    """maximal matching using array-backed tries instead of prefix dictionaries.
+
+    Segments are stored once in a forward trie (for L{match_end} and
+    L{values}) and once in a reversed trie (for L{match_start}). See
+    L{make_trie} for the layout. No prefix or suffix strings are built, so
+    each match is linear in the length of the segment found, and the tries
+    only take a few bytes per node.
+
+    The tries are (re)built on the first lookup after L{add_segment_values}.
+    The root node has thousands of children, so its transitions are also
+    kept in a dictionary. Most of the other nodes have a single child,
+    which is compared directly instead of being searched for.
+    L{match_all_ends} and L{match_all_starts}, which are used for parsing,
+    walk the tries without a method call for each position.
+    """
+    def __init__(self):
+        self._segment_values = dict()           # segments not yet built
+        self._first = self._chars = None        # forward trie
+        self._is_word = None                    # forward trie node -> 1/0
+        self._values = None                     # forward trie node -> values
+        self._root = None                       # forward trie root children
+        self._rfirst = self._rchars = None      # reversed trie
+        self._is_end = None                     # reversed trie node -> 1/0
+        self._rroot = None                      # reversed trie root children
+        self.max_length = 0
+
+    def add_segment_values(self, segment_values):
+        """add a sequence of known segments and their values.
+
+        Can be called multiple times. Each segment may have several values.
+
+        @param segment_values: (segment, value) tuples
+        @type segment_values: iterable
+        """
+        if self._first is not None:
+            # Already built: recover the segments from the trie
+            self._segment_values = dict((segment, list(values))
+                                        for segment, values in self._items())
+            self._first = None
+        seg_values = self._segment_values
+        for segment, value in segment_values:
+            values = seg_values.setdefault(segment, [])
+            if value not in values:
+                values.append(value)
+            if len(segment) > self.max_length:
+                self.max_length = len(segment)
+
+    def _items(self):
+        # Depth-first walk of the forward trie: yields (segment, values)
+        first = self._first
+        chars = self._chars
+        stack = [(0, '')]
+        while stack:
+            node, prefix = stack.pop()
+            if self._is_word[node]:
+                yield prefix, self._node_values(node)
+            for child in range(first[node], first[node+1]):
+                stack.append((child, prefix + chr(chars[child])))
+
+    def _build(self):
+        segments = list(self._segment_values)
+        self._first, self._chars, nodes = make_trie(segments)
+        self._is_word = bytearray(len(self._first) - 1)
+        self._values = [None] * (len(self._first) - 1)
+        for segment, node in zip(segments, nodes):
+            self._is_word[node] = 1
+            self._values[node] = tuple(self._segment_values[segment])
+        self._rfirst, self._rchars, nodes = \
+            make_trie([segment[::-1] for segment in segments])
+        self._is_end = bytearray(len(self._rfirst) - 1)
+        for node in nodes:
+            self._is_end[node] = 1
+        self._root = dict((chr(self._chars[node]), node)
+                          for node in range(self._first[0], self._first[1]))
+        self._rroot = dict((chr(self._rchars[node]), node)
+                           for node in range(self._rfirst[0], self._rfirst[1]))
+        self._segment_values = None
+
+    def _node_values(self, node):
+        return self._values[node]
+
+    def values(self, segment):
+        """return the value of the segment
+
+        @param segment: a segment, or the beginning of a segment
+        @type: string
+        @return: all values of the segment, or None if segment is only the
+            beginning of a known segment
+        @rtype: set of values
+        @raise KeyError: if segment is not the beginning of any known segment
+        """
+        if self._first is None:
+            self._build()
+        first = self._first
+        chars = self._chars
+        node = self._root.get(segment[:1])
+        if node is None:
+            raise KeyError(segment)
+        for c in segment[1:]:
+            o = ord(c)
+            hi = first[node+1]
+            node = bisect_left(chars, o, first[node], hi)
+            if node == hi or chars[node] != o:
+                raise KeyError(segment)
+        if not self._is_word[node]:
+            return None
+        return set(self._node_values(node))
+
+    def match_end(self, s, start=0):
+        """return the endpoint of the longest segment from position start.
+
+        See L{MaximalMatch.match_end}.
+        """
+        if self._first is None:
+            self._build()
+        first = self._first
+        chars = self._chars
+        is_word = self._is_word
+        node = self._root.get(s[start:start+1])
+        if node is None:
+            return -1
+        end = start + 1 if is_word[node] else -1
+        for pos in range(start + 1, len(s)):
+            o = ord(s[pos])
+            lo = first[node]
+            hi = first[node+1]
+            if hi - lo == 1:
+                if chars[lo] != o:
+                    break
+                node = lo
+            else:
+                node = bisect_left(chars, o, lo, hi)
+                if node == hi or chars[node] != o:
+                    break
+            if is_word[node]:
+                end = pos + 1
+        return end
+
+    def match_start(self, s, end=None):
+        """return the start point of the longest segment to position end.
+
+        See L{MaximalMatch.match_start}.
+        """
+        if self._first is None:
+            self._build()
+        if end is None:
+            end = len(s)
+        first = self._rfirst
+        chars = self._rchars
+        is_end = self._is_end
+        node = self._rroot.get(s[end-1:end]) if end > 0 else None
+        if node is None:
+            return -1
+        start = end - 1 if is_end[node] else -1
+        for pos in range(end - 2, -1, -1):
+            o = ord(s[pos])
+            lo = first[node]
+            hi = first[node+1]
+            if hi - lo == 1:
+                if chars[lo] != o:
+                    break
+                node = lo
+            else:
+                node = bisect_left(chars, o, lo, hi)
+                if node == hi or chars[node] != o:
+                    break
+            if is_end[node]:
+                start = pos
+        return start
+
+    def match_all_ends(self, s):
+        """return the positions of the forward maximal match segmentation.
+
+        See L{MaximalMatch.match_all_ends}. This is L{match_end} at each
+        segment boundary in turn.
+        """
+        if self._first is None:
+            self._build()
+        first = self._first
+        chars = self._chars
+        is_word = self._is_word
+        root = self._root
+        length = len(s)
+        l = list()
+        pos = 0
+        while pos < length:
+            l.append(pos)
+            end = -1
+            node = root.get(s[pos])
+            if node is not None:
+                if is_word[node]:
+                    end = pos + 1
+                for p in range(pos + 1, length):
+                    o = ord(s[p])
+                    lo = first[node]
+                    hi = first[node+1]
+                    if hi - lo == 1:
+                        if chars[lo] != o:
+                            break
+                        node = lo
+                    else:
+                        node = bisect_left(chars, o, lo, hi)
+                        if node == hi or chars[node] != o:
+                            break
+                    if is_word[node]:
+                        end = p + 1
+            pos = pos + 1 if end == -1 else end
+        l.append(pos)
+        return l
+
+    def match_all_starts(self, s):
+        """return the positions of the backward maximal match segmentation.
+
+        See L{MaximalMatch.match_all_starts}. This is L{match_start} at
+        each segment boundary in turn.
+        """
+        if self._first is None:
+            self._build()
+        first = self._rfirst
+        chars = self._rchars
+        is_end = self._is_end
+        root = self._rroot
+        l = list()
+        pos = len(s)
+        while pos > 0:
+            l.append(pos)
+            start = -1
+            node = root.get(s[pos-1])
+            if node is not None:
+                if is_end[node]:
+                    start = pos - 1
+                for p in range(pos - 2, -1, -1):
+                    o = ord(s[p])
+                    lo = first[node]
+                    hi = first[node+1]
+                    if hi - lo == 1:
+                        if chars[lo] != o:
+                            break
+                        node = lo
+                    else:
+                        node = bisect_left(chars, o, lo, hi)
+                        if node == hi or chars[node] != o:
+                            break
+                    if is_end[node]:
+                        start = p
+            pos = pos - 1 if start == -1 else start
+        l.append(pos)
+        l.reverse()
+        return l
+
+    def match_ends(self, s, start=0):
+        """return the endpoints of all the segments from position start.
+
+        See L{MaximalMatch.match_ends}.
+        """
+        if self._first is None:
+            self._build()
+        first = self._first
+        chars = self._chars
+        is_word = self._is_word
+        ends = list()
+        node = self._root.get(s[start:start+1])
+        if node is None:
+            return ends
+        if is_word[node]:
+            ends.append(start + 1)
+        for pos in range(start + 1, len(s)):
+            o = ord(s[pos])
+            lo = first[node]
+            hi = first[node+1]
+            if hi - lo == 1:
+                if chars[lo] != o:
+                    break
+                node = lo
+            else:
+                node = bisect_left(chars, o, lo, hi)
+                if node == hi or chars[node] != o:
+                    break
+            if is_word[node]:
+                ends.append(pos + 1)
+        return ends
+
+    def save(self, fname, meta=None):
+        """write the tries to a file that can be opened with L{MappedMaximalMatch}.
+
+        The values must be strings that don't contain '\\x1f'.
+
+        @param fname: name of the file to write
+        @type fname: string
+        @param meta: information to store with the tries, e.g. to identify
+            the source files. Must be JSON serialisable.
+        @type meta: dictionary
+        """
+        if self._first is None:
+            self._build()
+        value_offsets = array('I', [0])
+        pool = bytearray()
+        for node in range(len(self._first) - 1):
+            if self._is_word[node]:
+                pool += ''.join(v + VALUE_SEP for v in self._node_values(node)).encode('utf-8')
+            value_offsets.append(len(pool))
+        header = json.dumps({'byteorder': sys.byteorder,
+                             'max_length': self.max_length,
+                             'nodes': len(self._first) - 1,
+                             'rnodes': len(self._rfirst) - 1,
+                             'meta': meta}).encode('utf-8')
+        header += b' ' * (-len(header) % 4)     # align the arrays
+        with open(fname, 'wb') as f:
+            f.write(TRIE_FILE_MAGIC)
+            f.write(array('I', [TRIE_FILE_VERSION, len(header)]).tobytes())
+            f.write(header)
+            for a in (self._first, self._chars, value_offsets,
+                      self._rfirst, self._rchars):
+                f.write(a.tobytes())
+            f.write(self._is_word)
+            f.write(self._is_end)
+            f.write(pool)
+
+# File format for TrieMaximalMatch.save() and MappedMaximalMatch
+TRIE_FILE_MAGIC = b'SEGTRIE\0'
+TRIE_FILE_VERSION = 1
+VALUE_SEP = '\x1f'
+
+class MappedMaximalMatch(TrieMaximalMatch):
+    """maximal matching directly from a file written by L{TrieMaximalMatch.save}.
+
+    The file is memory mapped and the trie arrays are used in place, so
+    opening it doesn't create any objects for the segments. Values are
+    decoded when they are looked up. The segments can't be changed.
+
+    @ivar meta: the meta information saved with the tries
+    @raise ValueError: if the file isn't a valid trie file for this
+        version and platform
+    """
+    def __init__(self, fname):
+        with open(fname, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        buf = memoryview(self._mmap)
+        self._buffers = [buf]
+        if buf[:len(TRIE_FILE_MAGIC)] != TRIE_FILE_MAGIC:
+            self.close()
+            raise ValueError('%s is not a trie file' % fname)
+        pos = len(TRIE_FILE_MAGIC)
+        version, header_len = buf[pos:pos+8].cast('I')
+        pos += 8
+        if version != TRIE_FILE_VERSION:
+            self.close()
+            raise ValueError('%s is version %d, expected %d'
+                             % (fname, version, TRIE_FILE_VERSION))
+        header = json.loads(bytes(buf[pos:pos+header_len]).decode('utf-8'))
+        pos += header_len
+        if header['byteorder'] != sys.byteorder:
+            self.close()
+            raise ValueError('%s has the wrong byte order' % fname)
+        self.meta = header['meta']
+        self.max_length = header['max_length']
+        n = header['nodes']
+        m = header['rnodes']
+
+        def section(length, fmt):
+            nonlocal pos
+            size = length * (4 if fmt == 'I' else 1)
+            view = buf[pos:pos+size].cast(fmt)
+            self._buffers.append(view)
+            pos += size
+            return view
+
+        self._first = section(n + 1, 'I')
+        self._chars = section(n, 'I')
+        self._value_offsets = section(n + 1, 'I')
+        self._rfirst = section(m + 1, 'I')
+        self._rchars = section(m, 'I')
+        self._is_word = section(n, 'B')
+        self._is_end = section(m, 'B')
+        self._pool = section(self._value_offsets[n], 'B')
+        self._root = dict((chr(self._chars[node]), node)
+                          for node in range(self._first[0], self._first[1]))
+        self._rroot = dict((chr(self._rchars[node]), node)
+                           for node in range(self._rfirst[0], self._rfirst[1]))
+
+    def add_segment_values(self, segment_values):
+        raise TypeError('segments of a MappedMaximalMatch cannot be changed')
+
+    def _node_values(self, node):
+        start = self._value_offsets[node]
+        end = self._value_offsets[node+1]
+        return bytes(self._pool[start:end]).decode('utf-8').split(VALUE_SEP)[:-1]
+
+    def close(self):
+        """release the memory mapped file."""
+        for view in reversed(self._buffers):
+            view.release()
+        self._buffers = []
+        self._mmap.close()
+
 class MaximalMatch_old(object):
     """
     """
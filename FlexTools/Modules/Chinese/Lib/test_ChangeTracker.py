@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+#
+#   test_ChangeTracker
+#
+#   Checks that ChangeTracker skips the objects recorded in the last run,
+#   and that the saved state is discarded when a data file or the
+#   module's settings change. Nothing is skipped or saved when it is
+#   disabled.
+#
+
+import os
+
+import datafiles
+from ChineseUtilities import ChangeTracker
+
+
+# --- Test data ---
+
+class FakeProject(object):
+    def ProjectName(self):
+        return "Test project"
+
+settings = {"version" : "1.0"}
+
+
+def makeTracker(folder, dataFile, settings=settings, enabled=True):
+    return ChangeTracker(FakeProject(), "Test module", [dataFile],
+                         settings, enabled=enabled, folder=str(folder))
+
+
+def recordRun(folder, dataFile):
+    # A first run that records two objects.
+    tracker = makeTracker(folder, dataFile)
+    assert not tracker.Unchanged("guid-1", "中国", "zhong1guo2")
+    tracker.Record("guid-1", "中国", "zhong1guo2")
+    tracker.Record("guid-2", "人", None)
+    tracker.Save()
+
+
+# --- Testing ---
+
+def test_round_trip(tmp_path):
+    dataFile = tmp_path / "words.txt"
+    dataFile.write_text("中国\tzhong1guo2\n", encoding="utf-8")
+    recordRun(tmp_path, dataFile)
+    assert os.path.exists(tmp_path / "Test project - Test module.json")
+
+    tracker = makeTracker(tmp_path, dataFile)
+    assert tracker.Unchanged("guid-1", "中国", "zhong1guo2")
+    assert tracker.Unchanged("guid-2", "人", None)
+    assert not tracker.Unchanged("guid-2", "人", "")    # Field changed
+    assert not tracker.Unchanged("guid-3", "人", None)  # Not recorded
+    assert tracker.Skipped == 2
+    tracker.Save()
+
+    # Only the objects found Unchanged or recorded are kept.
+    tracker = makeTracker(tmp_path, dataFile)
+    assert tracker.Unchanged("guid-1", "中国", "zhong1guo2")
+    assert not tracker.Unchanged("guid-3", "人", None)
+
+def test_data_file_changed(tmp_path):
+    dataFile = tmp_path / "words.txt"
+    dataFile.write_text("中国\tzhong1guo2\n", encoding="utf-8")
+    recordRun(tmp_path, dataFile)
+
+    dataFile.write_text("中国\tzhong1guo2\n人\tren2\n", encoding="utf-8")
+    tracker = makeTracker(tmp_path, dataFile)
+    assert not tracker.Unchanged("guid-1", "中国", "zhong1guo2")
+    assert tracker.Skipped == 0
+
+def test_settings_changed(tmp_path):
+    dataFile = tmp_path / "words.txt"
+    dataFile.write_text("中国\tzhong1guo2\n", encoding="utf-8")
+    recordRun(tmp_path, dataFile)
+
+    tracker = makeTracker(tmp_path, dataFile, settings={"version" : "1.1"})
+    assert not tracker.Unchanged("guid-1", "中国", "zhong1guo2")
+    assert tracker.Skipped == 0
+
+def test_disabled(tmp_path):
+    dataFile = tmp_path / "words.txt"
+    dataFile.write_text("中国\tzhong1guo2\n", encoding="utf-8")
+    recordRun(tmp_path, dataFile)
+
+    tracker = makeTracker(tmp_path, dataFile, enabled=False)
+    assert not tracker.Unchanged("guid-1", "中国", "zhong1guo2")
+    tracker.Record("guid-3", "人", None)
+    os.remove(tmp_path / "Test project - Test module.json")
+    tracker.Save()
+    assert os.listdir(tmp_path) == ["words.txt"]
+
+def test_state_folder():
+    # The state is kept per user, not in the (possibly read-only) install.
+    assert not datafiles.statepath.startswith(os.path.dirname(datafiles.__file__))
@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+#
+#   test_ChineseBatch
+#
+#   Checks that the batch functions of ChineseParser and SortStringDB
+#   give the same results, in the same order, as calculating each field
+#   separately. A small sample dictionary and sort data are used, so the
+#   bundled data files aren't needed.
+#
+
+import os
+
+import datafiles
+from ChineseUtilities import ChineseParser, SortStringDB, MakeSortString
+
+
+# --- Test data ---
+
+dictionary = """\
+中	zhong1
+国	guo2
+中国	Zhong1guo2
+话	hua4
+中国话	Zhong1guo2hua4
+人	ren2
+人民	ren2min2
+民	min2
+公园	gong1yuan2
+你好	ni3 hao3
+好	hao3
+枣	zao3
+红	hong2
+色	se4
+枣红	zao3hong2
+红色	hong2se4
+"""
+
+# (hanzi, tonenum) fields, including repeats
+tonenumFields = [
+           ("中国话",       "Zhong1guo2hua4"),  # Correct
+           ("中国话",       ""),                # Generate the tone number
+           ("中国话",       "zhong1guo2hua4"),  # Wrong
+           (" 中国话 ",     ""),                # Stripped
+           ("人民公园",      "ren2min2 gong1yuan2"),
+           ("枣红色",       ""),                # Ambiguous parse
+           ("枣红色",       "zao3 hong2se4"),   # One of the parses
+           ("去人民公园",     ""),                # 去 isn't in the dictionary
+           ("",          "ni3 hao3"),        # Chinese deleted
+           ("",          ""),
+           ("中国话",       "Zhong1guo2hua4"),
+           ]
+
+
+# {hz : (hz, [pinyin], stroke count, strokes)}, as in char_dat.pkl
+sortData = {
+           "中" : ("中", ["zhong1", "zhong4"], 4, "2512"),
+           "国" : ("国", ["guo2"], 8, "25112141"),
+           "话" : ("话", ["hua4", "hua5"], 8, "45312251"),
+           "绿" : ("绿", ["lu4", "lu:4"], 11, "55151124134"),
+           "红" : ("红", ["gong1", "hong2"], 6, "551121"),
+           }
+
+# (hanzi, tonenum, sortString) fields, including repeats
+sortFields = [
+           ("中国话",       "Zhong1guo2hua4",   ""),
+           ("中国话",       "Zhong1guo2hua4",   "zhong1@D2512;guo2@H25112141;hua4@H45312251"),
+           ("绿",         "lu:4",             ""),
+           ("中国",        "zhong1",           "x"),  # Different length
+           ("中国",        "zhong1guo3",       ""),   # Pinyin mismatch
+           ("中去",        "zhong1qu4",        ""),   # 去 isn't in the data
+           ("红",         "gong1|hong2",      "x"),  # Ambiguous tone number
+           ("",          "hong2",            "x"),  # Blank Chinese
+           ("",          "",                 ""),
+           ("中国话",       "Zhong1guo2hua4",   ""),
+           ]
+
+
+def makeDictionary(folder):
+    fname = os.path.join(folder, "words.txt")
+    with open(fname, "w", encoding="utf-8") as file:
+        file.write(dictionary)
+    return fname
+
+
+def makeSortFiles(folder):
+    # Returns the names of a ch2sort.txt-style text file and a sort data
+    # pickle with the same data.
+    textFile = os.path.join(folder, "ch2sort.txt")
+    with open(textFile, "w", encoding="utf-8") as file:
+        for hz, (c, pinyin, strokeCount, strokes) in sortData.items():
+            file.write("\t".join([hz] + [field for py in pinyin for field in
+                                         (py, MakeSortString(py, strokeCount, strokes))]))
+            file.write("\n")
+    pickleFile = os.path.join(folder, "char_dat.pkl")
+    datafiles.saveSortData(sortData, pickleFile)
+    return textFile, pickleFile
+
+
+# --- Testing ---
+
+def test_tonenum_batch(tmp_path):
+    dictFile = makeDictionary(tmp_path)
+    for settings in ({},
+                     {"cacheSize" : 2},
+                     {"latticeParses" : 4}):
+        parser = ChineseParser(dictFile, **settings)
+        expected = [(key,) + parser.CalculateTonenum(hanzi, tonenum)
+                    for key, (hanzi, tonenum) in enumerate(tonenumFields)]
+        items = [(key, hanzi, tonenum)
+                 for key, (hanzi, tonenum) in enumerate(tonenumFields)]
+        assert list(parser.CalculateTonenumBatch(items)) == expected, settings
+        assert list(parser.CalculateTonenumBatch([])) == []
+
+def test_tonenum_results(tmp_path):
+    parser = ChineseParser(makeDictionary(tmp_path))
+    items = [(key, hanzi, tonenum)
+             for key, (hanzi, tonenum) in enumerate(tonenumFields)]
+    results = {key : (newTonenum, msg) for key, newTonenum, msg
+               in parser.CalculateTonenumBatch(items)}
+    assert results[0] == (None, None)
+    assert results[1] == ("Zhong1guo2hua4", None)
+    assert results[2][0] is None and "Expected" in results[2][1]
+    assert results[3] == ("Zhong1guo2hua4", None)
+    assert results[4] == (None, None)
+    assert results[5] == ("zao3hong2 se4 | zao3 hong2se4", None)
+    assert results[6] == (None, None)
+    assert results[7][0] is None and "Unknown" in results[7][1]
+    assert results[8] == ("", None)
+    assert results[9] == (None, None)
+
+def test_sort_string_batch(tmp_path):
+    items = [(key, hanzi, tonenum, sortString)
+             for key, (hanzi, tonenum, sortString) in enumerate(sortFields)]
+    results = []
+    for fname in makeSortFiles(tmp_path):
+        sortDB = SortStringDB(fname)
+        expected = [(key,) + sortDB.CalculateSortString(hanzi, tonenum, sortString)
+                    for key, hanzi, tonenum, sortString in items]
+        assert list(sortDB.CalculateSortStringBatch(items)) == expected, fname
+        assert list(sortDB.CalculateSortStringBatch([])) == []
+        results.append(expected)
+    # The text file and the pickle give the same results
+    assert results[0] == results[1]
+
+def test_sort_string_results(tmp_path):
+    sortDB = SortStringDB(makeSortFiles(tmp_path)[1])
+    items = [(key, hanzi, tonenum, sortString)
+             for key, (hanzi, tonenum, sortString) in enumerate(sortFields)]
+    results = {key : (newSortString, msg) for key, newSortString, msg
+               in sortDB.CalculateSortStringBatch(items)}
+    assert results[0] == ("zhong1@D2512;guo2@H25112141;hua4@H45312251", None)
+    assert results[1] == (None, None)
+    assert results[2] == ("lu94AA55151124134", None)
+    assert results[3][0] == "" and "PY different length" in results[3][1]
+    # (Already blank, so not written)
+    assert results[4][0] is None and "PY mismatch" in results[4][1]
+    assert results[5][0] is None and "HZ not in DB" in results[5][1]
+    assert results[6][0] == "" and "Ambiguous" in results[6][1]
+    assert results[7] == ("", None)
+    assert results[8] == (None, None)
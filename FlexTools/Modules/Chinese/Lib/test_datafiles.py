@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+#
+#   test_datafiles
+#
+#   Checks the columnar sort data store (datafiles.SortDataStore) against
+#   the sort data dictionary it is made from, and that the store compiled
+#   from a sort data pickle is reused, refreshed and rebuilt correctly.
+#
+
+import os
+
+import datafiles
+
+
+# --- Test data ---
+
+# {hz : (hz, [pinyin], stroke count, strokes)}, as in char_dat.pkl
+sortData = {
+           "中" : ("中", ["zhong1", "zhong4"], 4, "2512"),
+           "国" : ("国", ["guo2"], 8, "25112141"),
+           "绿" : ("绿", ["lu:4", "lu4"], 11, "55151242534"),
+           "一" : ("一", ["yi1"], 1, "1"),
+           "𠀀" : ("𠀀", ["qiu1"], 5, "15234"),     # Outside the BMP
+           }
+
+
+def checkStore(store):
+    assert len(store) == len(sortData)
+    assert list(store) == sorted(sortData)
+    for hz, (c, pinyin, strokeCount, strokes) in sortData.items():
+        assert hz in store
+        assert store[hz] == (pinyin, strokeCount, strokes)
+    assert "去" not in store
+    try:
+        store["去"]
+    except KeyError:
+        pass
+    else:
+        assert False, "KeyError expected for an unknown character"
+
+
+# --- Testing ---
+
+def test_store():
+    store = datafiles.SortDataStore(datafiles.packSortData(sortData,
+                                                           {"source" : "test"}))
+    checkStore(store)
+    assert store.meta == {"source" : "test"}
+
+def test_invalid_store():
+    data = datafiles.packSortData(sortData)
+    for badData in (b"", b"NOTSORT\0" + data[8:]):
+        try:
+            datafiles.SortDataStore(badData)
+        except ValueError:
+            pass
+        else:
+            assert False, "ValueError expected"
+
+def test_compiled_store(tmp_path):
+    pickleFile = os.path.join(tmp_path, "char_dat.pkl")
+    compiledFile = datafiles.compiledName(pickleFile)
+    datafiles.saveSortData(sortData, pickleFile)
+
+    # Compiled on first use
+    checkStore(datafiles.loadSortDataStore(pickleFile))
+    assert os.path.exists(compiledFile)
+    checkStore(datafiles.loadSortDataStore(compiledFile))
+
+    # Reused while the pickle is unchanged
+    compiledTime = os.stat(compiledFile).st_mtime_ns
+    checkStore(datafiles.loadSortDataStore(pickleFile))
+    assert os.stat(compiledFile).st_mtime_ns == compiledTime
+
+    # Touching the pickle only updates the recorded modification time
+    os.utime(pickleFile, ns=(compiledTime, compiledTime + 10**9))
+    checkStore(datafiles.loadSortDataStore(pickleFile))
+    meta = datafiles.loadSortDataStore(compiledFile).meta
+    assert meta["source"]["mtime"] == compiledTime + 10**9
+    assert datafiles.isUnchanged(meta["source"], pickleFile)
+
+    # Rebuilt when the pickle changes
+    changed = dict(sortData)
+    changed["去"] = ("去", ["qu4"], 5, "12154")
+    datafiles.saveSortData(changed, pickleFile)
+    store = datafiles.loadSortDataStore(pickleFile)
+    assert store["去"] == (["qu4"], 5, "12154")
+    assert len(datafiles.loadSortDataStore(compiledFile)) == len(changed)
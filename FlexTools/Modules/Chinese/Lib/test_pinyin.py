@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+#
+#   test_pinyin
+#
+#   Checks the single-pass, table-driven tone number to Pinyin conversion
+#   (pinyin.tonenum_pinyin) against known results, and against the
+#   original regular expression version (pinyin.multipass_tonenum_pinyin).
+#
+
+import pinyin
+
+
+# --- Test data ---
+
+testSet = [
+           ("ni3 hao3",       "nǐ hǎo"),
+           ("Zhong1guo2hua4", "Zhōngguóhuà"),
+           ("lu:4",           "lǜ"),              # u-diaeresis
+           ("Lu:e4",          "Lüè"),
+           ("e^2",            "ế"),               # e-circumflex
+           ("Xi1an1",         "Xī’ān"),           # Apostrophe added
+           ("nu:3er2",        "nǚ’ér"),
+           ("xi1'an1",        "xī'ān"),           # Already has one
+           ("er3.duo5",       "ěr.duo"),          # Neutral tone
+           ("lao3lao5shi2shi2 .de5", "lǎolaoshíshí .de"),
+           ("sa1//huang3",    "sā//huǎng"),
+           ("HAO3",           "HǍO"),
+           ("ka3la1OK",       "kǎlā’OK"),         # Latin letters
+           ("ta1, ta1, ta1",  "tā, tā, tā"),
+           ("ma",             "ma"),              # No tone number
+           ("",               ""),
+           ]
+
+
+# --- Testing ---
+
+def test_known_results():
+    for tonenum, expected in testSet:
+        assert pinyin.tonenum_pinyin(tonenum) == expected, tonenum
+
+def test_same_as_multipass():
+    tests = [tonenum for tonenum, expected in testSet]
+    # Every syllable in the table, in lower, title and upper case,
+    # on its own and following another syllable (for the apostrophe.)
+    for syllable in list(pinyin.syllable_table):
+        for s in (syllable, syllable.title(), syllable.upper()):
+            tests.append(s)
+            tests.append("xi1" + s)
+    for s in tests:
+        assert pinyin.tonenum_pinyin(s) == pinyin.multipass_tonenum_pinyin(s), s
+
+def test_table_growth():
+    # Short tokens that aren't in the table are added to it; long
+    # ones aren't.
+    short = "Zhong1"
+    long = "Abcdefghij1"
+    pinyin.tonenum_pinyin(short + " " + long)
+    assert pinyin.syllable_table[short] == pinyin.multipass_tonenum_pinyin(short)
+    assert long not in pinyin.syllable_table
@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+#
+#   test_segmenter
+#
+#   Checks that the trie segmenters (TrieMaximalMatch and the memory
+#   mapped MappedMaximalMatch) give the same results as the dictionary
+#   based MaximalMatch, using a small sample dictionary.
+#
+
+import segmenter
+
+
+# --- Test data ---
+
+segmentValues = [
+           ("中",        "zhong1"),
+           ("中",        "zhong4"),          # Multiple values
+           ("中国",       "Zhong1guo2"),
+           ("中国话",      "Zhong1guo2hua4"),
+           ("中国人",      "Zhong1guo2ren2"),
+           ("国",        "guo2"),
+           ("话",        "hua4"),
+           ("人",        "ren2"),
+           ("人民",       "ren2min2"),
+           ("民",        "min2"),
+           ("公园",       "gong1yuan2"),
+           ("园",        "yuan2"),
+           ("你好",       "ni3 hao3"),
+           ("好",        "hao3"),
+           ("枣红",       "zao3hong2"),
+           ("红色",       "hong2se4"),
+           ("枣",        "zao3"),
+           ("红",        "hong2"),
+           ("色",        "se4"),
+           ("\N{FULLWIDTH COMMA}", ","),
+           ]
+
+testPhrases = [
+           "中国话",
+           "中国人民公园",
+           "你好\N{FULLWIDTH COMMA}中国",
+           "枣红色",                           # Ambiguous parse
+           "去人民公园",                        # 去 isn't known
+           "公",                               # Only the start of a word
+           "中中中",
+           "",
+           ]
+
+
+def makeSegmenters(folder):
+    # Returns [MaximalMatch, TrieMaximalMatch, MappedMaximalMatch]
+    # loaded with segmentValues. The trie file is saved in folder.
+    mm = segmenter.MaximalMatch()
+    mm.add_segment_values(segmentValues)
+    trie = segmenter.TrieMaximalMatch()
+    trie.add_segment_values(segmentValues)
+
+    fname = str(folder / "words.bin")
+    trie.save(fname, {"source" : "test"})
+    mapped = segmenter.MappedMaximalMatch(fname)
+    return [mm, trie, mapped]
+
+
+# --- Testing ---
+
+def test_match_functions(tmp_path):
+    mm, *tries = makeSegmenters(tmp_path)
+    for s in testPhrases:
+        for sgmtr in tries:
+            name = type(sgmtr).__name__
+            assert sgmtr.match_all_ends(s) == mm.match_all_ends(s), (name, s)
+            assert sgmtr.match_all_starts(s) == mm.match_all_starts(s), (name, s)
+            for i in range(len(s)):
+                assert sgmtr.match_end(s, i) == mm.match_end(s, i), (name, s, i)
+                assert sgmtr.match_start(s, i+1) == mm.match_start(s, i+1), (name, s, i)
+                assert sgmtr.match_ends(s, i) == mm.match_ends(s, i), (name, s, i)
+
+def test_segmentations(tmp_path):
+    for sgmtr in makeSegmenters(tmp_path):
+        assert sgmtr.match_all_ends("中国人民公园") == [0, 3, 4, 6]
+        assert sgmtr.match_all_starts("中国人民公园") == [0, 2, 4, 6]
+        # Forward and backward maximal match differ for an ambiguous parse
+        assert sgmtr.match_all_ends("枣红色") == [0, 2, 3]
+        assert sgmtr.match_all_starts("枣红色") == [0, 1, 3]
+        # Unknown characters are single segments
+        assert sgmtr.match_all_ends("去人民") == [0, 1, 3]
+        assert sgmtr.match_end("去人民") == -1
+
+def test_values(tmp_path):
+    for sgmtr in makeSegmenters(tmp_path):
+        assert sgmtr.values("中") == {"zhong1", "zhong4"}
+        assert sgmtr.values("中国话") == {"Zhong1guo2hua4"}
+        assert sgmtr.values("公") is None       # Only the start of 公园
+        try:
+            sgmtr.values("去")
+        except KeyError:
+            pass
+        else:
+            assert False, "KeyError expected for an unknown segment"
+
+def test_trie_additions():
+    # Segments can be added after the trie has been built.
+    trie = segmenter.TrieMaximalMatch()
+    trie.add_segment_values(segmentValues[:5])
+    assert trie.match_end("中国人民") == 3
+    trie.add_segment_values(segmentValues[5:])
+    assert trie.match_all_ends("中国人民") == [0, 3, 4]
+    assert trie.values("人民") == {"ren2min2"}
+
+def test_mapped_file(tmp_path):
+    mapped = makeSegmenters(tmp_path)[2]
+    assert mapped.meta == {"source" : "test"}
+    assert mapped.max_length == 3
+    try:
+        mapped.add_segment_values([("去", "qu4")])
+    except TypeError:
+        pass
+    else:
+        assert False, "TypeError expected"
+    mapped.close()
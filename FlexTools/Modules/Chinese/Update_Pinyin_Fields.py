@@ -10,14 +10,13 @@
 #   Platforms: Python .NET and IronPython
 #
 
-import unicodedata
-
 from flextoolslib import *
 
 import site
 site.addsitedir(r"Lib")
 
-from ChineseUtilities import ChineseWritingSystems, TonenumberToPinyin
+from ChineseUtilities import ChineseWritingSystems, TonenumberToPinyinMany
+from ChineseUtilities import ChangeTracker
 
 #----------------------------------------------------------------
 # Documentation for the user:
@@ -43,43 +42,66 @@ changes are enabled.)
 See Chinese Utilities Help.pdf for detailed information on configuration and usage.
 """ }
                  
+#----------------------------------------------------------------
+# Configurables:
+
+# Set INCREMENTAL to True to skip the senses and reversal entries that
+# haven't changed since the last run of this module on the project.
+
+INCREMENTAL = False
+
 #----------------------------------------------------------------
 # The main processing function
 
-def UpdatePinyinFields(project, report, modifyAllowed=False):
+def UpdatePinyinFields(project, report, modifyAllowed, writeBuffer):
+
+    # The fields are read first, then the Pinyin is calculated for all
+    # of them together (__CalcNewPinyins), and then the changes are
+    # written.
+
+    def __CalcNewPinyins(fields):
+        # fields: list of (key, tonenum, pinyin)
+        # Returns a list of tuples: (key, tonenum, pinyin, newPinyin, msg)
+        #   newPinyin: new value for the Pinyin field (NFD)
+        #   msg: a warning message about the data, or None
+
+        def __isAmbiguous(tonenum):
+            return '|' in tonenum or '[' in tonenum
+
+        # Clear the Pinyin field if the tonenum is blank, or if ambiguity
+        # in the tonenum field hasn't been resolved.
+        tonenums = [tonenum if tonenum and not __isAmbiguous(tonenum) else ""
+                    for key, tonenum, pinyin in fields]
+
+        results = []
+        for (key, tonenum, pinyin), newPinyin in \
+                zip(fields, TonenumberToPinyinMany(tonenums)):
+            msg = None
+            if tonenum and __isAmbiguous(tonenum):
+                msg = "Ambiguous tone number: %s" % tonenum
+            results.append((key, tonenum, pinyin, newPinyin, msg))
+        return results
 
-    def __CalcNewPinyin(project, tonenum, pinyin):
+    def __ReadSensePinyin(project, sense, entry, fields):
         # Note that project is passed to each of these local functions otherwise
         # project is treated as a global and isn't released for garbage collection.
         # That keeps the project locked so FT has to be restarted to use
         # that project again.
-        # Returns a tuple: (newPinyin, msg)
-        #   newPinyin: new value for the Pinyin field
-        #   msg: a warning message about the data, or None
+        tonenum = project.LexiconGetSenseGloss(sense, ChineseTonenumWS)
+        pinyin  = project.LexiconGetSenseGloss(sense, ChinesePinyinWS)
+        if not Tracker.Unchanged(sense.Guid, tonenum, pinyin):
+            fields.append(((sense, entry), tonenum, pinyin))
 
-        msg = None
-        if tonenum:
-            if '|' in tonenum or '[' in tonenum: 
-                msg = "Ambiguous tone number: %s" % tonenum
-                # Clear the Pinyin field if ambiguity in 
-                # the tonenum field hasn't been resolved
-                newPinyin = ""
-            else:
-                newPinyin = TonenumberToPinyin(tonenum)
-        else:
-            newPinyin = ""              # Clear if the tonenum is blank
-                
-        return (unicodedata.normalize('NFD', newPinyin), msg)
+        # Subentries
+        for se in sense.SensesOS:
+            __ReadSensePinyin(project, se, entry, fields)
 
-    def __WriteSensePinyin(project, sense, entry):
+    def __WriteSensePinyin(project, sense, entry, tonenum, pinyin, newPinyin, msg):
         global NumWarnings
         global UpdatedSenses
         
-        tonenum = project.LexiconGetSenseGloss(sense, ChineseTonenumWS)
-        pinyin  = project.LexiconGetSenseGloss(sense, ChinesePinyinWS)
         headword = project.LexiconGetHeadword(entry)
 
-        newPinyin, msg = __CalcNewPinyin(project, tonenum, pinyin)
         if msg:
             report.Warning("    %s: %s" % (headword, msg),
                            project.BuildGotoURL(entry))
@@ -88,23 +110,31 @@ def UpdatePinyinFields(project, report, modifyAllowed=False):
             report.Info(("    Updating '%s': %s > %s" if modifyAllowed else
                          "    '%s' needs updating: %s > %s") \
                          % (headword, tonenum, newPinyin))
-            if modifyAllowed:
-                project.LexiconSetSenseGloss(sense, newPinyin, ChinesePinyinWS)
+            writeBuffer.SetSenseGloss(sense, newPinyin, ChinesePinyinWS)
             UpdatedSenses += 1
+        __RecordDone(sense, tonenum, pinyin, newPinyin, msg)
 
-        # Subentries
-        for se in sense.SensesOS:
-            __WriteSensePinyin(project, se, entry)
+    def __ReadReversalPinyin(project, entry, fields):
+        tonenum = project.ReversalGetForm(entry, ChineseTonenumWS)
+        pinyin  = project.ReversalGetForm(entry, ChinesePinyinWS)
+        if not Tracker.Unchanged(entry.Guid, tonenum, pinyin):
+            fields.append((entry, tonenum, pinyin))
 
-    def __WriteReversalPinyin(project, entry):
+        # Subentries (Changed from OC to OS in FW8)
+        try:
+            subentries = entry.SubentriesOS
+        except AttributeError:
+            subentries = entry.SubentriesOC
+            
+        for se in subentries:
+            __ReadReversalPinyin(project, se, fields)
+
+    def __WriteReversalPinyin(project, entry, tonenum, pinyin, newPinyin, msg):
         global NumWarnings
         global UpdatedReversals
         
-        tonenum = project.ReversalGetForm(entry, ChineseTonenumWS)
-        pinyin  = project.ReversalGetForm(entry, ChinesePinyinWS)
         reversalForm  = project.ReversalGetForm(entry, ChineseWS)
 
-        newPinyin, msg = __CalcNewPinyin(project, tonenum, pinyin)
         if msg:
             report.Warning("    %s: %s" % (reversalForm, msg),
                            project.BuildGotoURL(entry))
@@ -113,18 +143,15 @@ def UpdatePinyinFields(project, report, modifyAllowed=False):
             report.Info(("    Updating '%s': %s > %s" if modifyAllowed else
                          "    '%s' needs updating: %s > %s") \
                          % (reversalForm, tonenum, newPinyin))
-            if modifyAllowed:
-                project.ReversalSetForm(entry, newPinyin, ChinesePinyinWS)
+            writeBuffer.SetReversalForm(entry, newPinyin, ChinesePinyinWS)
             UpdatedReversals += 1
+        __RecordDone(entry, tonenum, pinyin, newPinyin, msg)
 
-        # Subentries (Changed from OC to OS in FW8)
-        try:
-            subentries = entry.SubentriesOS
-        except AttributeError:
-            subentries = entry.SubentriesOC
-            
-        for se in subentries:
-            __WriteReversalPinyin(project, se)
+    def __RecordDone(obj, tonenum, pinyin, newPinyin, msg):
+        # Objects with warnings, or changes not yet written, are
+        # reported again next time.
+        if not msg and (newPinyin == pinyin or modifyAllowed):
+            Tracker.Record(obj.Guid, tonenum, newPinyin)
 
     global NumWarnings 
     global UpdatedSenses
@@ -143,6 +170,10 @@ def UpdatePinyinFields(project, report, modifyAllowed=False):
         report.Info("Using these writing systems:")
         report.Info("    Tone number Pinyin: %s" % project.WSUIName(ChineseTonenumWS))
         report.Info("    Chinese Pinyin field: %s" % project.WSUIName(ChinesePinyinWS))
+
+    Tracker = ChangeTracker(project, "Update_Pinyin_Fields",
+                            settings={"version" : docs[FTM_Version]},
+                            enabled=INCREMENTAL)
    
     # Lexicon Glosses
 
@@ -152,10 +183,14 @@ def UpdatePinyinFields(project, report, modifyAllowed=False):
     NumWarnings = 0
     UpdatedSenses = 0
 
+    fields = []
     for entryNumber, entry in enumerate(project.LexiconAllEntries()):
         report.ProgressUpdate(entryNumber)
         for sense in entry.SensesOS:
-            __WriteSensePinyin(project, sense, entry)
+            __ReadSensePinyin(project, sense, entry, fields)
+
+    for (sense, entry), tonenum, pinyin, newPinyin, msg in __CalcNewPinyins(fields):
+        __WriteSensePinyin(project, sense, entry, tonenum, pinyin, newPinyin, msg)
 
     if NumWarnings > 0:
         report.Info("  %d warnings" % NumWarnings)
@@ -174,9 +209,13 @@ def UpdatePinyinFields(project, report, modifyAllowed=False):
             report.ProgressStart(index.AllEntries.Count, "Reversal index")
             report.Info("Updating Pinyin for '%s' reversal index"
                         % project.WSUIName(ChineseWS))
+            fields = []
             for entryNumber, entry in enumerate(project.ReversalEntries(ChineseWS)):
                 report.ProgressUpdate(entryNumber)
-                __WriteReversalPinyin(project, entry)
+                __ReadReversalPinyin(project, entry, fields)
+
+            for entry, tonenum, pinyin, newPinyin, msg in __CalcNewPinyins(fields):
+                __WriteReversalPinyin(project, entry, tonenum, pinyin, newPinyin, msg)
                 
             if NumWarnings > 0:
                 report.Info("  %d warnings" % NumWarnings)
@@ -185,6 +224,10 @@ def UpdatePinyinFields(project, report, modifyAllowed=False):
                          "  %d %s to update") \
                          % (UpdatedReversals, "entry" if (UpdatedReversals==1) else "entries"))
 
+    if INCREMENTAL:
+        report.Info("  %d unchanged %s skipped"
+                    % (Tracker.Skipped, "item" if (Tracker.Skipped==1) else "items"))
+    Tracker.Save()
 
 #----------------------------------------------------------------
 
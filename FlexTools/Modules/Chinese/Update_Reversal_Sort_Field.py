@@ -18,7 +18,9 @@ from flextoolslib import *
 import site
 site.addsitedir(r"Lib")
 
-from ChineseUtilities import SortStringDB, ChineseWritingSystems
+from ChineseUtilities import SharedSortStringDB, ChineseWritingSystems
+from ChineseUtilities import ChangeTracker
+import datafiles
 
 #----------------------------------------------------------------
 # Documentation for the user:
@@ -59,16 +61,26 @@ by stroke count, and finally by stroke order. This follows the ordering in
 See Chinese Utilities Help.pdf for detailed information on configuration and usage.
 """ }
                  
+#----------------------------------------------------------------
+# Configurables:
+
+# Set INCREMENTAL to True to skip the reversal entries that haven't
+# changed since the last run of this module on the project.
+# Everything is checked again if the sort data changes.
+
+INCREMENTAL = False
+
 #----------------------------------------------------------------
 # The main processing function
 
 UpdatedSortStrings = 0
 
-def UpdateReversalSortFields(project, report, modifyAllowed=False):
+def UpdateReversalSortFields(project, report, modifyAllowed, writeBuffer):
 
-    
-    def __WriteSortString(project, entry):
-        global UpdatedSortStrings
+    # The fields are read first, then the sort strings are calculated
+    # together (SortDB.CalculateSortStringBatch), and then written.
+
+    def __ReadSortString(project, entry, fields):
         # Note that project is passed to each of these local functions otherwise
         # project is treated as a global and isn't released for garbage collection.
         # That keeps the project locked so FT has to be restarted to use
@@ -77,8 +89,12 @@ def UpdateReversalSortFields(project, report, modifyAllowed=False):
         hz = project.ReversalGetForm(entry, ChineseWS)
         tn = project.ReversalGetForm(entry, ChineseTonenumWS)
         ss = project.ReversalGetForm(entry, ChineseSortWS)
+        if not Tracker.Unchanged(entry.Guid, hz, tn, ss):
+            fields.append(((entry, hz, tn, ss), hz, tn, ss))
+
+    def __WriteSortString(project, entry, hz, tn, ss, newSortString, msg):
+        global UpdatedSortStrings
 
-        newSortString, msg = SortDB.CalculateSortString(hz, tn, ss)
         if msg:
             report.Warning("    %s: %s" % (hz, msg),
                            project.BuildGotoURL(entry))
@@ -86,9 +102,16 @@ def UpdateReversalSortFields(project, report, modifyAllowed=False):
             report.Info(("    Updating %s: (%s + %s) > %s" if modifyAllowed else
                          "    %s needs updating: (%s + %s) > %s") \
                          % (hz, hz, tn, newSortString))
-            if modifyAllowed:
-                project.ReversalSetForm(entry, newSortString, ChineseSortWS)
+            writeBuffer.SetReversalForm(entry, newSortString, ChineseSortWS)
             UpdatedSortStrings += 1
+
+        # Entries with warnings, or changes not yet written, are
+        # reported again next time.
+        if not msg:
+            if newSortString is None:
+                Tracker.Record(entry.Guid, hz, tn, ss)
+            elif modifyAllowed:
+                Tracker.Record(entry.Guid, hz, tn, newSortString)
                 
         # (Subentries don't need the sort string)
 
@@ -105,20 +128,32 @@ def UpdateReversalSortFields(project, report, modifyAllowed=False):
         report.Info("    Tone number Pinyin: %s" % project.WSUIName(ChineseTonenumWS))
         report.Info("    Chinese sort field: %s" % project.WSUIName(ChineseSortWS))
 
-    SortDB = SortStringDB()
+    SortDB = SharedSortStringDB()
+    Tracker = ChangeTracker(project, "Update_Reversal_Sort_Field",
+                            [datafiles.SortPickle],
+                            {"version" : docs[FTM_Version]},
+                            enabled=INCREMENTAL)
 
     index = project.ReversalIndex(ChineseWS)
     if index:
         report.ProgressStart(index.AllEntries.Count)
         report.Info("Updating sort strings for '%s' reversal index"
                     % project.WSUIName(ChineseWS))
+        fields = []
         for entryNumber, entry in enumerate(project.ReversalEntries(ChineseWS)):
             report.ProgressUpdate(entryNumber)
-            __WriteSortString(project, entry)
+            __ReadSortString(project, entry, fields)
+
+        for (entry, hz, tn, ss), newSortString, msg in SortDB.CalculateSortStringBatch(fields):
+            __WriteSortString(project, entry, hz, tn, ss, newSortString, msg)
     
     report.Info(("  %d %s updated" if modifyAllowed else
                  "  %d %s to update") \
                  % (UpdatedSortStrings, "entry" if (UpdatedSortStrings==1) else "entries"))
+    if INCREMENTAL:
+        report.Info("  %d unchanged %s skipped"
+                    % (Tracker.Skipped, "entry" if (Tracker.Skipped==1) else "entries"))
+    Tracker.Save()
 
 #----------------------------------------------------------------
 
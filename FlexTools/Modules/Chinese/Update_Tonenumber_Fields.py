@@ -15,7 +15,9 @@ from flextoolslib import *
 import site
 site.addsitedir(r"Lib")
 
-from ChineseUtilities import ChineseWritingSystems, ChineseParser
+from ChineseUtilities import ChineseWritingSystems, SharedChineseParser
+from ChineseUtilities import ChineseProcessPool, ChangeTracker
+import datafiles
 
 
 #----------------------------------------------------------------
@@ -59,6 +61,34 @@ Note: So that manual edits are not lost, this Module will not over-write the Pin
 See Chinese Utilities Help.pdf for detailed information on configuration and usage.
 """ }
 
+#----------------------------------------------------------------
+# Configurables:
+
+# Reversal entries and glosses often repeat the same Chinese. The parses
+# of this many distinct Hanzi strings are remembered so that repeats
+# aren't parsed again. Set to 0 to turn off the cache.
+
+TONENUM_CACHE_SIZE = 10000
+
+# For very large lexicons and reversal indexes, the tone numbers can be
+# calculated in this many worker processes on a multi-core computer.
+# 0 calculates them in the FlexTools process.
+
+PROCESSES = 0
+
+# Ambiguous Chinese is normally found by comparing the forward and backward
+# maximal match parses. Set LATTICE_PARSES to a number to instead consider
+# every segmentation, and list up to that many alternatives that have the
+# fewest words. 0 uses the maximal match parses.
+
+LATTICE_PARSES = 0
+
+# Set INCREMENTAL to True to skip the senses and reversal entries that
+# haven't changed since the last run of this module on the project.
+# Everything is checked again if the dictionary or the settings change.
+
+INCREMENTAL = False
+
                  
 #----------------------------------------------------------------
 # The main processing function
@@ -66,15 +96,26 @@ See Chinese Utilities Help.pdf for detailed information on configuration and usa
 UpdatedSenses = 0
 UpdatedReversals = 0
 
-def UpdateTonenumberFields(project, report, modifyAllowed=False):
+def UpdateTonenumberFields(project, report, modifyAllowed, writeBuffer):
 
-    def __WriteSenseTonenum(project, entry, sense):
-        global UpdatedSenses
+    # The fields are read first, then the tone numbers are calculated
+    # together (Parser.CalculateTonenumBatch), and then the changes are
+    # written.
+
+    def __ReadSenseTonenum(project, entry, sense, fields):
         hz = project.LexiconGetSenseGloss(sense, ChineseWS)
         tn = project.LexiconGetSenseGloss(sense, ChineseTonenumWS)
+        if not Tracker.Unchanged(sense.Guid, hz, tn):
+            fields.append(((entry, sense, hz, tn), hz, tn))
+
+        # Subentries
+        for se in sense.SensesOS:
+            __ReadSenseTonenum(project, entry, se, fields)
+
+    def __WriteSenseTonenum(project, entry, sense, hz, tn, newTonenum, msg):
+        global UpdatedSenses
         headword = project.LexiconGetHeadword(entry)
 
-        newTonenum, msg = Parser.CalculateTonenum(hz, tn)
         if msg:
             report.Warning("    %s: %s" % (headword, msg),
                            project.BuildGotoURL(entry))
@@ -82,20 +123,28 @@ def UpdateTonenumberFields(project, report, modifyAllowed=False):
             report.Info(("    Updating %s: %s > %s" if modifyAllowed else
                          "    %s needs updating: %s > %s") \
                          % (headword, hz, newTonenum))
-            if modifyAllowed:
-                project.LexiconSetSenseGloss(sense, newTonenum, ChineseTonenumWS)
+            writeBuffer.SetSenseGloss(sense, newTonenum, ChineseTonenumWS)
             UpdatedSenses += 1
-                                    
-        # Subentries
-        for se in sense.SensesOS:
-            __WriteSenseTonenum(project, entry, se)
+        __RecordDone(sense, hz, tn, newTonenum, msg)
 
-    def __WriteReversalTonenum(project, entry):
-        global UpdatedReversals
+    def __ReadReversalTonenum(project, entry, fields):
         hz = project.ReversalGetForm(entry, ChineseWS)
         tn = project.ReversalGetForm(entry, ChineseTonenumWS)
-        
-        newTonenum, msg = Parser.CalculateTonenum(hz, tn)
+        if not Tracker.Unchanged(entry.Guid, hz, tn):
+            fields.append(((entry, hz, tn), hz, tn))
+
+        # Subentries (Changed from OC to OS in FW8)
+        try:
+            subentries = entry.SubentriesOC
+        except AttributeError:
+            subentries = entry.SubentriesOS
+            
+        for se in subentries:
+            __ReadReversalTonenum(project, se, fields)
+
+    def __WriteReversalTonenum(project, entry, hz, tn, newTonenum, msg):
+        global UpdatedReversals
+
         if msg:
             report.Warning("    %s" % msg,
                            project.BuildGotoURL(entry))
@@ -103,18 +152,19 @@ def UpdateTonenumberFields(project, report, modifyAllowed=False):
             report.Info(("    Updating %s > %s" if modifyAllowed else
                          "    %s needs updating > %s") \
                          % (hz, newTonenum))
-            if modifyAllowed:
-                project.ReversalSetForm(entry, newTonenum, ChineseTonenumWS)
+            writeBuffer.SetReversalForm(entry, newTonenum, ChineseTonenumWS)
             UpdatedReversals += 1
-                
-        # Subentries (Changed from OC to OS in FW8)
-        try:
-            subentries = entry.SubentriesOC
-        except AttributeError:
-            subentries = entry.SubentriesOS
-            
-        for se in subentries:
-            __WriteReversalTonenum(project, se)
+        __RecordDone(entry, hz, tn, newTonenum, msg)
+
+    def __RecordDone(obj, hz, tn, newTonenum, msg):
+        # Objects with warnings, or changes not yet written, are
+        # reported again next time.
+        if msg:
+            return
+        if newTonenum is None:
+            Tracker.Record(obj.Guid, hz, tn)
+        elif modifyAllowed:
+            Tracker.Record(obj.Guid, hz, newTonenum)
 
 
     # -----------------------------------------------------------
@@ -131,37 +181,80 @@ def UpdateTonenumberFields(project, report, modifyAllowed=False):
         report.Info("    Hanzi: %s" % project.WSUIName(ChineseWS))
         report.Info("    Tone number Pinyin: %s" % project.WSUIName(ChineseTonenumWS))
 
-    Parser = ChineseParser()
-    
-    # Lexicon Glosses
+    Parser = SharedChineseParser(cacheSize=TONENUM_CACHE_SIZE,
+                                 latticeParses=LATTICE_PARSES)
+    Parser.ResetCacheStatistics()
+    if PROCESSES:
+        Calculator = ChineseProcessPool(PROCESSES, latticeParses=LATTICE_PARSES)
+    else:
+        Calculator = Parser
+
+    # The worker processes are always closed, even if the module fails
+    # or is stopped. (All the results have been read on success, so
+    # only unfinished work is dropped.)
+    try:
+        Tracker = ChangeTracker(project, "Update_Tonenumber_Fields",
+                                [datafiles.DictDB],
+                                {"version"       : docs[FTM_Version],
+                                 "latticeParses" : LATTICE_PARSES},
+                                enabled=INCREMENTAL)
+
+        # Lexicon Glosses
 
-    report.Info("Updating tone number Pinyin for all lexical entries")
-    report.ProgressStart(project.LexiconNumberOfEntries(), "Lexicon")
+        report.Info("Updating tone number Pinyin for all lexical entries")
+        report.ProgressStart(project.LexiconNumberOfEntries(), "Lexicon")
    
-    for entryNumber, entry in enumerate(project.LexiconAllEntries()):
-        report.ProgressUpdate(entryNumber)
-        for sense in entry.SensesOS:
-            __WriteSenseTonenum(project, entry, sense)
-
-    report.Info(("  %d %s updated" if modifyAllowed else
-                 "  %d %s to update") \
-                 % (UpdatedSenses, "sense" if (UpdatedSenses==1) else "senses"))
+        fields = []
+        for entryNumber, entry in enumerate(project.LexiconAllEntries()):
+            if report.Cancelled:
+                return
+            report.ProgressUpdate(entryNumber)
+            for sense in entry.SensesOS:
+                __ReadSenseTonenum(project, entry, sense, fields)
+
+        for (entry, sense, hz, tn), newTonenum, msg in Calculator.CalculateTonenumBatch(fields):
+            __WriteSenseTonenum(project, entry, sense, hz, tn, newTonenum, msg)
+
+        report.Info(("  %d %s updated" if modifyAllowed else
+                     "  %d %s to update") \
+                     % (UpdatedSenses, "sense" if (UpdatedSenses==1) else "senses"))
     
-    # Reversal Index
+        # Reversal Index
     
-    index = project.ReversalIndex(ChineseWS)
-    if index:
-        report.ProgressStart(index.AllEntries.Count, "Reversal index")
-        report.Info("Updating tone number Pinyin for '%s' reversal index"
-                    % project.WSUIName(ChineseWS))
-        for entryNumber, entry in enumerate(project.ReversalEntries(ChineseWS)):
-            report.ProgressUpdate(entryNumber)
-            __WriteReversalTonenum(project, entry)
+        index = project.ReversalIndex(ChineseWS)
+        if index:
+            report.ProgressStart(index.AllEntries.Count, "Reversal index")
+            report.Info("Updating tone number Pinyin for '%s' reversal index"
+                        % project.WSUIName(ChineseWS))
+            fields = []
+            for entryNumber, entry in enumerate(project.ReversalEntries(ChineseWS)):
+                if report.Cancelled:
+                    return
+                report.ProgressUpdate(entryNumber)
+                __ReadReversalTonenum(project, entry, fields)
+
+            for (entry, hz, tn), newTonenum, msg in Calculator.CalculateTonenumBatch(fields):
+                __WriteReversalTonenum(project, entry, hz, tn, newTonenum, msg)
             
-    report.Info(("  %d %s updated" if modifyAllowed else
-                 "  %d %s to update") \
-                 % (UpdatedReversals, "entry" if (UpdatedReversals==1) else "entries"))
-    
+        report.Info(("  %d %s updated" if modifyAllowed else
+                     "  %d %s to update") \
+                     % (UpdatedReversals, "entry" if (UpdatedReversals==1) else "entries"))
+
+        if INCREMENTAL:
+            report.Info("  %d unchanged %s skipped"
+                        % (Tracker.Skipped, "item" if (Tracker.Skipped==1) else "items"))
+        Tracker.Save()
+    finally:
+        if PROCESSES:
+            Calculator.Close(cancel=True)
+
+    if not PROCESSES and TONENUM_CACHE_SIZE:
+        hits, misses, evictions = Parser.CacheStatistics()
+        lookups = hits + misses
+        report.Info("Parse cache: %d hits, %d misses, %d evictions (%d%% hit rate)"
+                    % (hits, misses, evictions,
+                       100 * hits // lookups if lookups else 0))
+
 #----------------------------------------------------------------
 
 FlexToolsModule = FlexToolsModuleClass(runFunction = UpdateTonenumberFields,
@@ -0,0 +1,111 @@
+#
+#   benchmark_chin_utils
+#
+#   Compares the table-based character classification in chin_utils
+#   (is_chinese_char, is_chinese_punctuation, is_chinese and
+#   is_chinese_string) with the original range comparisons (copied below)
+#   on the characters and words in the dictionary (xhc4_words.txt).
+#   Also checks that the two give the same answers.
+#
+#   Note: the original is_chinese_char() tested Extension B with
+#   'Ȁ00' <= c <= 'ʦd6', which is U+0200 followed by '00',
+#   etc. The copy below uses the intended range (U+20000 - U+2A6D6).
+#
+
+import site
+site.addsitedir("..\Lib")
+
+import time
+
+import datafiles
+import chin_utils
+from check_pinyin import get_tonenum_dict
+
+# ---------------------------------------------------------------
+REPEATS = 5
+
+# ---------------------------------------------------------------
+# The original implementations
+
+def old_is_chinese_punctuation(c):
+    ans = False
+    if '　' <= c <= '〿':
+        ans = True
+    elif c == '\N{FULLWIDTH COMMA}':
+        ans = True
+    elif c == '\N{HORIZONTAL ELLIPSIS}':
+        ans = True
+    return ans
+
+def old_is_chinese(c):
+    ans = False
+    if old_is_chinese_char(c):
+        ans = True
+    elif old_is_chinese_punctuation(c):
+        ans = True
+    return ans
+
+def old_is_chinese_char(c):
+    ans = False
+    if  '一' <= c <= '龻':
+        ans = True
+    elif '㐀' <= c <= '䶵':
+        ans = True
+    elif  '\U00020000' <= c <= '\U0002a6d6':
+        ans = True
+    elif '⿰' <= c <= '⿻':
+        ans = True
+    return ans
+
+def old_is_chinese_string(s):
+    ans = True
+    for c in s:
+        if not old_is_chinese(c):
+            ans = False
+    return ans
+
+# ---------------------------------------------------------------
+
+def timeIt(function, args):
+    start = time.perf_counter()
+    for i in range(REPEATS):
+        for a in args:
+            function(a)
+    return time.perf_counter() - start
+
+
+words = [hz for hz, tonenum in get_tonenum_dict(datafiles.DictDB)]
+chars = [c for w in words for c in w]
+# Strings that fail on the first character, to show the early return
+mixed = ["x" + w for w in words]
+allCodepoints = [chr(o) for o in range(0x30000) if not 0xd800 <= o <= 0xdfff]
+bmp = allCodepoints[:0x10000 - 0x800]
+
+print("Checking all codepoints up to U+2FFFF")
+mismatches = 0
+for old, new in ((old_is_chinese_char, chin_utils.is_chinese_char),
+                 (old_is_chinese_punctuation, chin_utils.is_chinese_punctuation),
+                 (old_is_chinese, chin_utils.is_chinese),
+                 (old_is_chinese_string, chin_utils.is_chinese_string)):
+    for c in allCodepoints:
+        if old(c) != new(c):
+            mismatches += 1
+for s in words + mixed + ["", "abc"]:
+    if old_is_chinese_string(s) != chin_utils.is_chinese_string(s):
+        mismatches += 1
+print("%d mismatches" % mismatches)
+
+print()
+print("%d characters, %d words (x%d)" % (len(chars), len(words), REPEATS))
+print("%-40s %10s %10s %8s" % ("Function", "Original", "Table", "Speedup"))
+for name, old, new, args in (
+        ("is_chinese_char (characters)", old_is_chinese_char, chin_utils.is_chinese_char, chars),
+        ("is_chinese (characters)", old_is_chinese, chin_utils.is_chinese, chars),
+        ("is_chinese_char (all BMP codepoints)", old_is_chinese_char, chin_utils.is_chinese_char, bmp),
+        ("is_chinese (all BMP codepoints)", old_is_chinese, chin_utils.is_chinese, bmp),
+        ("is_chinese_string (words)", old_is_chinese_string, chin_utils.is_chinese_string, words),
+        ("is_chinese_string (non-Chinese start)", old_is_chinese_string, chin_utils.is_chinese_string, mixed),
+        ):
+    oldTime = timeIt(old, args)
+    newTime = timeIt(new, args)
+    print("%-40s %9.2fs %9.2fs %7.1fx" % (name, oldTime, newTime, oldTime / newTime))
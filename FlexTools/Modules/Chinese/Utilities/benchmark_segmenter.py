@@ -0,0 +1,71 @@
+#
+#   benchmark_segmenter
+#
+#   Compares the dictionary-based segmenter (segmenter.MaximalMatch) with
+#   the trie-based segmenter (segmenter.TrieMaximalMatch) on the bundled
+#   dictionary (xhc4_words.txt):
+#       - memory used by the loaded segmenter
+#       - forward and backward maximal matching lookups per second
+#
+
+import site
+site.addsitedir("..\Lib")
+
+import random
+import time
+import tracemalloc
+
+import datafiles
+import segmenter
+from check_pinyin import get_tonenum_dict, punctuation
+
+# ---------------------------------------------------------------
+# Number of test phrases, and how long to run the lookups for each class
+NUM_PHRASES = 20000
+LOOKUP_SECONDS = 3.0
+
+# ---------------------------------------------------------------
+
+def load(segmenterClass, segmentValues):
+    tracemalloc.start()
+    sgmtr = segmenterClass()
+    sgmtr.add_segment_values(segmentValues)
+    sgmtr.match_end(segmentValues[0][0])   # TrieMaximalMatch builds on first use
+    memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return sgmtr, memory
+
+
+def lookupsPerSecond(sgmtr, phrases):
+    lookups = 0
+    start = time.perf_counter()
+    while True:
+        for phrase in phrases:
+            sgmtr.match_all_ends(phrase)
+            sgmtr.match_all_starts(phrase)
+        lookups += len(phrases)
+        elapsed = time.perf_counter() - start
+        if elapsed >= LOOKUP_SECONDS:
+            return lookups / elapsed
+
+
+print("Loading %s" % datafiles.DictDB)
+segmentValues = get_tonenum_dict(datafiles.DictDB) + list(punctuation.items())
+
+# Test phrases are made from 1-4 random dictionary words
+random.seed(0)
+words = [w for w, tonenum in segmentValues]
+phrases = ["".join(random.choice(words) for i in range(random.randint(1, 4)))
+           for n in range(NUM_PHRASES)]
+
+results = []
+for segmenterClass in (segmenter.MaximalMatch, segmenter.TrieMaximalMatch):
+    sgmtr, memory = load(segmenterClass, segmentValues)
+    rate = lookupsPerSecond(sgmtr, phrases)
+    results.append((segmenterClass.__name__, memory, rate))
+    del sgmtr
+
+print()
+print("%-20s %12s %20s" % ("Segmenter", "Memory (MB)", "Phrases/sec (L+R)"))
+for name, memory, rate in results:
+    print("%-20s %12.1f %20.0f" % (name, memory / 1024 / 1024, rate))
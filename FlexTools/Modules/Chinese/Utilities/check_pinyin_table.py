@@ -0,0 +1,53 @@
+#
+#   check_pinyin_table
+#
+#   Checks that the single-pass, table-driven pinyin.tonenum_pinyin()
+#   gives identical results to the original regular expression version
+#   (pinyin.multipass_tonenum_pinyin) for:
+#       - every tone number string in the dictionary (xhc4_words.txt)
+#       - every syllable in the dictionary, in lower, title and upper case
+#   and compares the speed of the two functions.
+#
+
+import site
+site.addsitedir("..\Lib")
+
+import time
+
+import datafiles
+import pinyin
+from check_pinyin import get_tonenum_dict
+from chin_utils import get_tone_syls
+
+
+def timeIt(function, strings):
+    start = time.perf_counter()
+    for s in strings:
+        function(s)
+    return time.perf_counter() - start
+
+
+tonenums = [tonenum for hz, tonenum in get_tonenum_dict(datafiles.DictDB)]
+syllables = set()
+for tonenum in tonenums:
+    syllables.update(get_tone_syls(tonenum))
+syllables = sorted(syllables)
+tests = tonenums + [f(syl) for syl in syllables
+                    for f in (str.lower, str.title, str.upper)]
+
+print("Checking %d tone number strings and %d syllables from %s"
+      % (len(tonenums), len(syllables), datafiles.DictDB))
+
+mismatches = 0
+for s in tests:
+    expected = pinyin.multipass_tonenum_pinyin(s)
+    result = pinyin.tonenum_pinyin(s)
+    if result != expected:
+        mismatches += 1
+        print("Mismatch: %r > %r (expected %r)" % (s, result, expected))
+
+print("%d mismatches" % mismatches)
+
+print()
+print("multipass_tonenum_pinyin: %.2fs" % timeIt(pinyin.multipass_tonenum_pinyin, tonenums))
+print("tonenum_pinyin:           %.2fs" % timeIt(pinyin.tonenum_pinyin, tonenums))
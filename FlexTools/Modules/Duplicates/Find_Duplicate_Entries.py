@@ -57,7 +57,7 @@ up homograph numbers and duplicate grammatical info details.
 #----------------------------------------------------------------
 # The main processing function
 
-def MainFunction(project, report, modifyAllowed):
+def MainFunction(project, report, modifyAllowed, writeBuffer):
 
     def __EntryMessage(project, entry, message):
         report.Info("   %s(%i) [%s][%s] %s" % (entry.HomographForm,
@@ -140,9 +140,9 @@ def MainFunction(project, report, modifyAllowed):
             continue
         report.Info("   {}: {} homographs".format(key, len(data)),
                     project.BuildGotoURL(data[0]))
-        if AddTagToField:
+        if tagsField:
             for e in data:
-                project.LexiconAddTagToField(e, tagsField, TAG_Merge) 
+                writeBuffer.AddTagToField(e, tagsField, TAG_Merge) 
 
     # Mark entries with only one homograph with "review"
     
@@ -155,9 +155,9 @@ def MainFunction(project, report, modifyAllowed):
         if len(data) == 1:
             report.Info("   {}".format(key),
                         project.BuildGotoURL(data[0]))
-            if AddTagToField:
+            if tagsField:
                 e = data[0]
-                project.LexiconAddTagToField(e, tagsField, TAG_MergeReview) 
+                writeBuffer.AddTagToField(e, tagsField, TAG_MergeReview) 
 
 #----------------------------------------------------------------
 
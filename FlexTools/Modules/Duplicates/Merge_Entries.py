@@ -113,6 +113,8 @@ def MergeEntries(project, report, modifyAllowed):
     deleteList = list()
 
     for entryNumber, entry in enumerate(project.LexiconAllEntries()):
+        if report.Cancelled:
+            return
         report.ProgressUpdate(entryNumber)
 
         MorphType = entry.LexemeFormOA.MorphTypeRA
@@ -171,6 +173,8 @@ def MergeEntries(project, report, modifyAllowed):
     progressCount = 0
     
     for key, mergeData in list(mergeList.items()):
+        if report.Cancelled:
+            break
         progressCount += 1
         report.ProgressUpdate(progressCount)
 
@@ -221,10 +225,12 @@ def MergeEntries(project, report, modifyAllowed):
 
 
     # DELETE
-    if DoCommands and deleteList:
+    if DoCommands and deleteList and not report.Cancelled:
         report.Info("Deleting %i entries" % len(deleteList))
 
         for entry in deleteList:
+            if report.Cancelled:
+                break
             entry.Delete()      # OnBeforeObjectDeleted() will fix homograph numbering
 
             progressCount += 1
@@ -65,15 +65,14 @@ for analysis.
 #----------------------------------------------------------------
 # The main processing function
 
-def MainFunction(project, report, modifyAllowed):
+def MainFunction(project, report, modifyAllowed, writeBuffer):
 
-    entryUsageField = None
-    senseUsageField = None
+    # The counts are written via writeBuffer, which drops any that
+    # haven't changed, and only writes if modifications are allowed.
+    entryUsageField = project.LexiconGetEntryCustomFieldNamed("Entry Frequency")
+    senseUsageField = project.LexiconGetSenseCustomFieldNamed("Sense Frequency")
 
     if modifyAllowed:
-        entryUsageField = project.LexiconGetEntryCustomFieldNamed("Entry Frequency")
-        senseUsageField = project.LexiconGetSenseCustomFieldNamed("Sense Frequency")
-    
         if not (entryUsageField or senseUsageField):
             report.Warning("Usage custom fields don't exist. Please read the module information for instructions.")
 
@@ -87,6 +86,8 @@ def MainFunction(project, report, modifyAllowed):
 
     numAttested = 0
     for entryNumber, entry in enumerate(project.LexiconAllEntries()):
+        if report.Cancelled:
+            return
         report.ProgressUpdate(entryNumber)
         lexeme = project.LexiconGetHeadword(entry)
         entryTotal = 0
@@ -99,10 +100,10 @@ def MainFunction(project, report, modifyAllowed):
                 entryTotal += senseCount
                 
             if senseUsageField:
-                project.LexiconSetFieldInteger(sense.Hvo, senseUsageField, senseCount)
+                writeBuffer.SetFieldInteger(sense.Hvo, senseUsageField, senseCount)
 
         if entryUsageField:
-            project.LexiconSetFieldInteger(entry.Hvo, entryUsageField, entryTotal)
+            writeBuffer.SetFieldInteger(entry.Hvo, entryUsageField, entryTotal)
             
         if entryTotal > 0:
             numAttested += 1
@@ -0,0 +1,29 @@
+#
+#   RunCollection
+#
+#   Runs a FlexTools collection on one or more projects without the
+#   user interface. Run from the FlexTools folder as a command-line
+#   application:
+#       py scripts\RunCollection.py <Collection> <Project> [<Project>...]
+#                                   [--modify] [--json]
+#
+#   The report is written to stdout, and the exit code is non-zero if
+#   there were any errors.
+#
+
+import sys
+
+
+LOG_FILE = "RunCollection.log"
+
+import logging
+logging.basicConfig(filename=LOG_FILE, 
+                    filemode='w' if __name__ == "__main__" else 'a',
+                    level=logging.INFO)
+
+from flextoolslib.misc.RunCollection import main
+
+# The guard is needed because modules may start worker processes
+# (multiprocessing 'spawn'), which import this script again.
+if __name__ == "__main__":
+    sys.exit(main())
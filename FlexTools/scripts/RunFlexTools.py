@@ -6,4 +6,7 @@ import flextoolslib
 
 from Version import Title
 
-flextoolslib.main(Title)
+# The guard is needed because modules may start worker processes
+# (multiprocessing 'spawn'), which import this script again.
+if __name__ == "__main__":
+    flextoolslib.main(Title)
@@ -43,3 +43,8 @@ from .code.FTConfig import (
 from .misc.RunModule import (
     RunModule, 
     )
+
+# Headless running of collections (see RunCollection.py)
+from .misc.RunCollection import (
+    RunCollection,
+    )
@@ -14,6 +14,15 @@
 #       CurrentProject
 #       WarnOnModify
 #       DisableDoubleClick
+#       WriteBatchSize      (Number of buffered changes to write at a time;
+#                            0 = all at the end of each module)
+#       ListPendingChanges  (List each change that a module would make
+#                            when modifications aren't allowed)
+#       ProfileModules      (Report the time and memory used by each
+#                            module, and save them in Profiles\)
+#       ProfileDumps        (Also save a cProfile dump for each module)
+#       ReportJsonFile      (Also write the report messages to this file
+#                            as JSON lines; see FTReport.JSONLinesSink)
 #
 #   Craig Farrow
 #   Copyright 2012-2023
@@ -52,6 +61,13 @@ CONFIG_PATH      = join(BASE_PATH, INI_FILENAME)
 MODULES_PATH     = join(BASE_PATH, "Modules")
 COLLECTIONS_PATH = join(BASE_PATH, "Collections")
 
+# Cache of the module docs, so that unchanged modules don't need to
+# be imported at start-up. (See FTModules.)
+MANIFEST_PATH    = join(BASE_PATH, "flextools_modules.json")
+
+# Module timings and profiles (See FTProfiler.)
+PROFILES_PATH    = join(BASE_PATH, "Profiles")
+
 #----------------------------------------------------------- 
 # Load the configuration
 
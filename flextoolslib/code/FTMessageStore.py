@@ -0,0 +1,128 @@
+#
+#   Project: FlexTools
+#   Module:  FTMessageStore
+#
+#   Storage for report messages (see FTReport):
+#    - The most recent messages are kept in memory.
+#    - Older messages are moved to a temporary file as JSON lines, so
+#      memory use doesn't grow with the number of messages. The file is
+#      deleted when the store is cleared.
+#    - All the messages can still be read back, either one at a time,
+#      a page at a time (Page()), or by iterating over the store.
+#    - Messages can be added on one thread (running the Modules) while
+#      they are read on another (the UI.)
+#
+
+import json
+import tempfile
+import threading
+from array import array
+from collections import deque
+
+import logging
+logger = logging.getLogger(__name__)
+
+# ------------------------------------------------------------------
+
+# The default number of messages to keep in memory.
+MAX_MESSAGES_IN_MEMORY = 10000
+
+# The number of messages read from the file at a time when iterating.
+PAGE_SIZE = 1000
+
+
+class FTMessageStore(object):
+    """
+    A list-like store of (msgType, msg, ref) tuples that can only be
+    appended to. Supports len(), indexing (including negative indexes)
+    and iteration.
+    """
+
+    def __init__(self, maxInMemory=MAX_MESSAGES_IN_MEMORY):
+        self.maxInMemory = max(1, maxInMemory)
+        self.__recent = deque()
+        self.__spillFile = None
+        # Byte offset in the spill file of each spilled message, plus
+        # the end of the file.
+        self.__offsets = array('Q', [0])
+        self.__lock = threading.RLock()
+
+    def __len__(self):
+        with self.__lock:
+            return self.Spilled() + len(self.__recent)
+
+    def Spilled(self):
+        # Returns the number of messages that are in the file.
+        return len(self.__offsets) - 1
+
+    # --- Adding messages
+
+    def append(self, message):
+        with self.__lock:
+            if len(self.__recent) >= self.maxInMemory:
+                self.__Spill(self.__recent.popleft())
+            self.__recent.append(message)
+
+    def __Spill(self, message):
+        if self.__spillFile is None:
+            self.__spillFile = tempfile.TemporaryFile(prefix="flextools-report-",
+                                                      suffix=".jsonl")
+            logger.debug(f"Report messages spilling to {self.__spillFile.name}")
+        # (References that aren't strings are stored as their repr().)
+        line = json.dumps(message, default=repr).encode("utf-8") + b"\n"
+        self.__spillFile.write(line)
+        self.__offsets.append(self.__offsets[-1] + len(line))
+
+    # --- Reading messages
+
+    def __ReadSpilled(self, start, stop):
+        # Returns the spilled messages [start:stop].
+        if start >= stop:
+            return []
+        f = self.__spillFile
+        f.flush()
+        f.seek(self.__offsets[start])
+        data = f.read(self.__offsets[stop] - self.__offsets[start])
+        f.seek(0, 2)                # Back to the end for appending
+        return [tuple(json.loads(line)) for line in data.splitlines()]
+
+    def Page(self, start, count):
+        # Returns a list of up to count messages, starting at index start.
+        with self.__lock:
+            start = max(0, start)
+            stop = min(len(self), start + count)
+            spilled = self.Spilled()
+            messages = self.__ReadSpilled(start, min(stop, spilled))
+            if stop > spilled:
+                recent = range(max(start, spilled) - spilled, stop - spilled)
+                messages.extend(self.__recent[i] for i in recent)
+            return messages
+
+    def __getitem__(self, index):
+        with self.__lock:
+            if index < 0:
+                index += len(self)
+            if not 0 <= index < len(self):
+                raise IndexError("message index out of range")
+            return self.Page(index, 1)[0]
+
+    def __iter__(self):
+        # Iterates over a snapshot of the messages; messages added while
+        # iterating aren't included.
+        end = len(self)
+        for start in range(0, end, PAGE_SIZE):
+            yield from self.Page(start, min(PAGE_SIZE, end - start))
+
+    # --- Discarding messages
+
+    def Clear(self):
+        # Discards all the messages and deletes the spill file.
+        with self.__lock:
+            self.__recent.clear()
+            self.__offsets = array('Q', [0])
+            if self.__spillFile is not None:
+                self.__spillFile.close()
+                self.__spillFile = None
+
+    def __del__(self):
+        self.Clear()
@@ -9,6 +9,10 @@
 #   October 2010
 #
 
+import inspect
+
+from .FTWriteBuffer import FTWriteBuffer
+
 # FlexTools module documentation keys. These keys must be defined in the
 # docs dictionary passed to the FlexToolsModuleClass initialisation.
 FTM_Name        = 'moduleName'
@@ -54,12 +58,34 @@ class FlexToolsModuleClass (object):
                        - reference is an optional hyperlink to a lexical
                          entry in FLEx.
                          It is built with project.BuildGotoURL(entry)
+                   report.Cancelled
+                       - True if the user has asked to stop the run. Long
+                         loops should check this and return early.
            - _modififyAllowed_ is True if the user has permitted any kind
              of modification to the project. If this is False then the module
              should ensure that no data is modified.
              Users are warned to back up their projects before attempting 
              any modifications via a FlexTools module.
 
+       or, to have changes to the project written after the module has
+       finished:
+         def _processing_function_(project, report, modifyAllowed, writeBuffer):
+
+           - The parameter must be named writeBuffer: FlexTools only
+             passes a write buffer to processing functions that have a
+             parameter with that name.
+           - _writeBuffer_ is a FTWriteBuffer.FTWriteBuffer instance that
+             records changes for writing later. E.g.:
+                   writeBuffer.SetSenseGloss(sense, gloss, languageTag)
+                   writeBuffer.SetReversalForm(entry, form, languageTag)
+                   writeBuffer.SetFieldText(entry, fieldID, text)
+                   writeBuffer.SetFieldInteger(entry, fieldID, integer)
+                   writeBuffer.AddTagToField(entry, fieldID, tag)
+             The module can call these whether or not modifications are
+             allowed: the changes are only written if _modifyAllowed_ is
+             True. Otherwise, the number of changes that would have been
+             made is reported.
+
     - _user_documentation_ is a dictionary with the following keys defined:
         FTM_Name           : A short name for the module.
         FTM_Version        : The module version as a string or anything that
@@ -101,13 +127,37 @@ class FlexToolsModuleClass (object):
     def GetConfigurables(self):
         return self.configurationItems
 
-    def Run(self, project, report, modifyAllowed = False):
+    def UsesWriteBuffer(self):
+        # True if the processing function has a parameter named
+        # writeBuffer (see the class documentation.)
+        try:
+            parameters = inspect.signature(self.runFunction).parameters
+        except (TypeError, ValueError):
+            return False
+        return "writeBuffer" in parameters
+
+    def Run(self, project, report, modifyAllowed = False, writeBuffer = None):
+        # If the processing function takes a writeBuffer, then writeBuffer
+        # is passed to it, and the caller is responsible for calling
+        # writeBuffer.Finish(). If no writeBuffer is given, then one is
+        # created and finished here.
         if self.runFunction:
             # Prevent writes if not documented
             if modifyAllowed and not self.docs[FTM_ModifiesDB]:
                 report.Info("(Modifications are allowed, but this module doesn't modify the project.)")
                 modifyAllowed = False
-            self.runFunction(project, report, modifyAllowed)
+            if not self.UsesWriteBuffer():
+                self.runFunction(project, report, modifyAllowed)
+                return
+
+            if writeBuffer is None:
+                buffer = FTWriteBuffer(project, report, modifyAllowed)
+            else:
+                buffer = writeBuffer
+                buffer.modifyAllowed = modifyAllowed
+            self.runFunction(project, report, modifyAllowed, buffer)
+            if writeBuffer is None:
+                buffer.Finish()
 
     def Help(self):
         #
@@ -11,16 +11,30 @@
 #   subdirectories). These all need to conform to the specification for
 #   FlexTools modules -- See FTModuleClass.py
 #
+#   The module files are found first, and then the ones that need to be
+#   imported are read and compiled in parallel (IMPORT_THREADS.) The
+#   compiled modules are then executed one at a time, in the order they
+#   were found.
+#
+#   The docs of each module are cached in a manifest file (MANIFEST_PATH)
+#   so that only new or changed modules are imported at start-up. The
+#   other modules are represented by an FTModuleProxy, which imports the
+#   module when it is first run or configured.
 #
 
 import os
 import sys
+import json
+import hashlib
+import time
 import importlib.util
 import traceback
+from concurrent.futures import ThreadPoolExecutor
 
 import System
 
 from . import FTReport
+from .FTReport import JSONLinesSink
 from flexlibs import (
     FLExProject, 
     FP_ProjectError, 
@@ -28,9 +42,11 @@ from flexlibs import (
     )
 
 from .FTModuleClass import *
+from .FTWriteBuffer import FTWriteBuffer
+from .FTProfiler import FTProfiler
 
 # Loads .pth files from Modules\
-from .FTConfig import FTConfig
+from .FTConfig import FTConfig, MANIFEST_PATH
 MODULES_PATH = FTConfig.ModulesPath
 
 import site
@@ -42,35 +58,278 @@ logger = logging.getLogger(__name__)
 
 # ------------------------------------------------------------------
 
+# Increment this if the manifest format, or the way the docs are
+# stored in it, changes.
+ManifestVersion = 1
+
+# The maximum number of modules to read and compile at the same time.
+IMPORT_THREADS = 8
+
+
+def _CompileModule(moduleName, modulePath):
+    # Reads and compiles the Python module, without running it.
+    # moduleName is the name of the module in Python namespace.
+    # modulePath is the full path+filename of the module.
+    # Returns (spec, code object, None), or (None, None, error message)
+    # if the module couldn't be compiled.
+    # This can be called from any thread.
+
+    spec = importlib.util.spec_from_file_location(moduleName, modulePath)
+    if spec is None:
+        return None, None, f"{modulePath} not found."
+
+    try:
+        code = spec.loader.get_code(moduleName)
+        return spec, code, None
+    except:
+        return None, None, f"Module error: {modulePath}\n {traceback.format_exc()}"
+
+
+def _ExecModule(spec, code):
+    # Runs the compiled module from _CompileModule().
+    # Returns (module, None), or (None, error message) if it failed.
+    # Module code can have side-effects (e.g. importing .NET assemblies)
+    # so this is only called from the main thread.
+
+    modulePath = spec.origin
+    logger.debug(f"Attempting import of {modulePath}")
+    startTime = time.perf_counter()
+    try:
+        mod = importlib.util.module_from_spec(spec)
+        exec(code, mod.__dict__)
+        logger.debug(f"Imported {modulePath} in "
+                     f"{time.perf_counter() - startTime:.3f}s")
+        return mod, None
+    except FTM_ModuleError as e:
+        return None, f"{modulePath}:\n{e.message}"
+    except:
+        return None, f"Module error: {modulePath}\n {traceback.format_exc()}"
+
+
+def _ImportModule(moduleName, modulePath):
+    # Manually import the Python module.
+    # Returns (module, None), or (None, error message) if the import failed.
+
+    spec, code, error = _CompileModule(moduleName, modulePath)
+    if error:
+        return None, error
+    return _ExecModule(spec, code)
+
+
+def _FileSignature(fname, stat=None):
+    # Returns a dictionary identifying the current contents of the file.
+    if stat is None:
+        stat = os.stat(fname)
+    with open(fname, 'rb') as file:
+        sha1 = hashlib.sha1(file.read()).hexdigest()
+    return {"size"  : stat.st_size,
+            "mtime" : stat.st_mtime_ns,
+            "sha1"  : sha1}
+
+
+def _IsUnchanged(signature, fname, stat):
+    # Returns True if the file still matches the signature. The file is
+    # only hashed if the modification time has changed.
+    try:
+        if stat.st_size != signature["size"]:
+            return False
+        if stat.st_mtime_ns == signature["mtime"]:
+            return True
+        return _FileSignature(fname, stat)["sha1"] == signature["sha1"]
+    except (OSError, KeyError, TypeError):
+        return False
+
+# ------------------------------------------------------------------
+
+class FTModuleProxy (object):
+    """
+    Stands in for a FlexToolsModuleClass instance whose docs were read
+    from the manifest. The module is imported when it is first needed
+    (by Run() or GetConfigurables()); GetDocs() doesn't import it.
+    Raises FTM_ModuleError if the import fails.
+    """
+
+    def __init__(self, moduleName, modulePath, docs):
+        self.moduleName = moduleName
+        self.docs = docs
+        self.docs[FTM_Path] = modulePath
+        self.__module = None
+
+    def __Module(self):
+        if self.__module is None:
+            modulePath = self.docs[FTM_Path]
+            logger.info(f"Importing cached module {modulePath}")
+            module, error = _ImportModule(self.moduleName, modulePath)
+            if not module:
+                raise FTM_ModuleError(error)
+            try:
+                ftm = module.FlexToolsModule
+            except AttributeError:
+                raise FTM_ModuleError(f"FlexToolsModule not found in {modulePath}")
+            ftm.docs[FTM_Path] = modulePath
+            self.__module = ftm
+        return self.__module
+
+    def GetDocs(self):
+        return self.docs
+
+    def GetConfigurables(self):
+        return self.__Module().GetConfigurables()
+
+    def Run(self, *args, **kwargs):
+        return self.__Module().Run(*args, **kwargs)
+
+    def __getattr__(self, name):
+        # Anything else is provided by the real module.
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return getattr(self.__Module(), name)
+
+# ------------------------------------------------------------------
+
 class ModuleManager (object):
 
-    def __importModule(self, moduleName, modulePath):
-        # Manually import the Python module.
-        # moduleName is the name of the module in Python namespace.
-        # modulePath is the full path+filename of the module.
+    def __init__(self, projectClass=FLExProject):
+        # projectClass is the class used to open projects. It can be
+        # replaced with a stand-in for testing.
+        self.projectClass = projectClass
 
-        spec = importlib.util.spec_from_file_location(moduleName, modulePath)
-        if spec is None:
-            self.__errors.append(f"{modulePath} not found.")
-            return None
-            
-        logger.debug(f"Attempting import of {modulePath}")
+    def __discoverModules(self):
+        # Returns a list of the candidate module files, in the order that
+        # they are loaded: [(library, moduleName, moduleFullPath, stat)]
+
+        with os.scandir(MODULES_PATH) as entries:
+            libNames = [e.name for e in entries if e.is_dir()] + [""]
+
+        try:
+            libNames.remove("__pycache__")
+        except ValueError:
+            pass
+        
+        logger.info("Module libraries found: %s" % libNames)
+
+        candidates = []
+        for library in libNames:
+            libPath = os.path.join(MODULES_PATH, library)
+
+            with os.scandir(libPath) as entries:
+                modFiles = [e for e in entries
+                                if e.name.endswith(".py")]
+            logger.info("From library '%s': %s" % (library,
+                                                   repr([e.name for e in modFiles])))
+
+            for entry in modFiles:
+                # Don't try to directly import python files starting with
+                # double underscore.
+                if entry.name.startswith("__"):
+                    continue
+
+                try:
+                    stat = entry.stat()
+                except OSError as e:
+                    logger.warning(f"Warning: {e}")
+                    continue
+
+                moduleName = os.path.splitext(entry.name)[0]
+                candidates.append((library, moduleName,
+                                   os.path.join(libPath, entry.name), stat))
+        return candidates
+
+    def __importModules(self, modules):
+        # Imports the modules, a list of (moduleName, moduleFullPath).
+        # Returns {moduleFullPath : (module, error message)}
+        # Reading and compiling is done in several threads, then the
+        # modules are run in this thread, in the order given.
+        if len(modules) <= 1:
+            compiled = [_CompileModule(*m) for m in modules]
+        else:
+            with ThreadPoolExecutor(max_workers=IMPORT_THREADS) as executor:
+                compiled = list(executor.map(lambda m: _CompileModule(*m),
+                                             modules))
+        results = {}
+        for (moduleName, path), (spec, code, error) in zip(modules, compiled):
+            if error:
+                results[path] = (None, error)
+            else:
+                results[path] = _ExecModule(spec, code)
+        return results
+
+    def __loadManifest(self):
+        # Returns the cached module entries: {module path : entry}
         try:
-            mod = importlib.util.module_from_spec(spec)
-            spec.loader.exec_module(mod)
-            return mod
-        except FTM_ModuleError as e:
-            msg = f"{modulePath}:\n{e.message}"
-            self.__errors.append(msg)
+            with open(MANIFEST_PATH, encoding="utf-8") as file:
+                manifest = json.load(file)
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as e:
+            logger.warning(f"Module manifest not loaded: {e}")
+            return {}
+        if manifest.get("version") != ManifestVersion \
+           or manifest.get("modulesPath") != MODULES_PATH:
+            logger.info("Module manifest is out of date")
+            return {}
+        return manifest.get("modules", {})
+
+    def __saveManifest(self, modules):
+        manifest = {"version"     : ManifestVersion,
+                    "modulesPath" : MODULES_PATH,
+                    "modules"     : modules}
+        tmpFile = MANIFEST_PATH + ".tmp"
+        try:
+            with open(tmpFile, "w", encoding="utf-8") as file:
+                json.dump(manifest, file, indent=1)
+            os.replace(tmpFile, MANIFEST_PATH)
+        except OSError as e:
+            # E.g. a read-only installation; everything is imported
+            # again next time.
+            logger.warning(f"Couldn't write module manifest {MANIFEST_PATH}: {e}")
+
+    def __fromManifest(self, moduleName, moduleFullPath, stat, cached, manifest):
+        # Returns a proxy for the FlexToolsModule in an unchanged file,
+        # or None. Updates manifest with the file's entry.
+
+        # (The file may have been copied, giving a new mtime.)
+        manifest[moduleFullPath] = dict(cached, mtime=stat.st_mtime_ns)
+        if cached["docs"] is None:
+            logger.debug(f"FlexToolsModule not found in {moduleFullPath} (cached)")
             return None
-        except:
-            msg = f"Module error: {modulePath}\n {traceback.format_exc()}"
-            self.__errors.append(msg)
+        return FTModuleProxy(moduleName, moduleFullPath, dict(cached["docs"]))
+
+    def __fromImport(self, moduleName, moduleFullPath, stat, module, error, manifest):
+        # Returns the FlexToolsModule from the imported Python module,
+        # or None. Updates manifest with the file's entry.
+
+        if error:
+            self.__errors.append(error)
+
+        if not module:
+            # Not cached so that the error is reported every time.
+            logger.warning(f"Warning: FlexToolsModule import failure - {moduleFullPath}")
             return None
 
+        entry = _FileSignature(moduleFullPath, stat)
+        entry["name"] = moduleName
+        try:
+            ftm = module.FlexToolsModule
+        except AttributeError:
+            logger.warning(f"Warning: FlexToolsModule not found in {moduleFullPath}")
+            entry["docs"] = None
+            manifest[moduleFullPath] = entry
+            return None
+
+        docs = {k: v for k, v in ftm.GetDocs().items() if k != FTM_Path}
+        try:
+            # Round-trip to make sure the cached docs will be the same.
+            if json.loads(json.dumps(docs)) == docs:
+                entry["docs"] = docs
+                manifest[moduleFullPath] = entry
+        except (TypeError, ValueError):
+            pass
+        return ftm
+
     def __openProject(self, projectName, modifyAllowed):
         #logger.debug("__openProject %s" % projectName)
-        self.project = FLExProject()
+        self.project = self.projectClass()
 
         try:
             self.project.OpenProject(projectName,
@@ -110,65 +369,60 @@ class ModuleManager (object):
         # Loads all the FlexTools modules from the Modules folder.
         # Returns a list of error messages about duplicate module names.
         # An empty list means there were no errors.
+        # Modules that are unchanged since the last time are not
+        # imported until they are needed.
         
         self.project = None
         self.__modules = {}
         self.__errors = []
 
-        libNames = [l for l in os.listdir(MODULES_PATH) \
-                       if os.path.isdir(os.path.join(MODULES_PATH,l))] \
-                   + [""]
-
-        try:
-            libNames.remove("__pycache__")
-        except ValueError:
-            pass
-        
-        logger.info("Module libraries found: %s" % libNames)
-        
-        for library in libNames:
-            libPath = os.path.join(MODULES_PATH, library)
-
-            modNames = [m for m in os.listdir(libPath)
-                            if m.endswith(".py")]
-            logger.info("From library '%s': %s" % (library, repr(modNames)))
-
-            for moduleFileName in modNames:
-                # Don't try to directly import python files starting with
-                # double underscore.
-                if moduleFileName.startswith("__"):
-                    continue
-
-                moduleFullPath = os.path.join(libPath, moduleFileName)
-                moduleName = os.path.splitext(moduleFileName)[0]
-                
-                # Import the Python module
-                module = self.__importModule(moduleName, moduleFullPath)
-
-                if not module:
-                    logger.warning(f"Warning: FlexToolsModule import failure - {moduleFullPath}")
-                    continue
+        cachedModules = self.__loadManifest()
+        manifest = {}
+
+        candidates = self.__discoverModules()
+
+        # Import the new and changed modules
+        unchanged = {}
+        toImport = []
+        for library, moduleName, moduleFullPath, stat in candidates:
+            cached = cachedModules.get(moduleFullPath)
+            if cached and _IsUnchanged(cached, moduleFullPath, stat):
+                unchanged[moduleFullPath] = cached
+            else:
+                toImport.append((moduleName, moduleFullPath))
+        imported = self.__importModules(toImport)
+
+        # Register the modules in the order they were found, so that
+        # duplicates and errors are handled the same way every time.
+        for library, moduleName, moduleFullPath, stat in candidates:
+            if moduleFullPath in unchanged:
+                ftm = self.__fromManifest(moduleName, moduleFullPath, stat,
+                                          unchanged[moduleFullPath],
+                                          manifest)
+            else:
+                ftm = self.__fromImport(moduleName, moduleFullPath, stat,
+                                        *imported[moduleFullPath],
+                                        manifest)
+            if not ftm:
+                continue
 
-                try:
-                    ftm = module.FlexToolsModule
-                except AttributeError:
-                    logger.warning(f"Warning: FlexToolsModule not found in {moduleFullPath}")
-                    continue
+            if library:
+                moduleFullName = ".".join([library, ftm.GetDocs()[FTM_Name]])
+            else:
+                moduleFullName = ftm.GetDocs()[FTM_Name]
 
-                if library:
-                    moduleFullName = ".".join([library, ftm.GetDocs()[FTM_Name]])
-                else:
-                    moduleFullName = ftm.GetDocs()[FTM_Name]
+            if moduleFullName in self.__modules:
+                otherModule = self.__modules[moduleFullName].docs[FTM_Path]
+                errString = "Duplicate module names found in these files (using the first one):\n"\
+                            "\t%s \n\t%s" % (otherModule, moduleFullPath)
+                self.__errors.append(errString)
+                continue
 
-                if moduleFullName in self.__modules:
-                    otherModule = self.__modules[moduleFullName].docs[FTM_Path]
-                    errString = "Duplicate module names found in these files (using the first one):\n"\
-                                "\t%s \n\t%s" % (otherModule, moduleFullPath)
-                    self.__errors.append(errString)
-                    continue
+            ftm.docs[FTM_Path] = moduleFullPath
+            self.__modules[moduleFullName] = ftm
 
-                ftm.docs[FTM_Path] = moduleFullPath
-                self.__modules[moduleFullName] = ftm
+        if manifest != cachedModules:
+            self.__saveManifest(manifest)
 
         return self.__errors
 
@@ -192,10 +446,35 @@ class ModuleManager (object):
         except KeyError:
             return None
 
+    def __OpenReportSink(self, projectName, reporter):
+        # Returns a JSONLinesSink for FTConfig.reportJsonFile (added to
+        # the reporter), or None.
+        if not FTConfig.reportJsonFile:
+            return None
+        try:
+            sink = JSONLinesSink(FTConfig.reportJsonFile, projectName)
+        except OSError as e:
+            logger.error(f"Couldn't open report file: {e}")
+            reporter.Warning(f"Couldn't open report file: {e}")
+            return None
+        reporter.AddSink(sink)
+        return sink
+
     def RunModules(self, projectName, moduleList, reporter, modifyAllowed = False):
         if not projectName:
             return False
 
+        sink = self.__OpenReportSink(projectName, reporter)
+        try:
+            return self.__RunModules(projectName, moduleList,
+                                     reporter, modifyAllowed)
+        finally:
+            reporter.SetModuleName(None)
+            if sink:
+                reporter.RemoveSink(sink)
+                sink.Close()
+
+    def __RunModules(self, projectName, moduleList, reporter, modifyAllowed):
         reporter.Info("Opening project %s..." % projectName)
         try:
             self.__openProject(projectName, modifyAllowed)
@@ -210,7 +489,15 @@ class ModuleManager (object):
             reporter.Error(msg, details)
             return False
 
+        profiler = None
+        if FTConfig.profileModules:
+            profiler = FTProfiler(projectName, FTConfig.profileDumps)
+
         for moduleName in moduleList:
+            if reporter.Cancelled:
+                break
+
+            reporter.SetModuleName(moduleName)
             docs = self.GetDocs(moduleName)
             if not docs:
                 reporter.Warning("Module %s missing or failed to import." % moduleName)
@@ -234,21 +521,52 @@ class ModuleManager (object):
             if FTConfig.simplifiedRunOps:
                 modifyAllowed = docs[FTM_ModifiesDB]
 
+            # Modules that take a write buffer have their changes
+            # written (or reported in preview) after they finish.
+            writeBuffer = FTWriteBuffer(self.project,
+                                        reporter,
+                                        modifyAllowed,
+                                        FTConfig.writeBatchSize or 0)
+            if profiler:
+                profiler.Start(moduleName, reporter)
             try:
                 self.__modules[moduleName].Run(self.project,
                                                reporter,
-                                               modifyAllowed=modifyAllowed)
+                                               modifyAllowed=modifyAllowed,
+                                               writeBuffer=writeBuffer)
+                # If the Module was cancelled its changes may be
+                # incomplete, so they are discarded below.
+                if not reporter.Cancelled:
+                    writeBuffer.Finish(listPending=FTConfig.listPendingChanges)
             except FP_RuntimeError as e:
                 msg, details = self.__buildExceptionMessages(e, "Module failed with a programming error!")
                 reporter.Error(msg, details)
             except Exception as e:
                 msg, details = self.__buildExceptionMessages(e, "Module failed with exception {}!")
                 reporter.Error(msg, details)
+            if profiler:
+                profiler.Stop()
+
+            numDiscarded = writeBuffer.Discard()
+            if numDiscarded:
+                reporter.Warning("%d pending %s not written because %s."
+                                 % (numDiscarded,
+                                    "change was" if numDiscarded==1 else "changes were",
+                                    "the run was stopped" if reporter.Cancelled
+                                        else "of the error"))
                 
             if FTConfig.stopOnError:
                 if reporter.messageCounts[reporter.ERROR]:
                     break
 
+        reporter.SetModuleName(None)
+        if profiler:
+            profiler.Report(reporter)
+            profiler.Save()
+
+        if reporter.Cancelled:
+            reporter.Info("Processing stopped by the user.")
+
         numErrors   = reporter.messageCounts[reporter.ERROR]
         numWarnings = reporter.messageCounts[reporter.WARNING]
         reporter.Info("Processing completed with %d error%s and %d warning%s" \
@@ -0,0 +1,160 @@
+#
+#   Project: FlexTools
+#   Module:  FTProfiler
+#
+#   Timing and profiling of Module runs:
+#    - ModuleManager.RunModules() calls Start() and Stop() around each
+#      Module if FTConfig.profileModules is True.
+#    - Each run records the wall time, CPU time, peak memory allocated
+#      by Python (tracemalloc) and the number of messages of each type.
+#      The CPU time is for the thread that runs the Module, so it doesn't
+#      include the UI, or any worker processes the Module uses.
+#    - Memory tracing slows Python code down, and the times include that
+#      overhead. The JSON file records this ("tracemalloc" : true) so
+#      that the times are only compared with other traced runs.
+#    - At the end a summary table is reported, and the results are saved
+#      as JSON in the Profiles folder so that they can be compared
+#      between FlexTools versions.
+#    - If FTConfig.profileDumps is also True, a cProfile dump (.prof) is
+#      saved for each Module as well. These can be examined with pstats
+#      or a viewer such as snakeviz.
+#
+
+import os
+import sys
+import json
+import time
+import datetime
+import cProfile
+import tracemalloc
+
+from .. import version
+from .FTConfig import PROFILES_PATH
+
+import logging
+logger = logging.getLogger(__name__)
+
+# ------------------------------------------------------------------
+
+class FTProfiler(object):
+
+    def __init__(self, projectName, cProfileDumps=False, folder=PROFILES_PATH):
+        self.projectName = projectName
+        self.cProfileDumps = cProfileDumps
+        self.folder = folder
+        self.started = datetime.datetime.now()
+        self.results = []
+        self.__current = None
+
+    def __FileName(self, name, extension):
+        # Files are named with the start time of the whole run so that
+        # the files from one run sort together.
+        fname = "%s %s %s%s" % (self.started.strftime("%Y-%m-%d %H%M%S"),
+                                self.projectName, name, extension)
+        return os.path.join(self.folder, fname)
+
+    def Start(self, moduleName, reporter):
+        # Starts timing moduleName. The message counts are taken from
+        # reporter when Stop() is called.
+        startedTracing = not tracemalloc.is_tracing()
+        if startedTracing:
+            tracemalloc.start()
+        elif hasattr(tracemalloc, "reset_peak"):
+            tracemalloc.reset_peak()
+
+        profile = None
+        if self.cProfileDumps:
+            profile = cProfile.Profile()
+            try:
+                profile.enable()
+            except ValueError as e:
+                # Another profiler is active (e.g. a debugger.)
+                logger.warning(f"cProfile not available: {e}")
+                profile = None
+
+        self.__current = (moduleName, reporter,
+                          list(reporter.messageCounts),
+                          startedTracing, profile,
+                          time.perf_counter(), time.thread_time())
+
+    def Stop(self):
+        # Stops timing the current Module and records the results.
+        if not self.__current:
+            return
+        endWall, endCPU = time.perf_counter(), time.thread_time()
+        (moduleName, reporter, startCounts, startedTracing, profile,
+         startWall, startCPU) = self.__current
+        self.__current = None
+
+        peakMemory = tracemalloc.get_traced_memory()[1]
+        if startedTracing:
+            tracemalloc.stop()
+
+        profileFile = None
+        if profile:
+            profile.disable()
+            # Numbered in case a Module is run more than once.
+            profileFile = self.__FileName("%02d %s" % (len(self.results) + 1,
+                                                       moduleName), ".prof")
+            try:
+                os.makedirs(self.folder, exist_ok=True)
+                profile.dump_stats(profileFile)
+            except OSError as e:
+                logger.warning(f"Couldn't write profile {profileFile}: {e}")
+                profileFile = None
+
+        counts = [end - start for start, end
+                  in zip(startCounts, reporter.messageCounts)]
+        self.results.append({"module"     : moduleName,
+                             "wallTime"   : endWall - startWall,
+                             "cpuTime"    : endCPU - startCPU,
+                             "peakMemory" : peakMemory,
+                             "messages"   : {"info"    : counts[reporter.INFO],
+                                             "warning" : counts[reporter.WARNING],
+                                             "error"   : counts[reporter.ERROR]},
+                             "profile"    : profileFile})
+        logger.debug("Profile: %s" % repr(self.results[-1]))
+
+    def Report(self, reporter):
+        # Reports a summary table of the Module runs.
+        if not self.results:
+            return
+        reporter.Blank()
+        reporter.Info("Module timings:")
+        reporter.Info("    %8s %8s %10s %8s %8s %8s  %s" %
+                      ("Wall (s)", "CPU (s)", "Peak (MB)",
+                       "Info", "Warning", "Error", "Module"))
+        for r in self.results:
+            m = r["messages"]
+            reporter.Info("    %8.2f %8.2f %10.1f %8d %8d %8d  %s" %
+                          (r["wallTime"], r["cpuTime"],
+                           r["peakMemory"] / 1024 / 1024,
+                           m["info"], m["warning"], m["error"],
+                           r["module"]),
+                          r["profile"])
+        reporter.Info("    %8.2f %8.2f" %
+                      (sum(r["wallTime"] for r in self.results),
+                       sum(r["cpuTime"] for r in self.results)))
+        reporter.Info("    (The times include the overhead of tracing memory allocations.)")
+
+    def Save(self):
+        # Writes the results to a JSON file in the Profiles folder.
+        # Returns the file name, or None if it couldn't be written.
+        if not self.results:
+            return None
+        fname = self.__FileName("timings", ".json")
+        data = {"flextoolsVersion" : version,
+                "pythonVersion"    : sys.version,
+                "project"          : self.projectName,
+                "started"          : self.started.isoformat(timespec="seconds"),
+                "tracemalloc"      : True,
+                "modules"          : self.results}
+        try:
+            os.makedirs(self.folder, exist_ok=True)
+            with open(fname, "w", encoding="utf-8") as file:
+                json.dump(data, file, indent=1)
+        except OSError as e:
+            logger.warning(f"Couldn't write timings {fname}: {e}")
+            return None
+        logger.info(f"Module timings saved to {fname}")
+        return fname
@@ -10,43 +10,109 @@
 #        - Warning: a warning message, with optional FLEx reference
 #        - Error: an error message, with optional FLEx reference
 #    - The UI displays this report information to the user.
+#    - The messages are kept in an FTMessageStore, which only keeps the
+#      most recent ones in memory.
+#    - Progress updates are passed on to the progress handler only when
+#      the percentage changes (or every PROGRESS_INTERVAL seconds), with
+#      the rate and estimated time remaining added to the message.
+#    - The UI can ask for the run to stop with Cancel(). Modules check
+#      the Cancelled property in long loops and return early.
+#    - Sinks (see AddSink()) receive every message as it is reported,
+#      with the time and the name of the Module that reported it. E.g.
+#      JSONLinesSink, which writes the messages to a file.
 #
 #   Craig Farrow
 #   Oct 2008
 #   v0.00
 #
 
+import time
+import json
+import datetime
+import threading
+
+from .FTMessageStore import FTMessageStore, MAX_MESSAGES_IN_MEMORY
+
 # ------------------------------------------------------------------
 
+# The longest time (seconds) between calls to the progress handler while
+# progress is being made. (Also how long before the rate and time
+# remaining are shown.)
+PROGRESS_INTERVAL = 1.0
+
+# Names of the message types (FTReporter.INFO, etc.)
+MESSAGE_TYPES = ["INFO", "WARNING", "ERROR", "BLANK"]
+
+def _FormatDuration(seconds):
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    if hours:
+        return "%d:%02d:%02d" % (hours, minutes, seconds)
+    return "%d:%02d" % (minutes, seconds)
+
+
 class FTReporter(object):
     INFO    = 0
     WARNING = 1
     ERROR   = 2
     BLANK   = 3
 
-    def __init__(self):
+    def __init__(self, maxMessagesInMemory=MAX_MESSAGES_IN_MEMORY):
         self.__handler = None
         self.__progressHandler = None
+        self.messages = FTMessageStore(maxMessagesInMemory)
+        self.progressMax = 0
+        self.progressMessage = None
+        self.__cancelled = threading.Event()
+        self.__sinks = []
+        self.SetModuleName(None)
+        self.__ProgressReset()
         self.Reset()
 
     def RegisterProgressHandler(self, handler):
         if handler:
             self.__progressHandler = handler
             self.progressMax = 0
+            self.__ProgressReset()
             
     def RegisterUIHandler(self, handler):
         if handler:
             self.__handler = handler
 
+    def AddSink(self, sink):
+        # sink.Write(message, moduleName, timestamp, elapsed) is called
+        # for each message, where:
+        #   - message is (msgType, msg, ref)
+        #   - moduleName is the Module that is running (or None)
+        #   - timestamp is the time of the message (time.time())
+        #   - elapsed is the number of seconds since the Module started
+        self.__sinks.append(sink)
+
+    def RemoveSink(self, sink):
+        self.__sinks.remove(sink)
+
+    def SetModuleName(self, moduleName):
+        # Called by the ModuleManager when each Module starts (and with
+        # None at the end.)
+        self.moduleName = moduleName
+        self.__moduleStart = time.time()
+
     def Reset(self):
         self.messageCounts = [0,0,0,0]
-        self.messages = []
+        self.messages.Clear()
+        self.__cancelled.clear()
 
     def __Report(self, msgType, msg, ref):
-        self.messages.append((msgType, msg, ref))
+        message = (msgType, msg, ref)
+        self.messages.append(message)
         self.messageCounts[msgType] += 1
+        if self.__sinks:
+            now = time.time()
+            for sink in self.__sinks:
+                sink.Write(message, self.moduleName,
+                           now, now - self.__moduleStart)
         if self.__handler:
-            self.__handler(self.messages[-1])
+            self.__handler(message)
 
     # --- Public methods for FTModules to use
 
@@ -64,24 +130,112 @@ class FTReporter(object):
     def Error(self, msg, ref=None):
         self.__Report(self.ERROR, msg, ref)
 
+    # > Cancellation
+
+    @property
+    def Cancelled(self):
+        return self.__cancelled.is_set()
+
+    def Cancel(self):
+        # Called (from any thread) to ask the Module to stop.
+        self.__cancelled.set()
+
     # > Progress Bar
 
+    def __ProgressReset(self):
+        self.progressRate = None        # Items per second
+        self.progressETA = None         # Seconds remaining
+        self.__progressStart = time.perf_counter()
+        # The handler is called when value reaches __progressNext
+        # (the next percentage) or when the time reaches __progressTime.
+        self.__progressNext = 0
+        self.__progressTime = 0
+
+    def __ProgressNotify(self, value):
+        now = time.perf_counter()
+        self.__progressTime = now + PROGRESS_INTERVAL
+        if not self.__progressHandler:
+            self.__progressNext = float("inf")
+            return
+
+        count = value + 1
+        msg = self.progressMessage
+        if self.progressMax > 0:
+            percent = (count * 100) // self.progressMax
+            # The first value that will give a higher percentage.
+            self.__progressNext = -((percent + 1) * self.progressMax // -100) - 1
+            elapsed = now - self.__progressStart
+            if elapsed >= PROGRESS_INTERVAL and count > 0:
+                self.progressRate = count / elapsed
+                self.progressETA = (self.progressMax - count) / self.progressRate
+                rate = "%.1f" if self.progressRate < 10 else "%d"
+                msg = "%s (%s/s, %s left)" % (msg or "Progress",
+                                              rate % self.progressRate,
+                                              _FormatDuration(self.progressETA))
+        else:
+            # No maximum (e.g. after ProgressStop()), so there is no
+            # percentage: only update after PROGRESS_INTERVAL.
+            self.__progressNext = float("inf")
+        self.__progressHandler(count,
+                               self.progressMax,
+                               msg)
+
     def ProgressUpdate(self, value):
-        if self.__progressHandler:
-            self.__progressHandler(value+1, 
-                                   self.progressMax, 
-                                   self.progressMessage)
+        # This is called for every item, so it returns quickly unless
+        # the progress display needs to change.
+        if value < self.__progressNext \
+           and time.perf_counter() < self.__progressTime:
+            return
+        self.__ProgressNotify(value)
 
     def ProgressStart(self, max, msg=None):
         self.progressMax = max
         self.progressMessage = msg
-        self.ProgressUpdate(-1)
+        self.__ProgressReset()
+        self.__ProgressNotify(-1)
            
     def ProgressStop(self):
         self.progressMax = 0            # Stop signal
         self.progressMessage = ""
-        self.ProgressUpdate(-1)
+        self.__ProgressReset()
+        self.__ProgressNotify(-1)
            
+
+# ------------------------------------------------------------------
+
+class JSONLinesSink(object):
+    """
+    A reporter sink that writes each message to a file as a JSON object
+    on its own line:
+        {"time": "2024-04-23T10:15:02.123", "elapsed": 1.25,
+         "project": ..., "module": ..., "type": "INFO"|"WARNING"|"ERROR"|"BLANK",
+         "message": ..., "reference": ...}
+    "elapsed" is the number of seconds since the Module started.
+    Each line is flushed as it is written, so the file can be followed
+    while the Modules are running.
+    """
+
+    def __init__(self, fname, projectName=None, append=True):
+        self.fname = fname
+        self.projectName = projectName
+        self.file = open(fname, "a" if append else "w", encoding="utf-8")
+
+    def Write(self, message, moduleName, timestamp, elapsed):
+        msgType, msg, ref = message
+        when = datetime.datetime.fromtimestamp(timestamp)
+        record = {"time"      : when.isoformat(timespec="milliseconds"),
+                  "elapsed"   : round(elapsed, 3),
+                  "project"   : self.projectName,
+                  "module"    : moduleName,
+                  "type"      : MESSAGE_TYPES[msgType],
+                  "message"   : msg,
+                  "reference" : ref}
+        self.file.write(json.dumps(record, default=repr) + "\n")
+        self.file.flush()
+
+    def Close(self):
+        self.file.close()
+
             
 if __name__ == '__main__':
     f = FTReporter()
@@ -90,5 +244,5 @@ if __name__ == '__main__':
     f.Warning("Cows crossing")
     f.Error("Bad bad news!")
     print(f.messageCounts)
-    print(f.messages)
+    print(list(f.messages))
     
@@ -0,0 +1,218 @@
+#
+#   Project: FlexTools
+#   Module:  FTWriteBuffer
+#
+#   Deferred writes to a FLEx project:
+#    - An instance is passed to each Module's Run() method (if the
+#      Module's processing function takes a writeBuffer parameter.)
+#    - The Module records its changes in the buffer instead of writing
+#      them to the project while it is iterating over the project.
+#    - Changes to the same field are combined, and changes that don't
+#      alter the field's value are dropped.
+#    - When modifications are allowed, the changes are written in one
+#      pass at the end of the Module (or whenever batchSize changes are
+#      pending.) Otherwise, the pending changes can be reported.
+#
+
+from collections import OrderedDict
+
+import logging
+logger = logging.getLogger(__name__)
+
+# ------------------------------------------------------------------
+
+# Kinds of change. These are also the order that the changes are
+# written in Flush().
+WB_SenseGloss   = "Sense gloss"
+WB_ReversalForm = "Reversal form"
+WB_FieldText    = "Field text"
+WB_FieldInteger = "Field integer"
+
+
+class FTWriteBuffer(object):
+    """
+    Records changes to a FLEx project for writing later.
+
+    The methods match the FLExProject methods for writing fields:
+        writeBuffer.SetSenseGloss(sense, gloss, languageTagOrHandle)
+        writeBuffer.SetReversalForm(entry, form, languageTagOrHandle)
+        writeBuffer.SetFieldText(senseOrEntryOrHvo, fieldID, text,
+                                 languageTagOrHandle)
+        writeBuffer.SetFieldInteger(senseOrEntryOrHvo, fieldID, integer)
+        writeBuffer.AddTagToField(senseOrEntryOrHvo, fieldID, tag)
+
+    These can be called whether or not modifications are allowed. The
+    project is only changed by Flush(), and only if modifyAllowed is True.
+    len(writeBuffer) is the number of changes pending.
+    """
+
+    def __init__(self, project, report, modifyAllowed=False, batchSize=0):
+        # batchSize: if not 0, Flush() is called whenever this many changes
+        #            are pending (and modifications are allowed.)
+        self.project = project
+        self.report = report
+        self.modifyAllowed = modifyAllowed
+        self.batchSize = batchSize
+        self.written = 0
+        # (kind, hvo, fieldID, ws) -> [object, old value, new value]
+        self.__pending = OrderedDict()
+
+    def __len__(self):
+        return len(self.__pending)
+
+    # --- Recording changes
+
+    @staticmethod
+    def __Key(kind, obj, fieldID, ws):
+        # The key of a change in __pending; obj may be an object or an Hvo.
+        try:
+            hvo = obj.Hvo
+        except AttributeError:
+            hvo = obj
+        return (kind, hvo, fieldID, ws)
+
+    def __Record(self, kind, obj, fieldID, ws, getter, value):
+        key = self.__Key(kind, obj, fieldID, ws)
+        try:
+            change = self.__pending[key]
+        except KeyError:
+            change = [obj, getter(), value]
+        if change[1] == value:
+            # Not a change to the project's current value.
+            self.__pending.pop(key, None)
+            return
+        change[2] = value
+        self.__pending[key] = change
+
+        if self.modifyAllowed and self.batchSize \
+           and len(self.__pending) >= self.batchSize:
+            self.Flush()
+
+    def SetSenseGloss(self, sense, gloss, languageTagOrHandle=None):
+        self.__Record(WB_SenseGloss, sense, None, languageTagOrHandle,
+                      lambda: self.project.LexiconGetSenseGloss(sense,
+                                                        languageTagOrHandle),
+                      gloss)
+
+    def SetReversalForm(self, entry, form, languageTagOrHandle=None):
+        self.__Record(WB_ReversalForm, entry, None, languageTagOrHandle,
+                      lambda: self.project.ReversalGetForm(entry,
+                                                        languageTagOrHandle),
+                      form)
+
+    def SetFieldText(self, senseOrEntryOrHvo, fieldID, text,
+                     languageTagOrHandle=None):
+        self.__Record(WB_FieldText, senseOrEntryOrHvo, fieldID,
+                      languageTagOrHandle,
+                      lambda: self.project.LexiconGetFieldText(senseOrEntryOrHvo,
+                                                fieldID, languageTagOrHandle),
+                      text)
+
+    def SetFieldInteger(self, senseOrEntryOrHvo, fieldID, integer):
+        self.__Record(WB_FieldInteger, senseOrEntryOrHvo, fieldID, None,
+                      lambda: self.project.GetCustomFieldValue(senseOrEntryOrHvo,
+                                                               fieldID),
+                      integer)
+
+    def AddTagToField(self, senseOrEntryOrHvo, fieldID, tag):
+        # As FLExProject.LexiconAddTagToField(), but tags added to the
+        # same field are combined into one write.
+        text = self.PendingValue(WB_FieldText, senseOrEntryOrHvo, fieldID)
+        if text is None:
+            text = self.project.LexiconGetFieldText(senseOrEntryOrHvo, fieldID)
+        if text:
+            if tag in text: return
+            text = "; ".join((text, tag))
+        else:
+            text = tag
+        self.SetFieldText(senseOrEntryOrHvo, fieldID, text)
+
+    # --- Querying the changes
+
+    def PendingValue(self, kind, obj, fieldID=None, languageTagOrHandle=None):
+        # Returns the value that will be written to this field, or None
+        # if there is no change pending.
+        key = self.__Key(kind, obj, fieldID, languageTagOrHandle)
+        try:
+            return self.__pending[key][2]
+        except KeyError:
+            return None
+
+    def Pending(self):
+        # Returns a list of the pending changes, in the order they will
+        # be written:
+        #   (kind, object, fieldID, languageTagOrHandle, old value, new value)
+        kinds = [WB_SenseGloss, WB_ReversalForm, WB_FieldText, WB_FieldInteger]
+        changes = [(kind, obj, fieldID, ws, old, new)
+                   for (kind, hvo, fieldID, ws), (obj, old, new)
+                   in self.__pending.items()]
+        changes.sort(key=lambda change: kinds.index(change[0]))
+        return changes
+
+    def ReportPending(self):
+        # Reports each pending change as an Info message.
+        for kind, obj, fieldID, ws, old, new in self.Pending():
+            try:
+                ref = self.project.BuildGotoURL(obj)
+            except Exception:
+                ref = None
+            field = kind if fieldID is None else "%s %s" % (kind, fieldID)
+            if ws:
+                field += " (%s)" % ws
+            self.report.Info("    %s: '%s' > '%s'" % (field, old, new), ref)
+        numPending = len(self.__pending)
+        self.report.Info("  %d pending %s" % (numPending,
+                         "change" if numPending==1 else "changes"))
+
+    # --- Writing the changes
+
+    def Flush(self):
+        # Writes all the pending changes to the project (grouped by kind),
+        # if modifications are allowed. Returns the number written.
+        # Each change is only removed once it has been written, so if a
+        # write raises an exception, that change and the ones after it
+        # are still pending (see Discard().)
+        if not self.modifyAllowed:
+            return 0
+
+        writers = {
+            WB_SenseGloss:   lambda obj, fieldID, ws, value:
+                self.project.LexiconSetSenseGloss(obj, value, ws),
+            WB_ReversalForm: lambda obj, fieldID, ws, value:
+                self.project.ReversalSetForm(obj, value, ws),
+            WB_FieldText:    lambda obj, fieldID, ws, value:
+                self.project.LexiconSetFieldText(obj, fieldID, value, ws),
+            WB_FieldInteger: lambda obj, fieldID, ws, value:
+                self.project.LexiconSetFieldInteger(obj, fieldID, value),
+            }
+
+        numWritten = 0
+        try:
+            for kind, obj, fieldID, ws, old, new in self.Pending():
+                writers[kind](obj, fieldID, ws, new)
+                del self.__pending[self.__Key(kind, obj, fieldID, ws)]
+                numWritten += 1
+        finally:
+            self.written += numWritten
+            logger.debug("Wrote %d changes" % numWritten)
+        return numWritten
+
+    def Finish(self, listPending=False):
+        # Called when the Module has finished: writes the pending changes
+        # if modifications are allowed, otherwise reports how many there
+        # are (and lists them if listPending is True.)
+        if self.modifyAllowed:
+            self.Flush()
+        elif self.__pending:
+            if listPending:
+                self.ReportPending()
+            else:
+                numPending = len(self.__pending)
+                self.report.Info("  %d pending %s not written" % (numPending,
+                                 "change" if numPending==1 else "changes"))
+
+    def Discard(self):
+        # Drops all the pending changes. Returns the number dropped.
+        numPending = len(self.__pending)
+        self.__pending.clear()
+        return numPending
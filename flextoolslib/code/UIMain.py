@@ -19,6 +19,10 @@
 #       If FTConfig.stopOnError is True, then processing will stop after
 #       any module that outputs an error message.
 #
+#   The modules are run on a worker thread so that the UI stays responsive.
+#   The Stop button asks the modules to stop (see FTReporter.Cancel()); the
+#   project is still closed normally.
+#
 #   Copyright Craig Farrow, 2010 - 2024
 #
 
@@ -57,6 +61,7 @@ from System.Windows.Forms import (
     Keys, Control,
     TextRenderer)
 
+from System import Action
 from System.Threading import Thread, ThreadStart, ApartmentState
 
 from .. import version
@@ -91,6 +96,8 @@ MESSAGE_SelectCollectionToolbar = \
     "Select or create a collection by clicking the Collections button in the toolbar."
 MESSAGE_SelectCollectionMenu = \
     "Select or create a collection by using the FlexTools | Manage Collections menu, or pressing Ctrl-L."
+MESSAGE_Stopping = \
+    "Stopping... (The current module will stop when it next checks.)"
 MESSAGE_RunButtons = \
     "Use the Run buttons to run modules."
 
@@ -158,11 +165,27 @@ class FTPanel(Panel):
         else:
             MESSAGE_SelectCollection = MESSAGE_SelectCollectionToolbar
         
-        ButtonList = ButtonListA + ButtonListB
+        ButtonListC = [
+                      None, # Separator
+                      (self.Stop,
+                       "Stop",
+                       "delete",
+                       "Stop running the modules"),
+                      ]
+
+        ButtonList = ButtonListA + ButtonListB + ButtonListC
 
         self.toolbar = CustomToolBar(ButtonList,
                                      UIGlobal.ToolbarIconParams)
 
+        # The buttons to disable while modules are running, and the
+        # Stop button (only enabled while running.)
+        self.runButtons = [self.toolbar.Buttons[i]
+                           for i in range(len(ButtonListA),
+                                          len(ButtonListA) + len(ButtonListB))]
+        self.stopButton = self.toolbar.Buttons[len(ButtonList) - 1]
+        self.stopButton.Enabled = False
+
         # Pre-calculate the menu items to disable when DisableRunAll is defined
         # for a collection.
         runallIndices = [i for i, b in enumerate(ButtonList)
@@ -185,6 +208,8 @@ class FTPanel(Panel):
         self.__InitToolBar()
 
         self.__ManageCollectionsHandler = None
+        self.__RunningStateHandler = None
+        self.runThread = None
 
         # -- Module list and Report window
         self.moduleManager = moduleManager
@@ -268,6 +293,9 @@ class FTPanel(Panel):
             self.__ChooseProjectHandler()
 
     def __Run(self, message, modules, modifyAllowed = False):
+        if self.IsRunning():
+            return
+
         # Reload the modules to make sure we're using the latest code.
         if self.reloadFunction: self.reloadFunction()
 
@@ -297,13 +325,58 @@ class FTPanel(Panel):
                 message += " (Changes enabled)"
 
         self.reportWindow.Reporter.Info(message)
-        self.reportWindow.Refresh()
-        self.moduleManager.RunModules(FTConfig.currentProject,
-                                      modules,
-                                      self.reportWindow.Reporter,
-                                      modifyAllowed)
-        # Make sure the progress indicator is off
-        self.reportWindow.Reporter.ProgressStop()
+        self.reportWindow.RefreshMessages()
+        self.__StartRun(FTConfig.currentProject, modules, modifyAllowed)
+
+    def __StartRun(self, projectName, modules, modifyAllowed):
+        # Runs the modules on a worker thread. The report messages are
+        # shown by the report window's timer, and the progress handler
+        # passes updates to the UI thread.
+        reporter = self.reportWindow.Reporter
+
+        def __RunModules():
+            try:
+                self.moduleManager.RunModules(projectName,
+                                              modules,
+                                              reporter,
+                                              modifyAllowed)
+            except Exception:
+                logger.exception("RunModules failed:")
+            finally:
+                # Make sure the progress indicator is off
+                reporter.ProgressStop()
+                self.BeginInvoke(Action(self.__RunFinished))
+
+        self.__SetRunningState(True)
+        self.runThread = Thread(ThreadStart(__RunModules))
+        self.runThread.SetApartmentState(ApartmentState.STA)
+        self.runThread.IsBackground = True
+        self.runThread.Start()
+
+    def __RunFinished(self):
+        # Called on the UI thread when the worker thread has finished.
+        self.runThread = None
+        self.__SetRunningState(False)
+        self.reportWindow.RefreshMessages()
+
+    def __SetRunningState(self, running):
+        for button in self.runButtons:
+            button.Enabled = not running
+        if not running:
+            for button in self.runallButtons:
+                button.Enabled = not getattr(self.listOfModules,
+                                             "disableRunAll", False)
+        self.stopButton.Enabled = running
+        if self.__RunningStateHandler:
+            self.__RunningStateHandler(running)
+
+    def IsRunning(self):
+        return self.runThread is not None
+
+    def Stop(self):
+        if self.IsRunning() and not self.reportWindow.Reporter.Cancelled:
+            self.reportWindow.Reporter.Cancel()
+            self.reportWindow.Report(MESSAGE_Stopping)
 
     def RunAll(self, modifyAllowed=False):
         if len(self.listOfModules) > 0:
@@ -374,12 +447,17 @@ class FTPanel(Panel):
     def SetManageCollectionsHandler(self, handler):
         self.__ManageCollectionsHandler = handler
 
+    def SetRunningStateHandler(self, handler):
+        # handler(running) is called when modules start and stop running.
+        self.__RunningStateHandler = handler
+
     def UpdateModuleList(self, listOfModules):
         if self.startupToolTip:
             self.startupToolTip.RemoveAll()
         self.listOfModules = listOfModules
         for button in self.runallButtons:
-            button.Enabled = not listOfModules.disableRunAll
+            button.Enabled = not listOfModules.disableRunAll \
+                             and not self.IsRunning()
         self.modulesList.UpdateAllItems(self.listOfModules)
         
     def UpdateCollectionTabs(self):
@@ -428,7 +506,9 @@ class FTPanel(Panel):
         self.reportWindow.CopyToClipboard()
 
     def ClearReport(self):
-        self.reportWindow.Clear()
+        # (The report is in use while modules are running.)
+        if not self.IsRunning():
+            self.reportWindow.Clear()
 
     def RefreshModules(self):
         self.modulesList.UpdateAllItems(self.listOfModules,
@@ -487,6 +567,11 @@ class FTMainForm (Form):
                         Shortcut.CtrlShiftA,
                         "Run all the modules and allow changes to the project"),
                        ]
+        RunMenu += [None,     # Separator
+                    (self.Stop,
+                     "Stop",
+                     None,
+                     "Stop running the modules")]
 
         ReportMenu =    [(self.CopyToClipboard, 
                           "Copy to Clipboard", 
@@ -536,11 +621,24 @@ class FTMainForm (Form):
         # Pre-calculate the menu items to disable when DisableRunAll is defined
         # for a collection.
         runallIndices = [i for i, m in enumerate(RunMenu)
-                         if m[0] in (self.RunAll, self.RunAllModify)]
+                         if m and m[0] in (self.RunAll, self.RunAllModify)]
         self.runallMenuItems = [self.Menu.MenuItems[1].MenuItems[i]
                                 for i in runallIndices]
 
+        # The menu items to disable while modules are running, and the
+        # Stop menu item (only enabled while running.)
+        runMenuItems = self.Menu.MenuItems[1].MenuItems
+        self.runMenuItems = [runMenuItems[i] for i, m in enumerate(RunMenu)
+                             if m and m[0] != self.Stop]
+        self.stopMenuItem = runMenuItems[len(RunMenu) - 1]
+        self.stopMenuItem.Enabled = False
+        reloadIndex = [m[0] for m in FlexToolsMenu].index(self.ReloadModules)
+        self.reloadMenuItem = self.Menu.MenuItems[0].MenuItems[reloadIndex]
+
     def __LoadModules(self):
+        # The modules can't be replaced while they are running.
+        if hasattr(self, "UIPanel") and self.UIPanel.IsRunning():
+            return
         logger.debug("Loading modules")
         if not hasattr(self, "moduleManager"):
             self.moduleManager = FTModules.ModuleManager()
@@ -668,6 +766,9 @@ class FTMainForm (Form):
                                )
         self.UIPanel.SetChooseProjectHandler(self.ChooseProject)
         self.UIPanel.SetManageCollectionsHandler(self.ManageCollections)
+        self.UIPanel.SetRunningStateHandler(self.__RunningStateChanged)
+        self.closeWhenStopped = False
+        self.FormClosing += self.__OnFormClosing
 
         self.Controls.Add(self.UIPanel)
         self.Controls.Add(self.StatusBar)
@@ -696,10 +797,35 @@ class FTMainForm (Form):
             self.StatusBar.Text = newText
 
     def UpdateMenuEnabledStates(self, disableRunAll):
+        running = hasattr(self, "UIPanel") and self.UIPanel.IsRunning()
         for menu in self.runallMenuItems:
-            menu.Enabled = not disableRunAll
+            menu.Enabled = not disableRunAll and not running
+
+    def __RunningStateChanged(self, running):
+        for menu in self.runMenuItems:
+            menu.Enabled = not running
+        self.reloadMenuItem.Enabled = not running
+        self.stopMenuItem.Enabled = running
+        if not running:
+            listOfModules = self.UIPanel.listOfModules
+            self.UpdateMenuEnabledStates(False if not listOfModules else
+                                         listOfModules.disableRunAll)
+            if self.closeWhenStopped:
+                self.Close()
+
+    def __OnFormClosing(self, sender, event):
+        # Don't close while modules are running: stop them and close
+        # once the project has been closed.
+        if self.UIPanel.IsRunning():
+            event.Cancel = True
+            self.closeWhenStopped = True
+            self.UIPanel.Stop()
 
     def __ProgressBar(self, val, max, msg=None):
+        # Progress updates come from the thread running the modules.
+        if self.InvokeRequired:
+            self.BeginInvoke(Action(lambda: self.__ProgressBar(val, max, msg)))
+            return
         if max == 0: # Clear progress bar
             if self.progressPercent != -1:
                 self.progressPercent = -1
@@ -767,3 +893,6 @@ class FTMainForm (Form):
         
     def RunAllModify(self, sender, event):
         self.UIPanel.RunAllModify()
+
+    def Stop(self, sender, event):
+        self.UIPanel.Stop()
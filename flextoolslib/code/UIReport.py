@@ -5,11 +5,17 @@
 #
 #   A custom list for status report messages from a FlexTools Module.
 #
+#   The list is in virtual mode: the messages are read from the
+#   Reporter's message store when they are displayed, rather than
+#   being added to the ListView. New messages are shown in batches
+#   (every REFRESH_INTERVAL), with one scroll to the end per batch.
+#
 #   Craig Farrow
 #   September 2010
 #
 
 import os
+import time
 
 from . import UIGlobal
 from . import FTReport
@@ -23,11 +29,14 @@ from System.Windows.Forms import (
     ListView, ListViewItem, DrawItemState, ColumnHeaderStyle,
     HorizontalAlignment, 
     ImageList, ColorDepth,
-    Clipboard,
+    Clipboard, Timer,
     )
 
 from System import Environment
 
+# Seconds between showing batches of new messages.
+REFRESH_INTERVAL = 0.1
+
 
 class ReportWindow(ListView):
     def __init__(self):
@@ -42,10 +51,14 @@ class ReportWindow(ListView):
         self.HeaderStyle = getattr(ColumnHeaderStyle, "None")
         self.ShowItemToolTips = True
         self.Columns.Add("", -2, HorizontalAlignment.Left)
+        self.VirtualMode = True
+        self.VirtualListSize = 0
 
         # Events
         self.Resize += self.__OnResize
         self.DoubleClick += self.__OnDoubleClick
+        self.RetrieveVirtualItem += self.__OnRetrieveVirtualItem
+        self.CacheVirtualItems += self.__OnCacheVirtualItems
 
         # Register this class as the sink for all messages.
         # The higher level passes self.Reporter to the Modules.
@@ -60,6 +73,16 @@ class ReportWindow(ListView):
         for i in images:
             self.SmallImageList.Images.Add(
                 Bitmap.FromFile(os.path.join(path, i+suffix)))
+
+        # Messages for the items currently on screen
+        self.__cacheStart = 0
+        self.__cache = []
+
+        self.__lastRefresh = 0
+        self.__refreshTimer = Timer()
+        self.__refreshTimer.Interval = int(REFRESH_INTERVAL * 1000)
+        self.__refreshTimer.Tick += self.__OnRefreshTimer
+        self.__refreshTimer.Start()
         self.ResumeLayout(False)
 
     def __OnResize(self, sender, event):
@@ -67,42 +90,87 @@ class ReportWindow(ListView):
         self.Columns[0].Width = self.Size.Width - 24
 
     def __OnDoubleClick(self, sender, event):
-        if sender.SelectedItems.Count:
-            item = sender.SelectedItems[0]
-            if item.Tag and item.Tag.startswith("silfw:"):
-                os.startfile(item.Tag)
+        if sender.SelectedIndices.Count:
+            msgType, msg, extra = self.__Message(sender.SelectedIndices[0])
+            if isinstance(extra, str) and extra.startswith("silfw:"):
+                os.startfile(extra)
+
+    # --- Virtual list
+
+    def __Message(self, index):
+        i = index - self.__cacheStart
+        if 0 <= i < len(self.__cache):
+            return self.__cache[i]
+        return self.Reporter.messages[index]
+
+    def __OnCacheVirtualItems(self, sender, event):
+        self.__cacheStart = event.StartIndex
+        self.__cache = self.Reporter.messages.Page(event.StartIndex,
+                                                   event.EndIndex - event.StartIndex + 1)
+
+    def __OnRetrieveVirtualItem(self, sender, event):
+        msgType, msg, extra = self.__Message(event.ItemIndex)
+        if msg == None: msg = ""            # If None then no icon shows
+        item = ListViewItem([msg], msgType) # 2nd = image index; 3 => no icon
+        if extra:
+            try:
+                if extra.startswith("silfw:"):
+                    item.ToolTipText = "Double-click to jump to Fieldworks"
+                else:
+                    item.ToolTipText = extra
+                item.Tag = extra
+            except AttributeError:      # Not a string
+                item.Tag = item.ToolTipText = repr(extra)
+        event.Item = item
+
+    def __Refresh(self):
+        # Shows any new messages and scrolls to the last one (when the
+        # window is next painted.)
+        self.__lastRefresh = time.perf_counter()
+        numMessages = len(self.Reporter.messages)
+        if numMessages != self.VirtualListSize:
+            self.VirtualListSize = numMessages
+            if numMessages:
+                self.EnsureVisible(numMessages - 1)
+
+    def __OnRefreshTimer(self, sender, event):
+        self.__Refresh()
+
+    # --- Public methods
 
     def Report(self, reportItem):
-        if type(reportItem) == tuple:
-            msgType, msg, extra = reportItem
-            if msg == None: msg = ""            # If None then no icon shows
-            item = ListViewItem([msg], msgType) # 2nd = image index; 3 => no icon
-            if extra:
-                try:
-                    if extra.startswith("silfw:"):
-                        item.ToolTipText = "Double-click to jump to Fieldworks"
-                    else:
-                        item.ToolTipText = extra
-                    item.Tag = extra
-                except AttributeError:      # Not a string
-                    item.Tag = item.ToolTipText = repr(extra)
-            addedItem = self.Items.Add(item)
-        else:
-            addedItem = self.Items.Add(reportItem)
-        addedItem.EnsureVisible()
+        # The Reporter's UI handler. The message is already in the
+        # Reporter's message store.
+        # A string is a message from the UI (not from a Module); it is
+        # added to the store but not counted.
+        if type(reportItem) != tuple:
+            self.Reporter.messages.append((FTReport.FTReporter.BLANK,
+                                           reportItem, None))
+        # When the Modules are run on the UI thread the timer doesn't
+        # run, so refresh here as well. (Otherwise the control can't be
+        # used from this thread, and the timer shows the messages.)
+        if not self.InvokeRequired and \
+           time.perf_counter() - self.__lastRefresh >= REFRESH_INTERVAL:
+            self.RefreshMessages()
+
+    def RefreshMessages(self):
+        # Shows any new messages now.
+        self.__Refresh()
+        self.Update()
 
     def CopyToClipboard(self):
-        def __getData(item):
-            if item.Tag:
-                if item.Tag.startswith("silfw:"):
-                    return item.Text
+        def __getData(message):
+            msgType, msg, extra = message
+            if msg == None: msg = ""
+            if extra:
+                if isinstance(extra, str) and extra.startswith("silfw:"):
+                    return msg
                 else:
-                    return Environment.NewLine.join((item.Text, 
-                                                     item.ToolTipText))
+                    return Environment.NewLine.join((msg, str(extra)))
             else:
-                return item.Text
+                return msg
 
-        data = [__getData(i) for i in self.Items]
+        data = [__getData(m) for m in self.Reporter.messages]
 
         if data:
             Clipboard.SetText(Environment.NewLine.join(data))
@@ -111,4 +179,6 @@ class ReportWindow(ListView):
 
     def Clear(self):
         self.Reporter.Reset()
-        self.Items.Clear()
+        self.__cacheStart = 0
+        self.__cache = []
+        self.__Refresh()
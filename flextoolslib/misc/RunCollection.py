@@ -0,0 +1,231 @@
+#
+#   RunCollection
+#
+#   Runs a collection of modules on one or more projects without the
+#   FlexTools user interface. E.g. for scheduled integrity checks.
+#   Used by FlexTools\scripts\RunCollection.py
+#
+#   Several projects can be run at the same time in worker processes,
+#   each with its own FLEx session. The report messages from all the
+#   projects are merged into one stream.
+#
+#   The report messages are written to stdout as text, or as JSON lines:
+#       {"project": ..., "type": "INFO"|"WARNING"|"ERROR"|"BLANK",
+#        "message": ..., "reference": ...}
+#
+#   Exit codes:
+#       0 - success
+#       1 - a project couldn't be opened, or a module reported errors
+#       2 - bad arguments (e.g. the collection doesn't exist)
+#
+
+import sys
+import json
+import argparse
+import atexit
+import traceback
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, wait
+
+import logging
+logger = logging.getLogger(__name__)
+
+from flexlibs import FLExInitialize, FLExCleanup, FLExProject
+
+from ..code.FTModules import ModuleManager
+from ..code.FTCollections import CollectionsManager, FTC_NameError
+from ..code.FTReport import FTReporter, MESSAGE_TYPES
+
+EXIT_OK     = 0
+EXIT_ERRORS = 1
+EXIT_USAGE  = 2
+
+#----------------------------------------------------------------
+
+def TextMessageWriter(output=sys.stdout):
+    # Returns a handler that writes report messages as text lines,
+    # prefixed with the project name.
+    def __write(projectName, message):
+        msgType, msg, ref = message
+        if msgType == FTReporter.BLANK:
+            output.write("\n")
+        else:
+            output.write(f"[{projectName}] {MESSAGE_TYPES[msgType]}: {msg}\n")
+            if ref:
+                output.write(f"[{projectName}]     {ref}\n")
+        output.flush()
+    return __write
+
+
+def JSONMessageWriter(output=sys.stdout):
+    # Returns a handler that writes report messages as JSON lines.
+    def __write(projectName, message):
+        msgType, msg, ref = message
+        output.write(json.dumps({"project"   : projectName,
+                                 "type"      : MESSAGE_TYPES[msgType],
+                                 "message"   : msg,
+                                 "reference" : ref}) + "\n")
+        output.flush()
+    return __write
+
+#----------------------------------------------------------------
+
+def RunCollection(collectionName, projectNames,
+                  modifyAllowed=False,
+                  writeMessage=None,
+                  workers=1,
+                  projectClass=FLExProject):
+    """
+    Runs the modules in the named collection on each of the projects.
+      - writeMessage(projectName, message) is called for each report
+        message, where message is (msgType, msg, reference). The default
+        writes text to stdout.
+      - workers is the maximum number of projects to run at the same
+        time. If more than 1, the projects are run in worker processes.
+      - projectClass is the class used to open the projects (see
+        ModuleManager.) For worker processes it must be importable by
+        name.
+    Returns one of the EXIT_ codes.
+
+    Note: FLExInitialize() must have been called.
+    """
+
+    if not writeMessage:
+        writeMessage = TextMessageWriter()
+
+    collectionsManager = CollectionsManager()
+    try:
+        moduleList = collectionsManager.ListOfModules(collectionName)
+    except FTC_NameError as e:
+        logger.error(e.message)
+        sys.stderr.write(f"{e.message}\n"
+                         f"Collections: {', '.join(sorted(collectionsManager.Names()))}\n")
+        return EXIT_USAGE
+
+    if workers > 1 and len(projectNames) > 1:
+        return __RunParallel(list(moduleList), projectNames, modifyAllowed,
+                             writeMessage, workers, projectClass)
+
+    moduleManager = ModuleManager(projectClass)
+    for error in moduleManager.LoadAll():
+        logger.warning(error)
+        sys.stderr.write(f"{error}\n")
+
+    result = EXIT_OK
+    for projectName in projectNames:
+        logger.info(f"Running collection '{collectionName}' on {projectName}")
+        reporter = FTReporter()
+        reporter.RegisterUIHandler(
+            lambda message, projectName=projectName: writeMessage(projectName, message))
+
+        if not moduleManager.RunModules(projectName, moduleList,
+                                        reporter, modifyAllowed):
+            result = EXIT_ERRORS
+        elif reporter.messageCounts[reporter.ERROR]:
+            result = EXIT_ERRORS
+
+    return result
+
+#----------------------------------------------------------------
+# Running projects in parallel
+#
+# Each worker process initialises FLEx and loads the modules once, then
+# runs whole projects. The report messages are sent back through a queue
+# as they happen.
+
+def _initWorker(messageQueue, projectClass):
+    global _workerQueue, _workerModules
+
+    if projectClass is FLExProject:
+        FLExInitialize()
+        atexit.register(FLExCleanup)
+
+    _workerQueue = messageQueue
+    _workerModules = ModuleManager(projectClass)
+    for error in _workerModules.LoadAll():
+        logger.warning(error)
+
+
+def _runProject(projectName, moduleList, modifyAllowed):
+    # Returns True if the project ran without errors.
+    reporter = FTReporter()
+    reporter.RegisterUIHandler(
+        lambda message: _workerQueue.put((projectName, message)))
+
+    if not _workerModules.RunModules(projectName, moduleList,
+                                     reporter, modifyAllowed):
+        return False
+    return not reporter.messageCounts[reporter.ERROR]
+
+
+def __RunParallel(moduleList, projectNames, modifyAllowed,
+                  writeMessage, workers, projectClass):
+
+    def __writeMessages():
+        while not messageQueue.empty():
+            writeMessage(*messageQueue.get())
+
+    result = EXIT_OK
+    # 'spawn' is the only method on Windows; use it everywhere so that
+    # the workers behave the same on all platforms.
+    context = multiprocessing.get_context("spawn")
+    with context.Manager() as manager:
+        messageQueue = manager.Queue()
+        with ProcessPoolExecutor(max_workers=workers,
+                                 mp_context=context,
+                                 initializer=_initWorker,
+                                 initargs=(messageQueue, projectClass)) as executor:
+            futures = {executor.submit(_runProject, projectName,
+                                       moduleList, modifyAllowed) : projectName
+                       for projectName in projectNames}
+            running = set(futures)
+            while running:
+                finished, running = wait(running, timeout=0.1)
+                __writeMessages()
+                for future in finished:
+                    try:
+                        ok = future.result()
+                    except Exception as e:
+                        details = "".join(traceback.format_exception(type(e), e,
+                                                                   e.__traceback__))
+                        logger.error(details)
+                        writeMessage(futures[future],
+                                     (FTReporter.ERROR,
+                                      f"Worker process failed: {e}",
+                                      details))
+                        ok = False
+                    if not ok:
+                        result = EXIT_ERRORS
+        __writeMessages()
+
+    return result
+
+#----------------------------------------------------------------
+
+def main(argv=None):
+    # Command-line interface. Returns the exit code.
+
+    parser = argparse.ArgumentParser(
+        description="Run a FlexTools collection without the user interface.")
+    parser.add_argument("collection",
+                        help="name of the collection to run")
+    parser.add_argument("projects", nargs="+",
+                        help="names of the FieldWorks projects")
+    parser.add_argument("--modify", action="store_true",
+                        help="allow the modules to change the projects")
+    parser.add_argument("--json", action="store_true",
+                        help="write the report messages as JSON lines")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="number of projects to run at the same time")
+    args = parser.parse_args(argv)
+
+    writeMessage = JSONMessageWriter() if args.json else TextMessageWriter()
+
+    FLExInitialize()
+    try:
+        return RunCollection(args.collection, args.projects,
+                             modifyAllowed = args.modify,
+                             writeMessage = writeMessage,
+                             workers = args.workers)
+    finally:
+        FLExCleanup()
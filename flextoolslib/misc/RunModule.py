@@ -22,6 +22,7 @@ from flexlibs import (
 
 from ..code.FTModuleClass import FTM_ModuleError
 from ..code.FTReport import FTReporter
+from ..code.FTWriteBuffer import FTWriteBuffer
 
     
 #----------------------------------------------------------------
@@ -99,9 +100,12 @@ def __RunModule(module, project):
         return False
         
     # --- Run the module ---
+    # (The project is read-only, so any changes are listed, not written.)
     reporter = FTReporter()
+    writeBuffer = FTWriteBuffer(FlexDB, reporter)
     try:
-        ftm.Run(FlexDB, reporter)
+        ftm.Run(FlexDB, reporter, writeBuffer=writeBuffer)
+        writeBuffer.Finish(listPending=True)
     except:
         logger.exception("Runtime error:")
         return False
@@ -51,6 +51,9 @@ def includeFile(path):
         return False
     if path.is_file() and path.parent.name == "Archive":   
         return False
+    # and any change tracking state left from running them
+    if path.name == "State" or path.parent.name == "State":
+        return False
     
     return not path.suffix in FILTERED_SUFFIXES
 
@@ -0,0 +1,131 @@
+#
+#   Project: FlexTools
+#   Module:  test_FTMessageStore
+#
+#   Checks that FTMessageStore behaves like a list of messages whether
+#   they are in memory or have been moved to the spill file:
+#    - len(), indexing (including negative indexes) and iteration;
+#    - Page() across the file/memory boundary;
+#    - references that aren't strings, and non-ASCII text;
+#    - Clear(), and adding messages while iterating.
+#
+#   Run with pytest.
+#
+
+import threading
+import os
+import importlib.util
+
+def loadModule(name):
+    # Loads the module from flextoolslib/code without importing the
+    # flextoolslib package, which needs FieldWorks (via pythonnet.)
+    path = os.path.join(os.path.dirname(__file__),
+                        "..", "flextoolslib", "code", name + ".py")
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+FTMessageStore = loadModule("FTMessageStore").FTMessageStore
+
+# ------------------------------------------------------------------
+
+def makeMessages(count):
+    return [(i % 3, "Message %d 中文" % i, "silfw://%d" % i if i % 2 else None)
+            for i in range(count)]
+
+def makeStore(messages, maxInMemory):
+    store = FTMessageStore(maxInMemory=maxInMemory)
+    for message in messages:
+        store.append(message)
+    return store
+
+# ------------------------------------------------------------------
+
+def test_in_memory():
+    messages = makeMessages(10)
+    store = makeStore(messages, maxInMemory=100)
+    assert store.Spilled() == 0
+    assert len(store) == 10
+    assert list(store) == messages
+    assert store[0] == messages[0]
+    assert store[-1] == messages[-1]
+
+def test_spilled():
+    messages = makeMessages(2500)
+    store = makeStore(messages, maxInMemory=100)
+    assert store.Spilled() == 2400
+    assert len(store) == 2500
+    assert list(store) == messages
+    for i in (0, 1, 2399, 2400, 2499, -1, -2500):
+        assert store[i] == messages[i], i
+
+def test_pages():
+    messages = makeMessages(250)
+    store = makeStore(messages, maxInMemory=100)
+    # Within the file, across the boundary, within memory, and past the end
+    for start, count in ((0, 10), (140, 20), (145, 10), (200, 50),
+                         (240, 20), (250, 10), (-5, 10)):
+        assert store.Page(start, count) == \
+               messages[max(0, start):max(0, start)+count], (start, count)
+
+def test_index_errors():
+    store = makeStore(makeMessages(5), maxInMemory=2)
+    for index in (5, -6):
+        try:
+            store[index]
+        except IndexError:
+            pass
+        else:
+            assert False, "IndexError expected for %d" % index
+
+def test_references():
+    # References that aren't strings are kept in memory, but stored as
+    # their repr() in the file.
+    class Ref(object):
+        def __repr__(self):
+            return "<Ref>"
+    ref = Ref()
+    store = makeStore([(0, "first", ref), (1, "second", ref)], maxInMemory=1)
+    assert store[0] == (0, "first", "<Ref>")
+    assert store[1] == (1, "second", ref)
+
+def test_clear():
+    store = makeStore(makeMessages(50), maxInMemory=10)
+    store.Clear()
+    assert len(store) == 0
+    assert store.Spilled() == 0
+    assert list(store) == []
+    messages = makeMessages(20)
+    for message in messages:
+        store.append(message)
+    assert list(store) == messages
+
+def test_iteration_snapshot():
+    messages = makeMessages(30)
+    store = makeStore(messages, maxInMemory=10)
+    seen = []
+    for message in store:
+        seen.append(message)
+        if len(seen) == 1:
+            store.append((0, "Added while iterating", None))
+    assert seen == messages
+    assert len(store) == 31
+
+def test_threads():
+    # Messages added on one thread while they are read on another.
+    store = FTMessageStore(maxInMemory=50)
+    messages = makeMessages(5000)
+
+    def add():
+        for message in messages:
+            store.append(message)
+
+    writer = threading.Thread(target=add)
+    writer.start()
+    while writer.is_alive():
+        n = len(store)
+        start = max(0, n - 60)
+        assert store.Page(start, n - start) == messages[start:n]
+    writer.join()
+    assert list(store) == messages
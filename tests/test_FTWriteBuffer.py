@@ -0,0 +1,210 @@
+#
+#   Project: FlexTools
+#   Module:  test_FTWriteBuffer
+#
+#   Checks FTWriteBuffer against a fake project that records the writes:
+#    - changes are only written by Flush(), and only if modifications
+#      are allowed;
+#    - changes to the same field are combined, and changes back to the
+#      current value are dropped;
+#    - the changes are written grouped by kind, and in batches if
+#      batchSize is set;
+#    - a change that fails to write stays pending, with the ones after it.
+#
+#   Run with pytest.
+#
+
+import os
+import importlib.util
+
+def loadModule(name):
+    # Loads the module from flextoolslib/code without importing the
+    # flextoolslib package, which needs FieldWorks (via pythonnet.)
+    path = os.path.join(os.path.dirname(__file__),
+                        "..", "flextoolslib", "code", name + ".py")
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+_FTWriteBuffer = loadModule("FTWriteBuffer")
+FTWriteBuffer = _FTWriteBuffer.FTWriteBuffer
+WB_SenseGloss = _FTWriteBuffer.WB_SenseGloss
+WB_ReversalForm = _FTWriteBuffer.WB_ReversalForm
+WB_FieldText = _FTWriteBuffer.WB_FieldText
+WB_FieldInteger = _FTWriteBuffer.WB_FieldInteger
+
+# ------------------------------------------------------------------
+
+class FakeObject(object):
+    def __init__(self, hvo):
+        self.Hvo = hvo
+
+
+class FakeProject(object):
+    # The fields are stored in a dictionary, and each write is recorded
+    # in the writes list.
+    def __init__(self):
+        self.fields = {}
+        self.writes = []
+
+    def __Set(self, kind, obj, fieldID, ws, value):
+        self.writes.append((kind, obj.Hvo, value))
+        self.fields[(kind, obj.Hvo, fieldID, ws)] = value
+
+    def __Get(self, kind, obj, fieldID, ws, default=""):
+        return self.fields.get((kind, obj.Hvo, fieldID, ws), default)
+
+    def LexiconGetSenseGloss(self, sense, ws=None):
+        return self.__Get(WB_SenseGloss, sense, None, ws)
+
+    def LexiconSetSenseGloss(self, sense, gloss, ws=None):
+        self.__Set(WB_SenseGloss, sense, None, ws, gloss)
+
+    def ReversalGetForm(self, entry, ws=None):
+        return self.__Get(WB_ReversalForm, entry, None, ws)
+
+    def ReversalSetForm(self, entry, form, ws=None):
+        self.__Set(WB_ReversalForm, entry, None, ws, form)
+
+    def LexiconGetFieldText(self, obj, fieldID, ws=None):
+        return self.__Get(WB_FieldText, obj, fieldID, ws)
+
+    def LexiconSetFieldText(self, obj, fieldID, text, ws=None):
+        self.__Set(WB_FieldText, obj, fieldID, ws, text)
+
+    def GetCustomFieldValue(self, obj, fieldID):
+        return self.__Get(WB_FieldInteger, obj, fieldID, None, 0)
+
+    def LexiconSetFieldInteger(self, obj, fieldID, integer):
+        self.__Set(WB_FieldInteger, obj, fieldID, None, integer)
+
+    def BuildGotoURL(self, obj):
+        return "silfw://%d" % obj.Hvo
+
+
+class FakeReport(object):
+    def __init__(self):
+        self.messages = []
+
+    def Info(self, msg, ref=None):
+        self.messages.append((msg, ref))
+
+# ------------------------------------------------------------------
+
+def test_flush():
+    project = FakeProject()
+    sense, entry = FakeObject(1), FakeObject(2)
+    wb = FTWriteBuffer(project, FakeReport(), modifyAllowed=True)
+
+    wb.SetFieldInteger(sense, "Count", 3)
+    wb.SetFieldText(sense, "Note", "note", "en")
+    wb.SetReversalForm(entry, "form", "zh")
+    wb.SetSenseGloss(sense, "gloss", "en")
+    assert len(wb) == 4
+    assert project.writes == []             # Nothing written yet
+
+    assert wb.Flush() == 4
+    assert len(wb) == 0
+    assert wb.written == 4
+    # Written grouped by kind
+    assert project.writes == [(WB_SenseGloss, 1, "gloss"),
+                              (WB_ReversalForm, 2, "form"),
+                              (WB_FieldText, 1, "note"),
+                              (WB_FieldInteger, 1, 3)]
+    assert project.LexiconGetFieldText(sense, "Note", "en") == "note"
+    assert wb.Flush() == 0
+
+def test_combined_changes():
+    project = FakeProject()
+    project.LexiconSetSenseGloss(FakeObject(1), "old", "en")
+    project.writes.clear()
+    sense = FakeObject(1)
+    wb = FTWriteBuffer(project, FakeReport(), modifyAllowed=True)
+
+    wb.SetSenseGloss(sense, "new", "en")
+    wb.SetSenseGloss(sense, "newer", "en")
+    assert len(wb) == 1
+    assert wb.PendingValue(WB_SenseGloss, sense, None, "en") == "newer"
+    # The Hvo identifies the object
+    assert wb.PendingValue(WB_SenseGloss, 1, None, "en") == "newer"
+    assert wb.Pending() == [(WB_SenseGloss, sense, None, "en", "old", "newer")]
+
+    # Back to the current value: no change
+    wb.SetSenseGloss(sense, "old", "en")
+    assert len(wb) == 0
+    assert wb.PendingValue(WB_SenseGloss, sense, None, "en") is None
+
+    # Setting the current value isn't a change either
+    wb.SetSenseGloss(sense, "old", "en")
+    assert len(wb) == 0
+    wb.Finish()
+    assert project.writes == []
+
+def test_add_tag():
+    project = FakeProject()
+    entry = FakeObject(5)
+    project.LexiconSetFieldText(entry, "Tags", "a")
+    project.writes.clear()
+    wb = FTWriteBuffer(project, FakeReport(), modifyAllowed=True)
+
+    wb.AddTagToField(entry, "Tags", "b")
+    wb.AddTagToField(entry, "Tags", "c")
+    wb.AddTagToField(entry, "Tags", "b")    # Already added
+    assert wb.PendingValue(WB_FieldText, entry, "Tags") == "a; b; c"
+    wb.Finish()
+    assert project.writes == [(WB_FieldText, 5, "a; b; c")]
+
+def test_batches():
+    project = FakeProject()
+    wb = FTWriteBuffer(project, FakeReport(), modifyAllowed=True, batchSize=3)
+    for hvo in range(1, 8):
+        wb.SetSenseGloss(FakeObject(hvo), "gloss %d" % hvo, "en")
+    # Two batches of 3 written, 1 pending
+    assert len(project.writes) == 6
+    assert len(wb) == 1
+    wb.Finish()
+    assert len(project.writes) == 7
+    assert wb.written == 7
+
+def test_modify_not_allowed():
+    project = FakeProject()
+    report = FakeReport()
+    wb = FTWriteBuffer(project, report, modifyAllowed=False, batchSize=1)
+    wb.SetSenseGloss(FakeObject(1), "gloss", "en")
+    wb.SetFieldInteger(FakeObject(2), "Count", 7)
+    assert wb.Flush() == 0
+    assert len(wb) == 2
+
+    wb.Finish(listPending=True)
+    assert project.writes == []
+    assert report.messages[0] == ("    %s (en): '' > 'gloss'" % WB_SenseGloss,
+                                  "silfw://1")
+    assert report.messages[-1] == ("  2 pending changes", None)
+
+    assert wb.Discard() == 2
+    assert len(wb) == 0
+
+def test_write_error():
+    # A change that fails to write, and the ones after it, stay pending.
+    class FailingProject(FakeProject):
+        def LexiconSetSenseGloss(self, sense, gloss, ws=None):
+            if sense.Hvo == 3:
+                raise RuntimeError("Write failed")
+            FakeProject.LexiconSetSenseGloss(self, sense, gloss, ws)
+
+    project = FailingProject()
+    wb = FTWriteBuffer(project, FakeReport(), modifyAllowed=True)
+    for hvo in range(1, 6):
+        wb.SetSenseGloss(FakeObject(hvo), "gloss %d" % hvo, "en")
+    try:
+        wb.Flush()
+    except RuntimeError:
+        pass
+    else:
+        assert False, "RuntimeError expected"
+    assert [hvo for kind, hvo, value in project.writes] == [1, 2]
+    assert wb.written == 2
+    assert len(wb) == 3
+    assert [obj.Hvo for kind, obj, fieldID, ws, old, new in wb.Pending()] == [3, 4, 5]
+    assert wb.Discard() == 3
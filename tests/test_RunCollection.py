@@ -0,0 +1,130 @@
+#
+#   Project: FlexTools
+#   Module:  test_RunCollection
+#
+#   Checks RunCollection with a fake project class in place of
+#   FLExProject, so no FieldWorks projects are needed:
+#    - the exit codes for success, errors and an unknown collection;
+#    - the report messages are tagged with the project name;
+#    - the same results when the projects are run in worker processes.
+#
+#   The flextoolslib package (and so pythonnet and FieldWorks) must be
+#   installed.
+#
+#   Run with pytest.
+#
+
+import pytest
+
+from flexlibs import FP_ProjectError
+
+from flextoolslib.code import FTModules, FTCollections
+from flextoolslib.code.FTReport import FTReporter
+from flextoolslib.misc.RunCollection import (
+    RunCollection,
+    EXIT_OK,
+    EXIT_ERRORS,
+    EXIT_USAGE,
+    )
+
+# ------------------------------------------------------------------
+
+class FakeProject(object):
+    # Projects named "bad..." can't be opened. (This class is used in the
+    # worker processes, so it must be importable by name.)
+    def OpenProject(self, projectName, writeEnabled=False):
+        if projectName.startswith("bad"):
+            raise FP_ProjectError("No such project: " + projectName)
+        self.projectName = projectName
+
+    def CloseProject(self):
+        pass
+
+    def ProjectName(self):
+        return self.projectName
+
+
+testModule = """\
+from flextoolslib import *
+
+docs = {FTM_Name       : "Hello",
+        FTM_Version    : 1,
+        FTM_ModifiesDB : False,
+        FTM_Synopsis   : "Reports the project name",
+        FTM_Description: "Reports an error for projects named 'error...'"}
+
+def MainFunction(project, report, modifyAllowed):
+    report.Info("Hello from %s" % project.ProjectName())
+    if project.ProjectName().startswith("error"):
+        report.Error("Error in %s" % project.ProjectName())
+
+FlexToolsModule = FlexToolsModuleClass(MainFunction, docs)
+"""
+
+@pytest.fixture
+def collection(tmp_path, monkeypatch):
+    # Makes a Modules and a Collections folder in tmp_path with one
+    # module and a collection that runs it. Returns the collection name.
+    # The worker processes find the folders from the current directory.
+    (tmp_path / "Modules" / "Test").mkdir(parents=True)
+    (tmp_path / "Modules" / "Test" / "Hello.py").write_text(testModule)
+    (tmp_path / "Collections").mkdir()
+    (tmp_path / "Collections" / "Nightly.ini").write_text("[Test.Hello]\n")
+
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(FTModules, "MODULES_PATH", str(tmp_path / "Modules"))
+    monkeypatch.setattr(FTModules, "MANIFEST_PATH",
+                        str(tmp_path / "flextools_modules.json"))
+    monkeypatch.setattr(FTCollections, "COLLECTIONS_PATH",
+                        str(tmp_path / "Collections"))
+    return "Nightly"
+
+
+def runCollection(collectionName, projectNames, workers=1):
+    # Returns the exit code, and the messages as {project : [messages]}
+    messages = {}
+    def writeMessage(projectName, message):
+        messages.setdefault(projectName, []).append(message)
+
+    result = RunCollection(collectionName, projectNames,
+                           writeMessage=writeMessage,
+                           workers=workers,
+                           projectClass=FakeProject)
+    return result, messages
+
+# ------------------------------------------------------------------
+
+def test_success(collection):
+    result, messages = runCollection(collection, ["A", "B"])
+    assert result == EXIT_OK
+    for projectName in ("A", "B"):
+        assert (FTReporter.INFO, "Hello from %s" % projectName, None) \
+               in messages[projectName]
+        assert not any(msgType == FTReporter.ERROR
+                       for msgType, msg, ref in messages[projectName])
+
+def test_errors(collection):
+    result, messages = runCollection(collection, ["A", "error1"])
+    assert result == EXIT_ERRORS
+    assert (FTReporter.ERROR, "Error in error1", None) in messages["error1"]
+
+    result, messages = runCollection(collection, ["bad1", "A"])
+    assert result == EXIT_ERRORS
+    assert any(msgType == FTReporter.ERROR
+               for msgType, msg, ref in messages["bad1"])
+    # The other projects are still run.
+    assert (FTReporter.INFO, "Hello from A", None) in messages["A"]
+
+def test_unknown_collection(collection):
+    result, messages = runCollection("No such collection", ["A"])
+    assert result == EXIT_USAGE
+    assert messages == {}
+
+def test_parallel(collection):
+    projectNames = ["A", "B", "error1", "bad1", "C"]
+    serialResult, serialMessages = runCollection(collection, projectNames)
+    result, messages = runCollection(collection, projectNames, workers=3)
+    assert result == serialResult == EXIT_ERRORS
+    # The messages from each project are the same, in the same order,
+    # however the projects' messages are interleaved.
+    assert messages == serialMessages